@@ -1,13 +1,48 @@
 import asyncio
+import base64
+import bisect
+import codecs
+import cProfile
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import pstats
+import queue
 import random
+import re
+import sqlite3
+import struct
+import threading
 import time
-from typing import Any, Dict, List, Optional, Tuple
+import zlib
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import BrokenExecutor, Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 import aiohttp
+from aiohttp import web
+
 from astrbot.api import logger
 from astrbot.api.event import AstrMessageEvent, filter
 from astrbot.api.star import Context, Star, register
 
+try:
+    import orjson
+except ImportError:  # 可选依赖：没有安装时使用标准库
+    orjson = None
+
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:  # 可选依赖：没有 Pillow 时排行榜退回文本
+    Image = ImageDraw = ImageFont = None
+
 
 def _now_ts() -> int:
     return int(time.time())
@@ -22,11 +57,2807 @@ def _fmt_duration(sec: int) -> str:
     return f"{m}m{s}s"
 
 
-def _safe_int(v: Any, default: int = 0) -> int:
-    try:
-        return int(v)
-    except Exception:
-        return default
+def _parse_window(text: str, default: int = 86400) -> Optional[int]:
+    """解析 "30m" / "24h" / "7d" / "7天" / "3小时" 等窗口写法，返回秒数。"""
+    text = text.strip().lower()
+    if not text:
+        return default
+    m = re.fullmatch(r"(\d+)\s*(m|min|分钟|h|小时|d|天)", text)
+    if not m:
+        return None
+    n = int(m.group(1))
+    unit = m.group(2)
+    if unit in ("m", "min", "分钟"):
+        sec = n * 60
+    elif unit in ("h", "小时"):
+        sec = n * 3600
+    else:
+        sec = n * 86400
+    if sec <= 0 or sec > HISTORY_DAY_RETENTION * 86400:
+        return None
+    return sec
+
+
+def _fmt_window(sec: int) -> str:
+    if sec % 86400 == 0:
+        return f"{sec // 86400}天"
+    if sec % 3600 == 0:
+        return f"{sec // 3600}小时"
+    return f"{sec // 60}分钟"
+
+
+def _safe_int(v: Any, default: int = 0) -> int:
+    try:
+        return int(v)
+    except Exception:
+        return default
+
+
+def _safe_float(v: Any, default: float = 0.0) -> float:
+    try:
+        return float(v or 0.0)
+    except Exception:
+        return default
+
+
+def _acc_key(acc: Dict[str, Any]) -> str:
+    return str(acc.get("id") or f"gid-{acc.get('gid')}")
+
+
+def _json_loads(data: Union[str, bytes]) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json_dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+# AccountRecord 实际读取的字段，其余（recentLogs/latestLog/proxy 等）在解析时丢弃
+DASHBOARD_ACCOUNT_FIELDS = (
+    "id", "gid", "name", "qqNumber", "platform", "status", "statusReason",
+    "level", "runtimeSec", "gold", "exp", "income",
+)
+DASHBOARD_CARD_FIELDS = ("id", "code", "creatorId")
+
+
+def _prune_account(acc: Any) -> Any:
+    if not isinstance(acc, dict):
+        return acc
+    return {k: acc[k] for k in DASHBOARD_ACCOUNT_FIELDS if k in acc}
+
+
+def _prune_card(card: Any) -> Any:
+    if not isinstance(card, dict):
+        return card
+    out = {k: card[k] for k in DASHBOARD_CARD_FIELDS if k in card}
+    out["accounts"] = [_prune_account(a) for a in card.get("accounts") or []]
+    return out
+
+
+def prune_dashboard(data: Dict[str, Any]) -> Dict[str, Any]:
+    """整份 dashboard 只保留插件用到的字段（WebSocket 快照等非流式来源使用）。"""
+    out = {k: v for k, v in data.items() if k not in ("cards", "unboundAccounts")}
+    out["cards"] = [_prune_card(c) for c in data.get("cards") or []]
+    out["unboundAccounts"] = [_prune_account(a) for a in data.get("unboundAccounts") or []]
+    return out
+
+
+class _NeedMore(Exception):
+    pass
+
+
+class DashboardStreamParser:
+    """/dashboard 响应的增量解析：按块喂入，逐张卡片/逐个账号解码后立即裁剪字段。
+
+    只在 {"ok":..,"data":{"cards":[..],"unboundAccounts":[..],..}} 这几层手工导航，
+    每个元素交给标准库的 C 扫描器 raw_decode，已消费的文本随时丢弃，
+    峰值内存约为一个分块加裁剪后的结果。
+    """
+
+    _WS = " \t\n\r"
+    _STREAMED = {"cards": _prune_card, "unboundAccounts": _prune_account}
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._pos = 0
+        self._final = False
+        # 导航状态机：root_* 为顶层对象，data_* 为 data 对象，items_* 为 cards/unboundAccounts 数组
+        self._state = "root_open"
+        self._key = ""
+        self.result: Dict[str, Any] = {}
+        self._data: Dict[str, Any] = {}
+        self._items: List[Any] = []
+        self._prune: Optional[Callable[[Any], Any]] = None
+
+    def feed(self, chunk: bytes) -> None:
+        self._buf += self._utf8.decode(chunk)
+        self._run()
+
+    def close(self) -> Dict[str, Any]:
+        self._buf += self._utf8.decode(b"", final=True)
+        self._final = True
+        self._run()
+        if self._state != "done":
+            raise ValueError(f"truncated dashboard payload (state={self._state})")
+        return self.result
+
+    def _run(self) -> None:
+        try:
+            while self._state != "done":
+                start = self._pos
+                try:
+                    self._step()
+                except _NeedMore:
+                    # 每一步要么完整执行，要么回到起点等下一块
+                    self._pos = start
+                    raise
+        except _NeedMore:
+            if self._final:
+                raise ValueError(f"truncated dashboard payload (state={self._state})")
+        # 丢弃已消费的前缀，避免缓冲区随响应体增长
+        if self._pos > 65536 or self._pos * 2 > len(self._buf):
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+
+    def _peek(self) -> str:
+        buf = self._buf
+        pos = self._pos
+        n = len(buf)
+        while pos < n and buf[pos] in self._WS:
+            pos += 1
+        self._pos = pos
+        if pos >= n:
+            raise _NeedMore()
+        return buf[pos]
+
+    def _expect(self, ch: str) -> None:
+        if self._peek() != ch:
+            raise ValueError(f"unexpected {self._buf[self._pos]!r} at dashboard offset, expected {ch!r}")
+        self._pos += 1
+
+    def _value(self) -> Any:
+        self._peek()
+        try:
+            value, end = self._decoder.raw_decode(self._buf, self._pos)
+        except json.JSONDecodeError:
+            if self._final:
+                raise
+            raise _NeedMore()
+        # 数字/字面量可能被分块截断（"12" 之后还有 "3"），缓冲区末尾的值要等下一块确认
+        if end >= len(self._buf) and not self._final:
+            raise _NeedMore()
+        self._pos = end
+        return value
+
+    def _string(self) -> str:
+        if self._peek() != '"':
+            raise ValueError("expected object key in dashboard payload")
+        try:
+            key, end = json.decoder.scanstring(self._buf, self._pos + 1)
+        except json.JSONDecodeError:
+            if self._final:
+                raise
+            raise _NeedMore()
+        self._pos = end
+        return key
+
+    def _step(self) -> None:
+        st = self._state
+        if st == "root_open":
+            self._expect("{")
+            self._state = "root_key"
+        elif st in ("root_key", "data_key"):
+            if self._peek() == "}":
+                self._pos += 1
+                self._state = "root_next" if st == "data_key" else "done"
+                return
+            key = self._string()
+            self._expect(":")
+            self._key = key
+            if st == "root_key" and key == "data" and self._peek() == "{":
+                self._pos += 1
+                self._data = self.result["data"] = {}
+                self._state = "data_key"
+            elif st == "data_key" and key in self._STREAMED and self._peek() == "[":
+                self._pos += 1
+                self._items = self._data[key] = []
+                self._prune = self._STREAMED[key]
+                self._state = "items_first"
+            else:
+                (self.result if st == "root_key" else self._data)[key] = self._value()
+                self._state = "root_next" if st == "root_key" else "data_next"
+        elif st in ("root_next", "data_next"):
+            ch = self._peek()
+            self._pos += 1
+            if ch == ",":
+                self._state = "root_key" if st == "root_next" else "data_key"
+            elif ch == "}":
+                self._state = "done" if st == "root_next" else "root_next"
+            else:
+                raise ValueError(f"unexpected {ch!r} in dashboard payload")
+        elif st in ("items_first", "items_next"):
+            ch = self._peek()
+            if ch == "]":
+                self._pos += 1
+                self._state = "data_next"
+            elif st == "items_next":
+                self._expect(",")
+                self._state = "items_first"
+            else:
+                self._items.append(self._prune(self._value()))
+                self._state = "items_next"
+
+
+def decode_dashboard_body(body: bytes, stream: bool = True) -> Any:
+    """解析完整的 /dashboard 响应体并裁剪字段；snapshotExecutor 开启时在工作线程/进程中调用。"""
+    if not stream:
+        js = _json_loads(body)
+        if isinstance(js, dict) and isinstance(js.get("data"), dict):
+            js["data"] = prune_dashboard(js["data"])
+        return js
+    # 线程模式下分块的逐元素解码会频繁让出 GIL，整段 json.loads 则会一直占住
+    parser = DashboardStreamParser()
+    view = memoryview(body)
+    for i in range(0, len(body), DASHBOARD_CHUNK_SIZE):
+        parser.feed(bytes(view[i:i + DASHBOARD_CHUNK_SIZE]))
+    return parser.close()
+
+
+def decode_ws_frame(data: Union[str, bytes]) -> Dict[str, Any]:
+    """解析 WebSocket 帧；快照帧只保留裁剪后的 dashboard。"""
+    frame = _json_loads(data)
+    if not isinstance(frame, dict):
+        return {}
+    if frame.get("type") == "snapshot":
+        dashboard = (frame.get("data") or {}).get("dashboard")
+        frame["data"] = {"dashboard": prune_dashboard(dashboard) if isinstance(dashboard, dict) else None}
+    return frame
+
+
+class AccountRecord:
+    """Dashboard 账号视图的精简版本，数值字段在建索引时一次性解析。"""
+
+    __slots__ = (
+        "key", "id", "gid", "name", "qq", "platform", "status", "reason",
+        "level", "runtime_sec", "gold", "exp", "gold_gain", "exp_gain",
+        "card_code", "creator_id", "display", "backend",
+    )
+
+    def __init__(self, acc: Dict[str, Any], card: Optional[Dict[str, Any]] = None, backend: str = ""):
+        income = acc.get("income") or {}
+        # 多后台时 id 可能重复，key 带上后台名；主后台保持原 key 以兼容已持久化的状态
+        self.key = f"{backend}:{_acc_key(acc)}" if backend else _acc_key(acc)
+        self.backend = backend
+        self.id = str(acc.get("id") or "")
+        self.gid = _safe_int(acc.get("gid"), 0)
+        self.name = str(acc.get("name") or "")
+        self.qq = str(acc.get("qqNumber") or "").strip()
+        self.platform = str(acc.get("platform") or "qq")
+        self.status = str(acc.get("status") or "")
+        self.reason = str(acc.get("statusReason") or "").strip()
+        self.level = _safe_int(acc.get("level"), 0)
+        self.runtime_sec = _safe_int(acc.get("runtimeSec"), 0)
+        self.gold = _safe_float(acc.get("gold"))
+        self.exp = _safe_float(acc.get("exp"))
+        self.gold_gain = _safe_float(income.get("gold"))
+        self.exp_gain = _safe_float(income.get("exp"))
+        self.card_code = str(card.get("code") or "") if card else ""
+        self.creator_id = str(card.get("creatorId") or "") if card else ""
+        name = self.name or "未知账号"
+        self.display = f"{name}(QQ:{self.qq})" if self.qq else f"{name}(GID:{self.gid})"
+
+    @property
+    def online(self) -> bool:
+        return self.status == "online"
+
+    # fingerprint 的前 ALERT_FIELDS 项决定告警；其余只影响榜单（runtimeSec 对在线账号每秒都变）
+    ALERT_FIELDS = 4
+
+    def fingerprint(self) -> Tuple:
+        return (
+            self.status, self.reason, self.card_code, self.creator_id,
+            self.level, self.runtime_sec, self.gold_gain, self.exp_gain, self.name, self.qq,
+        )
+
+
+class AccountIndex:
+    """每个 dashboard 快照只构建一次的账号索引：单次遍历，按 id/gid/QQ 与状态分桶。"""
+
+    __slots__ = ("records", "online", "by_key", "by_gid", "by_qq", "by_status", "bound_count")
+
+    def __init__(self, dashboard: Optional[Dict[str, Any]]):
+        self.records: List[AccountRecord] = []
+        self.online: List[AccountRecord] = []
+        self.by_key: Dict[str, AccountRecord] = {}
+        self.by_gid: Dict[int, AccountRecord] = {}
+        self.by_qq: Dict[str, AccountRecord] = {}
+        self.by_status: Dict[str, List[AccountRecord]] = {}
+        self.bound_count = 0
+        if not dashboard:
+            return
+        # 多后台合并快照：{"shards": [(后台名, dashboard), ...]}
+        shards = dashboard.get("shards")
+        if shards is None:
+            shards = [("", dashboard)]
+        for backend, data in shards:
+            # 1. Card bound accounts
+            for card in data.get("cards") or []:
+                for acc in card.get("accounts") or []:
+                    self._add(AccountRecord(acc, card, backend))
+                    self.bound_count += 1
+            # 2. Unbound accounts
+            for acc in data.get("unboundAccounts") or []:
+                self._add(AccountRecord(acc, None, backend))
+
+    def _add(self, rec: AccountRecord) -> None:
+        self.records.append(rec)
+        self.by_key[rec.key] = rec
+        if rec.gid > 0:
+            self.by_gid[rec.gid] = rec
+        if rec.qq:
+            self.by_qq[rec.qq] = rec
+        bucket = self.by_status.get(rec.status)
+        if bucket is None:
+            bucket = self.by_status[rec.status] = []
+        bucket.append(rec)
+        if rec.online:
+            self.online.append(rec)
+
+
+class SnapshotDelta:
+    """一次快照的索引与指纹比对结果；可以在工作线程中生成，再回到事件循环一次性应用。"""
+
+    __slots__ = ("index", "fingerprints", "changed", "alert_changed", "removed", "status_changes")
+
+    def __init__(
+        self,
+        index: AccountIndex,
+        fingerprints: Dict[str, Tuple],
+        changed: List[AccountRecord],
+        removed: List[str],
+        status_changes: int = 0,
+        alert_changed: Optional[List[AccountRecord]] = None,
+    ):
+        self.index = index
+        self.fingerprints = fingerprints
+        # changed：任一字段变化，交给榜单/分片/历史；alert_changed：新出现或告警字段变化，交给告警
+        self.changed = changed
+        self.alert_changed = changed if alert_changed is None else alert_changed
+        self.removed = removed
+        # 已有账号中 status/statusReason 变化的个数（收益等数值变化不算），供轮询节奏参考
+        self.status_changes = status_changes
+
+
+def build_snapshot_delta(
+    dashboard: Optional[Dict[str, Any]], prev: Dict[str, Tuple], index: Optional[AccountIndex] = None
+) -> SnapshotDelta:
+    """建索引并与上一轮指纹比对；只读 dashboard 和 prev，不触碰插件状态。"""
+    if index is None:
+        index = AccountIndex(dashboard)
+    curr: Dict[str, Tuple] = {}
+    changed: List[AccountRecord] = []
+    alert_changed: List[AccountRecord] = []
+    added = 0
+    status_changes = 0
+    n = AccountRecord.ALERT_FIELDS
+    for rec in index.records:
+        fp = rec.fingerprint()
+        curr[rec.key] = fp
+        old_fp = prev.get(rec.key)
+        if old_fp != fp:
+            changed.append(rec)
+            if old_fp is None:
+                added += 1
+                alert_changed.append(rec)
+            elif old_fp[:n] != fp[:n]:
+                alert_changed.append(rec)
+                if old_fp[0] != fp[0] or old_fp[1] != fp[1]:
+                    status_changes += 1
+    removed: List[str] = []
+    if len(curr) - added != len(prev):
+        removed = [k for k in prev if k not in curr]
+    return SnapshotDelta(index, curr, changed, removed, status_changes, alert_changed)
+
+
+class RenderCache:
+    """排行榜文本缓存：按 (榜单名, 范围, 快照版本) 存放，带 TTL 与 LRU 容量上限。"""
+
+    def __init__(self, ttl_sec: float = 5.0, max_size: int = 64):
+        self.ttl_sec = ttl_sec
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._items: "OrderedDict[Tuple, Tuple[float, str]]" = OrderedDict()
+
+    def get(self, key: Tuple) -> Optional[str]:
+        item = self._items.get(key)
+        if item is None or item[0] < time.time():
+            if item is not None:
+                del self._items[key]
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def put(self, key: Tuple, text: str) -> None:
+        self._items[key] = (time.time() + self.ttl_sec, text)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate_per_sec: float, capacity: float):
+        self.rate = rate_per_sec
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """取一个令牌；不足时返回需要等待的秒数（不扣除）。"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class OutboundDispatcher:
+    """群消息发送队列：每群令牌桶限速、跨群并发上限、告警合并与失败重试。"""
+
+    def __init__(
+        self, send: Callable[[int, str], Awaitable[None]], ready: Optional[Callable[[int], Awaitable[None]]] = None
+    ):
+        self._send = send
+        # 发送前的额外等待（如 bot 发送额度），在占用并发名额之前执行
+        self._ready = ready
+        self.concurrency = 3
+        self.rate_per_min = 20.0
+        self.burst = 5
+        self.merge_window_sec = 3.0
+        self.digest_max = 20
+        self.max_retries = 3
+        self._sem = asyncio.Semaphore(self.concurrency)
+        self._queues: Dict[int, Deque[Tuple[str, float, bool]]] = {}
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        self._latencies: Deque[float] = deque(maxlen=256)
+        self.stats: Dict[str, int] = {"sent": 0, "failed": 0, "retries": 0, "merged": 0}
+
+    def configure(self, cfg: Dict[str, Any]) -> None:
+        concurrency = max(1, _safe_int(cfg.get("sendConcurrency"), 3))
+        if concurrency != self.concurrency:
+            self.concurrency = concurrency
+            self._sem = asyncio.Semaphore(concurrency)
+        rate = max(1.0, _safe_float(cfg.get("groupRatePerMin"), 20.0))
+        burst = max(1, _safe_int(cfg.get("groupBurst"), 5))
+        if rate != self.rate_per_min or burst != self.burst:
+            self.rate_per_min = rate
+            self.burst = burst
+            self._buckets.clear()
+        self.merge_window_sec = max(0.0, _safe_float(cfg.get("alertMergeWindowSec"), 3.0))
+        self.max_retries = max(0, _safe_int(cfg.get("sendMaxRetries"), 3))
+
+    def submit(self, group_id: int, text: str, merge: bool = False) -> None:
+        q = self._queues.get(group_id)
+        if q is None:
+            q = self._queues[group_id] = deque()
+        q.append((text, time.monotonic(), merge))
+        worker = self._workers.get(group_id)
+        if worker is None or worker.done():
+            self._workers[group_id] = asyncio.ensure_future(self._drain(group_id))
+
+    @property
+    def depth(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def latency_ms(self) -> Tuple[float, float]:
+        if not self._latencies:
+            return 0.0, 0.0
+        rows = sorted(self._latencies)
+        avg = sum(rows) / len(rows)
+        p95 = rows[min(len(rows) - 1, int(len(rows) * 0.95))]
+        return avg * 1000, p95 * 1000
+
+    async def _drain(self, group_id: int) -> None:
+        q = self._queues[group_id]
+        while q:
+            text, queued_at, merge = q.popleft()
+            if merge:
+                # 合并窗口内到达的同群告警一起发送
+                wait = queued_at + self.merge_window_sec - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                parts = [text]
+                while q and q[0][2] and len(parts) < self.digest_max:
+                    parts.append(q.popleft()[0])
+                if len(parts) > 1:
+                    self.stats["merged"] += len(parts) - 1
+                    text = f"📋 告警汇总（{len(parts)}条）\n\n" + "\n\n".join(parts)
+            await self._wait_token(group_id)
+            await self._send_with_retry(group_id, text)
+            self._latencies.append(time.monotonic() - queued_at)
+        self._queues.pop(group_id, None)
+        self._workers.pop(group_id, None)
+
+    async def _wait_token(self, group_id: int) -> None:
+        bucket = self._buckets.get(group_id)
+        if bucket is None:
+            bucket = self._buckets[group_id] = TokenBucket(self.rate_per_min / 60.0, self.burst)
+        while True:
+            delay = bucket.take()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    async def _send_with_retry(self, group_id: int, text: str) -> None:
+        delay = 1.0
+        for attempt in range(self.max_retries + 1):
+            # 等额度和重试退避都不占并发名额
+            if self._ready is not None:
+                await self._ready(group_id)
+            try:
+                async with self._sem:
+                    await self._send(group_id, text)
+                self.stats["sent"] += 1
+                return
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    self.stats["failed"] += 1
+                    logger.error(f"[FarmRankBot] send_group_msg to {group_id} failed after {attempt + 1} tries: {e}")
+                    return
+                self.stats["retries"] += 1
+                await asyncio.sleep(delay + random.uniform(0, delay / 2))
+                delay = min(30.0, delay * 2)
+
+    async def close(self) -> None:
+        for task in list(self._workers.values()):
+            task.cancel()
+        self._workers.clear()
+        self._queues.clear()
+
+
+BOT_RING_VNODES = 64
+# 每个 bot 的发送额度（条/分钟）；0 为不限，只受每群限速约束
+BOT_RATE_PER_MIN = 0
+BOT_BURST = 10
+BOT_FAIL_THRESHOLD = 3
+BOT_COOLDOWN_SEC = 60
+BOT_REFRESH_SEC = 30
+
+
+def _ring_hash(text: str) -> int:
+    return int.from_bytes(hashlib.md5(text.encode()).digest()[:8], "big")
+
+
+class BotSlot:
+    __slots__ = ("key", "bot", "bucket", "sent", "failed", "took_over", "fails", "down_until", "bad_groups", "send_sec")
+
+    def __init__(self, key: str, bot: Any, bucket: Optional[TokenBucket]):
+        self.key = key
+        self.bot = bot
+        self.bucket = bucket
+        self.sent = 0
+        self.failed = 0
+        self.took_over = 0
+        self.fails = 0
+        self.down_until = 0.0
+        # 在某个群发送失败（常见原因：该账号不在群里）后，冷却期内不再用它发这个群
+        self.bad_groups: Dict[int, float] = {}
+        self.send_sec = 0.0
+
+    def usable(self, group_id: int, now: float) -> bool:
+        if self.bot is None or self.down_until > now:
+            return False
+        if not self.bad_groups:
+            return True
+        until = self.bad_groups.get(group_id)
+        if until is None:
+            return True
+        if until > now:
+            return False
+        del self.bad_groups[group_id]
+        return True
+
+
+class BotPool:
+    """多个 bot 账号分担群消息：一致性哈希把群固定到 bot，每个 bot 各自的令牌桶限额，出错或消失时顺延到环上的下一个。"""
+
+    def __init__(self, discover: Callable[[], List[Tuple[str, Any]]], send: Callable[[Any, int, str], Awaitable[None]]):
+        self._discover = discover
+        self._send = send
+        self.rate_per_min = float(BOT_RATE_PER_MIN)
+        self.burst = BOT_BURST
+        self.fail_threshold = BOT_FAIL_THRESHOLD
+        self.cooldown_sec = float(BOT_COOLDOWN_SEC)
+        self.slots: Dict[str, BotSlot] = {}
+        # wait_budget 为群预留的 bot（已扣令牌）；同一个群的消息串行发送，不会互相覆盖
+        self._reserved: Dict[int, BotSlot] = {}
+        self._ring: List[int] = []
+        self._ring_keys: List[str] = []
+        self._members = 0
+        self._refreshed = 0.0
+        self.stats: Dict[str, int] = {"failovers": 0, "spills": 0, "waits": 0}
+
+    def configure(self, cfg: Dict[str, Any]) -> None:
+        rate = max(0.0, _safe_float(cfg.get("botRatePerMin", BOT_RATE_PER_MIN), BOT_RATE_PER_MIN))
+        burst = max(1, _safe_int(cfg.get("botBurst", BOT_BURST), BOT_BURST))
+        if rate != self.rate_per_min or burst != self.burst:
+            self.rate_per_min = rate
+            self.burst = burst
+            for slot in self.slots.values():
+                slot.bucket = self._bucket()
+        self.fail_threshold = max(1, _safe_int(cfg.get("botFailThreshold", BOT_FAIL_THRESHOLD), BOT_FAIL_THRESHOLD))
+        self.cooldown_sec = max(1.0, _safe_float(cfg.get("botCooldownSec", BOT_COOLDOWN_SEC), BOT_COOLDOWN_SEC))
+
+    def _bucket(self) -> Optional[TokenBucket]:
+        if self.rate_per_min <= 0:
+            return None
+        return TokenBucket(self.rate_per_min / 60.0, self.burst)
+
+    @property
+    def live(self) -> List[BotSlot]:
+        return [s for s in self.slots.values() if s.bot is not None]
+
+    def refresh(self, force: bool = False) -> None:
+        """重新收集 bot 列表；消失的 bot 保留统计但移出哈希环。"""
+        now = time.monotonic()
+        if not force and now - self._refreshed < BOT_REFRESH_SEC:
+            return
+        self._refreshed = now
+        try:
+            found = self._discover()
+        except Exception as e:
+            logger.warning(f"[FarmRankBot] bot discovery failed: {e}")
+            return
+        seen = set()
+        for key, bot in found:
+            seen.add(key)
+            slot = self.slots.get(key)
+            if slot is None:
+                self.slots[key] = BotSlot(key, bot, self._bucket())
+                logger.info(f"[FarmRankBot] Bot joined send pool: {key}")
+            elif slot.bot is not bot:
+                if slot.bot is None:
+                    logger.info(f"[FarmRankBot] Bot back in send pool: {key}")
+                slot.bot = bot
+        for slot in self.slots.values():
+            if slot.key not in seen and slot.bot is not None:
+                slot.bot = None
+                logger.warning(f"[FarmRankBot] Bot left send pool: {slot.key}")
+        keys = sorted(s.key for s in self.live)
+        if len(keys) != self._members or keys != sorted(set(self._ring_keys)):
+            self._members = len(keys)
+            points = sorted((_ring_hash(f"{k}#{i}"), k) for k in keys for i in range(BOT_RING_VNODES))
+            self._ring = [h for h, _ in points]
+            self._ring_keys = [k for _, k in points]
+
+    def candidates(self, group_id: int) -> List[BotSlot]:
+        """从群在环上的位置顺时针取各 bot，第一个就是该群的固定发送者。"""
+        if not self._ring:
+            return []
+        start = bisect.bisect(self._ring, _ring_hash(str(group_id)))
+        out: List[BotSlot] = []
+        seen = set()
+        n = len(self._ring_keys)
+        for i in range(n):
+            key = self._ring_keys[(start + i) % n]
+            if key not in seen:
+                seen.add(key)
+                out.append(self.slots[key])
+                if len(out) == self._members:
+                    break
+        return out
+
+    def owner(self, group_id: int) -> Optional[str]:
+        order = self.candidates(group_id)
+        return order[0].key if order else None
+
+    def _usable(self, order: List[BotSlot], group_id: int, tried: set) -> List[BotSlot]:
+        now = time.monotonic()
+        usable = [s for s in order if s.key not in tried and s.usable(group_id, now)]
+        if not usable:
+            # 全部冷却中时仍然试一次最靠前的，避免消息全部丢弃
+            usable = [s for s in order if s.key not in tried and s.bot is not None][:1]
+        return usable
+
+    async def wait_budget(self, group_id: int) -> None:
+        """配置了每 bot 额度时，在占用发送并发名额之前等到有 bot 有额度，并为该群预留这个令牌。"""
+        if self.rate_per_min <= 0:
+            return
+        self.refresh(force=not self._ring)
+        while True:
+            wait = 0.0
+            for s in self._usable(self.candidates(group_id), group_id, set()):
+                delay = s.bucket.take() if s.bucket is not None else 0.0
+                if delay <= 0:
+                    self._reserved[group_id] = s
+                    return
+                wait = delay if not wait else min(wait, delay)
+            if not wait:
+                # 没有可用的 bot，交给 send 报错
+                return
+            self.stats["waits"] += 1
+            await asyncio.sleep(wait)
+
+    async def send(self, group_id: int, text: str) -> None:
+        """用 wait_budget 预留的 bot 发送（未配置额度时为固定发送者）；出错时立即顺延给环上下一个有额度的 bot，
+        这里不等待额度，都没有额度时抛错交给发送队列重试。"""
+        reserved = self._reserved.pop(group_id, None)
+        self.refresh(force=not self._ring)
+        order = self.candidates(group_id)
+        if not order:
+            raise RuntimeError("bot instance missing (no bot in send pool)")
+        tried: set = set()
+        last_error: Optional[Exception] = None
+        while True:
+            usable = self._usable(order, group_id, tried)
+            if not usable:
+                raise last_error or RuntimeError(f"no bot could send to group {group_id}")
+            slot = None
+            if reserved is not None and reserved in usable:
+                slot = reserved
+            else:
+                for s in usable:
+                    if s.bucket is None or s.bucket.take() <= 0:
+                        slot = s
+                        break
+            reserved = None
+            if slot is None:
+                raise last_error or RuntimeError(f"send budget of every bot exhausted for group {group_id}")
+            now = time.monotonic()
+            started = time.perf_counter()
+            try:
+                await self._send(slot.bot, group_id, text)
+            except Exception as e:
+                last_error = e
+                tried.add(slot.key)
+                slot.failed += 1
+                slot.fails += 1
+                slot.bad_groups[group_id] = time.monotonic() + self.cooldown_sec
+                if slot.fails >= self.fail_threshold and slot.down_until <= now:
+                    slot.down_until = time.monotonic() + self.cooldown_sec
+                    logger.warning(f"[FarmRankBot] Bot {slot.key} failed {slot.fails} sends in a row, cooling down {self.cooldown_sec:.0f}s: {e}")
+                continue
+            slot.send_sec += time.perf_counter() - started
+            slot.sent += 1
+            slot.fails = 0
+            slot.down_until = 0.0
+            slot.bad_groups.pop(group_id, None)
+            if slot is not order[0]:
+                slot.took_over += 1
+                self.stats["failovers" if tried or not order[0].usable(group_id, now) else "spills"] += 1
+            return
+
+
+METRIC_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+class Histogram:
+    """固定分桶直方图：observe 只做一次二分查找和三次加法。"""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...] = METRIC_BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other: "Histogram") -> None:
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q: float) -> float:
+        """按桶内线性插值估算分位数（与 Prometheus histogram_quantile 一致）。"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            if c and seen + c >= rank:
+                lo = self.bounds[i - 1] if i > 0 else 0.0
+                if i >= len(self.bounds):
+                    return lo
+                return lo + (self.bounds[i] - lo) * (rank - seen) / c
+            seen += c
+        return self.bounds[-1]
+
+
+def _fmt_value(v: float) -> str:
+    v = float(v)
+    return str(int(v)) if v.is_integer() else repr(v)
+
+
+def _label_key(labels: Dict[str, Any]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape_label(value: str) -> str:
+    # Prometheus 文本格式：标签值中的反斜杠、双引号和换行必须转义（后台名、请求路径来自配置）
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(labels: Iterable[Tuple[str, str]], extra: str = "") -> str:
+    parts = [f'{k}="{_escape_label(v)}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Metrics:
+    """进程内指标：计数器、直方图与抓取时计算的值，可渲染为 Prometheus 文本格式。
+
+    collector 给出的值默认是 gauge；以 _total 结尾的是只增不减的累计值，按 counter 导出。
+    """
+
+    def __init__(self):
+        self.counters: Dict[str, Dict[Tuple[Tuple[str, str], ...], float]] = {}
+        self.histograms: Dict[str, Dict[Tuple[Tuple[str, str], ...], Histogram]] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, Dict[str, Any], float]]]] = []
+
+    def inc(self, name: str, value: float = 1.0, **labels: Any) -> None:
+        series = self.counters.get(name)
+        if series is None:
+            series = self.counters[name] = {}
+        key = _label_key(labels)
+        series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        series = self.histograms.get(name)
+        if series is None:
+            series = self.histograms[name] = {}
+        key = _label_key(labels)
+        hist = series.get(key)
+        if hist is None:
+            hist = series[key] = Histogram()
+        hist.observe(value)
+
+    def histogram(self, name: str, **labels: Any) -> Histogram:
+        """返回匹配标签的合并直方图（未指定的标签全部合并）。"""
+        out = Histogram()
+        want = set(_label_key(labels))
+        for key, hist in (self.histograms.get(name) or {}).items():
+            if want <= set(key):
+                out.merge(hist)
+        return out
+
+    def label_values(self, name: str, label: str) -> List[str]:
+        values: List[str] = []
+        for key in self.histograms.get(name) or {}:
+            for k, v in key:
+                if k == label and v not in values:
+                    values.append(v)
+        return values
+
+    def add_collector(self, fn: Callable[[], Iterable[Tuple[str, Dict[str, Any], float]]]) -> None:
+        self._collectors.append(fn)
+
+    def render_prometheus(self) -> str:
+        lines: List[str] = []
+        for name, series in sorted(self.counters.items()):
+            lines.append(f"# TYPE {name} counter")
+            for key, value in series.items():
+                lines.append(f"{name}{_fmt_labels(key)} {_fmt_value(value)}")
+        for name, series in sorted(self.histograms.items()):
+            lines.append(f"# TYPE {name} histogram")
+            for key, hist in series.items():
+                cumulative = 0
+                for bound, c in zip(hist.bounds, hist.counts):
+                    cumulative += c
+                    le = 'le="%g"' % bound
+                    lines.append(f"{name}_bucket{_fmt_labels(key, le)} {cumulative}")
+                le = 'le="+Inf"'
+                lines.append(f"{name}_bucket{_fmt_labels(key, le)} {hist.count}")
+                lines.append(f"{name}_sum{_fmt_labels(key)} {_fmt_value(hist.sum)}")
+                lines.append(f"{name}_count{_fmt_labels(key)} {hist.count}")
+        gauges: Dict[str, List[str]] = {}
+        for collect in self._collectors:
+            try:
+                for name, labels, value in collect():
+                    gauges.setdefault(name, []).append(f"{name}{_fmt_labels(_label_key(labels))} {_fmt_value(value)}")
+            except Exception as e:
+                logger.error(f"[FarmRankBot] metrics collector failed: {e}")
+        for name, rows in sorted(gauges.items()):
+            lines.append(f"# TYPE {name} {'counter' if name.endswith('_total') else 'gauge'}")
+            lines.extend(rows)
+        return "\n".join(lines) + "\n"
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        return 0
+
+
+class ScheduledJob:
+    __slots__ = (
+        "name", "func", "interval", "jitter", "timeout", "enabled", "running", "wake_event",
+        "last_duration", "lag", "runs", "skips", "errors", "timeouts", "started_at", "rescheduled",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[], Awaitable[Any]],
+        interval: Callable[[], float],
+        jitter: float,
+        timeout: float,
+        enabled: Optional[Callable[[], bool]],
+    ):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        self.timeout = timeout
+        self.enabled = enabled
+        self.running = False
+        self.wake_event = asyncio.Event()
+        self.last_duration = 0.0
+        self.lag = 0.0
+        self.runs = 0
+        self.skips = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.started_at = 0.0
+        self.rescheduled = False
+
+
+class JobScheduler:
+    """各任务独立节奏并发运行：自带抖动、超时，上一次未结束则跳过本次。"""
+
+    def __init__(self, metrics: Optional[Metrics] = None):
+        self.jobs: Dict[str, ScheduledJob] = {}
+        self._tasks: List[asyncio.Task] = []
+        # 正在执行的任务本体；stop 时一并取消并等待结束
+        self._inflight: set = set()
+        self._running = False
+        self.metrics = metrics
+
+    def add(
+        self,
+        name: str,
+        func: Callable[[], Awaitable[Any]],
+        interval: Callable[[], float],
+        jitter: float = 0.0,
+        timeout: float = 30.0,
+        enabled: Optional[Callable[[], bool]] = None,
+    ) -> None:
+        self.jobs[name] = ScheduledJob(name, func, interval, jitter, timeout, enabled)
+
+    def wake(self, name: str, min_interval: float = 0.0) -> None:
+        """让任务提前执行一次（如收到 WebSocket 推送）；距上次开始不足 min_interval 秒时不唤醒。"""
+        job = self.jobs.get(name)
+        if job is None:
+            return
+        if min_interval > 0 and (job.running or time.monotonic() - job.started_at < min_interval):
+            return
+        job.wake_event.set()
+
+    def reschedule(self, name: str) -> None:
+        """间隔缩短后按新间隔（从上次开始执行算起）重新计算下次执行时间，不立即执行。"""
+        job = self.jobs.get(name)
+        if job is not None:
+            job.rescheduled = True
+            job.wake_event.set()
+
+    async def run(self) -> None:
+        self._running = True
+        self._tasks = [asyncio.ensure_future(self._loop(job)) for job in self.jobs.values()]
+        try:
+            await asyncio.gather(*self._tasks)
+        except asyncio.CancelledError:
+            pass
+
+    async def stop(self) -> None:
+        """停止调度并取消、等待正在执行的任务，之后才能安全地关闭它们用到的资源。"""
+        self._running = False
+        tasks = list(self._tasks) + list(self._inflight)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _loop(self, job: ScheduledJob) -> None:
+        next_at = time.monotonic() + random.uniform(0, job.jitter)
+        while self._running:
+            wait = next_at - time.monotonic()
+            woken = False
+            if wait > 0:
+                try:
+                    await asyncio.wait_for(job.wake_event.wait(), timeout=wait)
+                    woken = True
+                except asyncio.TimeoutError:
+                    pass
+            job.wake_event.clear()
+            now = time.monotonic()
+            if job.rescheduled:
+                job.rescheduled = False
+                next_at = min(next_at, job.started_at + max(0.1, float(job.interval())))
+                if next_at > now:
+                    continue
+                woken = False
+            job.lag = 0.0 if woken else max(0.0, now - next_at)
+            if self.metrics is not None:
+                self.metrics.observe("farm_job_lag_ms", job.lag * 1000, job=job.name)
+            interval = max(0.1, float(job.interval()))
+            if job.enabled is not None and not job.enabled():
+                next_at = now + min(interval, 5.0)
+                continue
+            next_at = now + interval + random.uniform(0, job.jitter)
+            if job.running:
+                job.skips += 1
+                continue
+            job.started_at = now
+            task = asyncio.ensure_future(self._execute(job))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _execute(self, job: ScheduledJob) -> None:
+        job.running = True
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(job.func(), timeout=job.timeout)
+        except asyncio.TimeoutError:
+            job.timeouts += 1
+            logger.warning(f"[FarmRankBot] job {job.name} timed out after {job.timeout}s")
+            if self.metrics is not None:
+                self.metrics.inc("farm_job_failures_total", job=job.name, kind="timeout")
+        except Exception as e:
+            job.errors += 1
+            logger.error(f"[FarmRankBot] job {job.name} error: {e}")
+            if self.metrics is not None:
+                self.metrics.inc("farm_job_failures_total", job=job.name, kind="error")
+        finally:
+            job.runs += 1
+            job.last_duration = time.monotonic() - started
+            job.running = False
+            if self.metrics is not None:
+                self.metrics.observe("farm_job_duration_ms", job.last_duration * 1000, job=job.name)
+
+    def stats_text(self) -> str:
+        lines = []
+        for job in self.jobs.values():
+            lines.append(
+                f"- {job.name}: 耗时{job.last_duration * 1000:.0f}ms · 延迟{job.lag * 1000:.0f}ms · "
+                f"运行{job.runs} · 跳过{job.skips} · 超时{job.timeouts} · 错误{job.errors}"
+            )
+        return "\n".join(lines)
+
+
+POLL_MIN_SEC = 2
+POLL_MAX_SEC = 30
+POLL_QUIET_TICKS = 3
+POLL_GROWTH = 1.5
+POLL_LATENCY_FACTOR = 5
+POLL_ERROR_BACKOFF = 4
+POLL_EWMA_ALPHA = 0.3
+
+
+class PollController:
+    """告警轮询间隔自适应：账号状态有变化时回到下限，连续几轮不变则逐步放长；/dashboard 变慢或出错时退避。"""
+
+    def __init__(self):
+        self.enabled = True
+        self.min_sec = float(POLL_MIN_SEC)
+        self.max_sec = float(POLL_MAX_SEC)
+        self.base = self.min_sec
+        self.latency = 0.0
+        self.error_rate = 0.0
+        self.quiet = 0
+        self.samples = 0
+        self.stats: Dict[str, int] = {"faster": 0, "slower": 0}
+
+    def configure(self, cfg: Dict[str, Any]) -> None:
+        self.enabled = bool(cfg.get("pollAdaptive", True))
+        self.min_sec = max(0.5, _safe_float(cfg.get("pollMinSec", POLL_MIN_SEC), POLL_MIN_SEC))
+        self.max_sec = max(self.min_sec, _safe_float(cfg.get("pollMaxSec", POLL_MAX_SEC), POLL_MAX_SEC))
+        self.base = min(self.max_sec, max(self.min_sec, self.base))
+
+    def observe_fetch(self, latency: float, ok: bool) -> None:
+        """记录一次 /dashboard 请求（超时按超时时长计）。"""
+        a = POLL_EWMA_ALPHA
+        if not self.samples:
+            self.latency = latency
+        else:
+            self.latency += a * (latency - self.latency)
+        self.error_rate += a * ((0.0 if ok else 1.0) - self.error_rate)
+        self.samples += 1
+
+    def update(self, status_changes: int) -> bool:
+        """每轮告警检查后调用，传入本轮状态变化的账号数；间隔因此缩短时返回 True。"""
+        if status_changes > 0:
+            self.quiet = 0
+            if self.base <= self.min_sec:
+                return False
+            self.stats["faster"] += 1
+            self.base = self.min_sec
+            return True
+        self.quiet += 1
+        if self.quiet >= POLL_QUIET_TICKS and self.base < self.max_sec:
+            self.base = min(self.max_sec, self.base * POLL_GROWTH)
+            self.stats["slower"] += 1
+        return False
+
+    def interval(self) -> float:
+        if not self.enabled:
+            return self.min_sec
+        # 后台越慢/错误越多，间隔越长，但不超过上限
+        value = max(self.base, self.latency * POLL_LATENCY_FACTOR)
+        value *= 1 + self.error_rate * POLL_ERROR_BACKOFF
+        return min(self.max_sec, value)
+
+
+class StateStore:
+    """告警签名、收益基线与公告时间戳的本地持久化（SQLite WAL），变更攒批后一次事务写入。"""
+
+    TABLES = ("alert_sig", "gain_base", "meta", "history", "history_keys")
+
+    def __init__(self, path: str):
+        self.path = path
+        self._pending: Dict[str, Dict[str, Union[str, bytes, None]]] = {t: {} for t in self.TABLES}
+        # flush 在线程池中执行，put 在事件循环线程中执行；_lock 只保护 _pending
+        self._lock = threading.Lock()
+        # 连接上的事务与 close 串行：定时 flush 与卸载时的最后一次 flush 可能来自不同线程
+        self._db_lock = threading.Lock()
+        self._closed = False
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        for table in self.TABLES:
+            self._db.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID")
+
+    def load(self, table: str) -> Dict[str, Any]:
+        with self._db_lock:
+            return dict(self._db.execute(f"SELECT key, value FROM {table}"))
+
+    def put(self, table: str, key: str, value: Union[str, bytes, None]) -> None:
+        """value 为 None 表示删除。"""
+        with self._lock:
+            self._pending[table][key] = value
+
+    @property
+    def dirty(self) -> int:
+        return sum(len(p) for p in self._pending.values())
+
+    def flush(self) -> int:
+        with self._db_lock:
+            if self._closed:
+                return 0
+            with self._lock:
+                batches = {t: p for t, p in self._pending.items() if p}
+                if not batches:
+                    return 0
+                self._pending = {t: {} for t in self.TABLES}
+            n = 0
+            try:
+                self._db.execute("BEGIN")
+                for table, rows in batches.items():
+                    upserts = [(k, v) for k, v in rows.items() if v is not None]
+                    deletes = [(k,) for k, v in rows.items() if v is None]
+                    if upserts:
+                        self._db.executemany(f"INSERT OR REPLACE INTO {table} (key, value) VALUES (?, ?)", upserts)
+                    if deletes:
+                        self._db.executemany(f"DELETE FROM {table} WHERE key = ?", deletes)
+                    n += len(rows)
+                self._db.execute("COMMIT")
+            except Exception:
+                if self._db.in_transaction:
+                    self._db.execute("ROLLBACK")
+                # 写入失败时把这批变更放回去，等待下次重试（不覆盖期间的新变更）
+                with self._lock:
+                    for table, rows in batches.items():
+                        rows.update(self._pending[table])
+                        self._pending[table] = rows
+                raise
+            return n
+
+    def close(self) -> None:
+        with self._db_lock:
+            self._closed = True
+            self._db.close()
+
+
+HISTORY_DAY_RETENTION = 31
+
+
+class HistoryBucket:
+    """一个时间桶内各账号的收益增量，按列存放在紧凑数组中。"""
+
+    __slots__ = ("ids", "gold", "exp")
+
+    def __init__(self, ids: array, gold: array, exp: array):
+        self.ids = ids
+        self.gold = gold
+        self.exp = exp
+
+    @classmethod
+    def from_acc(cls, acc: Dict[int, List[float]]) -> "HistoryBucket":
+        ids = array("I", acc.keys())
+        return cls(ids, array("d", (v[0] for v in acc.values())), array("d", (v[1] for v in acc.values())))
+
+    def add_to(self, out: Dict[int, List[float]]) -> None:
+        for i, g, e in zip(self.ids, self.gold, self.exp):
+            row = out.get(i)
+            if row is None:
+                out[i] = [g, e]
+            else:
+                row[0] += g
+                row[1] += e
+
+    def pack(self) -> bytes:
+        return zlib.compress(struct.pack("<I", len(self.ids)) + self.ids.tobytes() + self.gold.tobytes() + self.exp.tobytes())
+
+    @classmethod
+    def unpack(cls, blob: bytes) -> "HistoryBucket":
+        raw = zlib.decompress(blob)
+        (n,) = struct.unpack_from("<I", raw)
+        ids, gold, exp = array("I"), array("d"), array("d")
+        off = 4
+        ids.frombytes(raw[off:off + n * ids.itemsize])
+        off += n * ids.itemsize
+        gold.frombytes(raw[off:off + n * gold.itemsize])
+        off += n * gold.itemsize
+        exp.frombytes(raw[off:off + n * exp.itemsize])
+        return cls(ids, gold, exp)
+
+
+class HistoryTier:
+    """某一粒度（分钟/小时/天）的已封存桶 + 当前周期的累加器。"""
+
+    __slots__ = ("name", "size", "retention", "closed", "acc", "cur")
+
+    def __init__(self, name: str, size: int, retention: int):
+        self.name = name
+        self.size = size
+        self.retention = retention
+        self.closed: "OrderedDict[int, HistoryBucket]" = OrderedDict()
+        # 当前周期内已封存的下级桶之和（分钟层为当前分钟的原始增量）
+        self.acc: Dict[int, List[float]] = {}
+        self.cur = 0
+
+    def period(self, ts: float) -> int:
+        return int(ts // self.size) * self.size
+
+    def add_closed(self, out: Dict[int, List[float]], start: float, end: float) -> None:
+        for bucket_start, bucket in self.closed.items():
+            if start <= bucket_start < end:
+                bucket.add_to(out)
+
+    def add_acc(self, out: Dict[int, List[float]]) -> None:
+        for i, (g, e) in self.acc.items():
+            row = out.get(i)
+            if row is None:
+                out[i] = [g, e]
+            else:
+                row[0] += g
+                row[1] += e
+
+
+def _merge_acc(dst: Dict[int, List[float]], src: Dict[int, List[float]]) -> None:
+    for i, (g, e) in src.items():
+        row = dst.get(i)
+        if row is None:
+            dst[i] = [g, e]
+        else:
+            row[0] += g
+            row[1] += e
+
+
+class MetricHistory:
+    """账号金币/经验收益的时间序列：原始增量 → 1 分钟 → 1 小时 → 1 天逐级汇总，
+    各级只保留有限个桶，窗口查询直接累加覆盖窗口的最粗粒度桶。"""
+
+    def __init__(self, persist: Optional[Callable[[str, str, Union[str, bytes, None]], None]] = None):
+        self._persist = persist
+        # 粗 → 细；保留量需覆盖上一级的一个完整周期外加窗口边缘
+        self.tiers = [
+            HistoryTier("d", 86400, HISTORY_DAY_RETENTION),
+            HistoryTier("h", 3600, 49),
+            HistoryTier("m", 60, 120),
+        ]
+        self._ids: Dict[str, int] = {}
+        self.keys: List[str] = []
+        self.names: List[str] = []
+        self._last: Dict[int, Tuple[float, float]] = {}
+
+    def _intern(self, key: str, display: str) -> int:
+        i = self._ids.get(key)
+        if i is None:
+            i = self._ids[key] = len(self.keys)
+            self.keys.append(key)
+            self.names.append(display)
+        elif self.names[i] == display:
+            return i
+        self.names[i] = display
+        if self._persist:
+            self._persist("history_keys", str(i), json.dumps([key, display], ensure_ascii=False))
+        return i
+
+    def ingest(self, now: float, changed: Iterable[AccountRecord], removed: Iterable[str] = ()) -> None:
+        self.advance(now)
+        minute = self.tiers[-1].acc
+        for rec in changed:
+            i = self._intern(rec.key, rec.display)
+            prev = self._last.get(i)
+            self._last[i] = (rec.gold_gain, rec.exp_gain)
+            if prev is None:
+                continue
+            # income 是累计值；变小说明后端重置了基线，按从 0 重新累计处理
+            dg = rec.gold_gain - prev[0] if rec.gold_gain >= prev[0] else rec.gold_gain
+            de = rec.exp_gain - prev[1] if rec.exp_gain >= prev[1] else rec.exp_gain
+            if dg <= 0 and de <= 0:
+                continue
+            row = minute.get(i)
+            if row is None:
+                minute[i] = [dg, de]
+            else:
+                row[0] += dg
+                row[1] += de
+        for key in removed:
+            i = self._ids.get(key)
+            if i is not None:
+                self._last.pop(i, None)
+
+    def advance(self, now: float) -> None:
+        # 细 → 粗依次封存到期的周期，封存结果并入上一级累加器
+        for idx in range(len(self.tiers) - 1, -1, -1):
+            tier = self.tiers[idx]
+            period = tier.period(now)
+            if period == tier.cur:
+                continue
+            if tier.cur and tier.acc:
+                bucket = HistoryBucket.from_acc(tier.acc)
+                tier.closed[tier.cur] = bucket
+                if self._persist:
+                    self._persist("history", f"{tier.name}:{tier.cur}", bucket.pack())
+                if idx > 0:
+                    _merge_acc(self.tiers[idx - 1].acc, tier.acc)
+            tier.acc = {}
+            tier.cur = period
+            while len(tier.closed) > tier.retention:
+                old, _ = tier.closed.popitem(last=False)
+                if self._persist:
+                    self._persist("history", f"{tier.name}:{old}", None)
+
+    def window_start(self, now: float, window_sec: float) -> float:
+        """窗口实际起点。起点不足一个桶的部分要用下一级的桶补齐；超出下一级保留范围时
+        （如窗口超过约两天时不完整的那一天）改为从该桶的开头算起，结果会多出不足一个桶。"""
+        start = now - window_sec
+        for tier, finer in zip(self.tiers, self.tiers[1:]):
+            if start > tier.cur or start % tier.size == 0:
+                continue
+            # 最近 retention 个下级桶一定还在（更早的只在中间有空桶时才可能保留）
+            if start < finer.period(now) - finer.retention * finer.size:
+                return tier.period(start)
+        return start
+
+    def window_totals(self, now: float, window_sec: float) -> Dict[int, List[float]]:
+        self.advance(now)
+        start = self.window_start(now, window_sec)
+        out: Dict[int, List[float]] = {}
+        for idx, tier in enumerate(self.tiers):
+            if start > tier.cur:
+                continue
+            # 从粗到细：每一级只取完整落在窗口内的桶，起点不足一个桶的部分交给下一级
+            end = tier.cur
+            for t in self.tiers[idx:]:
+                aligned = math.ceil(start / t.size) * t.size
+                t.add_closed(out, aligned, end)
+                end = aligned
+            for t in self.tiers[idx:]:
+                t.add_acc(out)
+            return out
+        self.tiers[-1].add_acc(out)
+        return out
+
+    def top(
+        self, now: float, window_sec: float, field: int, k: int, keys: Optional[Iterable[str]] = None
+    ) -> List[Tuple[str, float]]:
+        totals = self.window_totals(now, window_sec)
+        if keys is not None:
+            # 范围查询只取分片内账号
+            ids = (self._ids.get(key) for key in keys)
+            totals = {i: totals[i] for i in ids if i is not None and i in totals}
+        rows = heapq.nlargest(k, ((v[field], i) for i, v in totals.items() if v[field] > 0))
+        return [(self.names[i], v) for v, i in rows]
+
+    def load(self, keys: Dict[str, str], buckets: Dict[str, bytes], now: float) -> None:
+        for i_str, raw in sorted(keys.items(), key=lambda kv: int(kv[0])):
+            i = int(i_str)
+            key, display = json.loads(raw)
+            while len(self.keys) <= i:
+                self.keys.append("")
+                self.names.append("")
+            self.keys[i] = key
+            self.names[i] = display
+            self._ids[key] = i
+        by_name = {t.name: t for t in self.tiers}
+        for bkey, blob in sorted(buckets.items(), key=lambda kv: int(kv[0].split(":")[1])):
+            name, start = bkey.split(":")
+            tier = by_name.get(name)
+            if tier is not None:
+                tier.closed[int(start)] = HistoryBucket.unpack(blob)
+        # 用已封存的下级桶重建各级当前周期的累加器
+        for idx, tier in enumerate(self.tiers):
+            tier.cur = tier.period(now)
+            if idx + 1 < len(self.tiers):
+                child = self.tiers[idx + 1]
+                child.add_closed(tier.acc, tier.cur, now + 1)
+            while len(tier.closed) > tier.retention:
+                old, _ = tier.closed.popitem(last=False)
+                if self._persist:
+                    self._persist("history", f"{tier.name}:{old}", None)
+
+
+ERROR_MAP = {
+    "remote_login": "该账号在其他设备登录",
+    "other_login": "被挤号/异地登录",
+    "reconnect_failed": "尝试重连失败，请检查网络",
+    "relogin_failed": "自动重新登录失败",
+    "password_error": "密码错误或失效",
+    "verify_code": "需要验证码/滑块验证",
+    "device_lock": "触发设备锁，需验证",
+    "network_error": "网络连接中断",
+    "timeout": "请求超时",
+    "unknown": "未知错误",
+}
+
+
+def default_alert_rules(error_map: Dict[str, str]) -> List[Dict[str, Any]]:
+    rules: List[Dict[str, Any]] = [
+        {"keywords": ["remote_login"], "title": "🚨 异地登录告警", "severity": "critical", "alert": True},
+        {"keywords": ["reconnect_failed"], "title": "🚨 重连失败告警", "severity": "critical", "alert": True},
+        {"keywords": ["password", "verify"], "title": "🔑 密码/验证码错误", "severity": "critical"},
+        {"keywords": ["network", "timeout"], "title": "🌐 网络连接超时", "severity": "warn"},
+        {"keywords": ["error"], "alert": True},
+    ]
+    rules.extend({"keywords": [k], "desc": v} for k, v in error_map.items())
+    return rules
+
+
+class AlertClassification:
+    __slots__ = ("title", "desc", "severity", "force_alert")
+
+    def __init__(self, title: str, desc: str, severity: str, force_alert: bool):
+        self.title = title
+        self.desc = desc
+        self.severity = severity
+        self.force_alert = force_alert
+
+
+class AlertClassifier:
+    """把告警规则（关键词 → 标题/说明/级别）编译成一个正则，按 statusReason 缓存分类结果。
+
+    规则按列表顺序取第一个命中的 title / desc / severity；desc 优先取与整条原因完全相同的关键词。
+    """
+
+    def __init__(self, rules: List[Dict[str, Any]], memo_size: int = 4096):
+        self.rules: List[Tuple[frozenset, Dict[str, Any]]] = []
+        self._exact_desc: Dict[str, str] = {}
+        keywords: List[str] = []
+        for rule in rules:
+            kws = rule.get("keywords")
+            if kws is None:
+                kws = [rule.get("keyword")]
+            kws = [str(k).strip().lower() for k in (kws if isinstance(kws, list) else [kws]) if str(k or "").strip()]
+            if not kws:
+                continue
+            self.rules.append((frozenset(kws), rule))
+            for k in kws:
+                keywords.append(k)
+                if rule.get("desc") and k not in self._exact_desc:
+                    self._exact_desc[k] = str(rule["desc"])
+        uniq = sorted(set(keywords), key=len, reverse=True)
+        # 每个关键词命中时，同时视为命中它包含的所有更短关键词
+        self._closure = {k: frozenset(x for x in uniq if x in k) for k in uniq}
+        # 零宽前瞻让每个位置都尝试匹配，重叠的关键词也不会漏掉
+        self._pattern = re.compile("(?=(" + "|".join(re.escape(k) for k in uniq) + "))") if uniq else None
+        self._memo: "OrderedDict[str, AlertClassification]" = OrderedDict()
+        self._memo_size = memo_size
+
+    def matched(self, reason_low: str) -> frozenset:
+        if self._pattern is None:
+            return frozenset()
+        hits = set()
+        for m in self._pattern.finditer(reason_low):
+            hits |= self._closure[m.group(1)]
+        return frozenset(hits)
+
+    def classify(self, reason: str) -> AlertClassification:
+        cached = self._memo.get(reason)
+        if cached is not None:
+            self._memo.move_to_end(reason)
+            return cached
+        low = reason.lower()
+        hits = self.matched(low)
+        title = ""
+        desc = self._exact_desc.get(low, "")
+        severity = ""
+        force_alert = False
+        for kws, rule in self.rules:
+            if not (kws & hits):
+                continue
+            if not title and rule.get("title"):
+                title = str(rule["title"])
+            if not desc and rule.get("desc"):
+                desc = str(rule["desc"])
+            if not severity and rule.get("severity"):
+                severity = str(rule["severity"])
+            if rule.get("alert"):
+                force_alert = True
+        result = AlertClassification(title or "⚠ 账号状态告警", desc or reason, severity or "warn", force_alert)
+        self._memo[reason] = result
+        if len(self._memo) > self._memo_size:
+            self._memo.popitem(last=False)
+        return result
+
+
+ALERT_STORM_SAMPLES = 5
+
+
+class AlertStorm:
+    __slots__ = (
+        "scope", "route", "reason", "title", "desc", "started_at", "last_at", "keys", "cards", "samples",
+        "suppressed",
+    )
+
+    def __init__(self, scope: str, reason: str, cls: AlertClassification, now: float, route: int = 0):
+        self.scope = scope
+        self.route = route
+        self.reason = reason
+        self.title = cls.title
+        self.desc = cls.desc
+        self.started_at = now
+        self.last_at = now
+        self.keys: set = set()
+        self.cards: set = set()
+        self.samples: List[str] = []
+        self.suppressed = 0
+
+    def absorb(self, now: float, accounts: List[AccountRecord]) -> None:
+        self.last_at = now
+        for acc in accounts:
+            self.keys.add(acc.key)
+            if acc.card_code:
+                self.cards.add(acc.card_code)
+            if len(self.samples) < ALERT_STORM_SAMPLES:
+                self.samples.append(acc.display)
+            self.suppressed += 1
+
+
+class AlertStormDetector:
+    """同一原因的告警在滑动窗口内超过阈值时转为“风暴”：只发一条汇总，
+    之后同原因的逐条告警被吞掉，静默 recovery_sec 后判定恢复。"""
+
+    def __init__(self):
+        self.threshold = 20
+        self.window_sec = 60.0
+        self.recovery_sec = 120.0
+        self.active: Dict[Tuple[str, int, str], AlertStorm] = {}
+        self._events: Dict[Tuple[str, int, str], Deque[float]] = {}
+
+    def configure(self, cfg: Dict[str, Any]) -> None:
+        self.threshold = max(2, _safe_int(cfg.get("stormThreshold"), 20))
+        self.window_sec = max(1.0, _safe_float(cfg.get("stormWindowSec"), 60.0))
+        self.recovery_sec = max(1.0, _safe_float(cfg.get("stormRecoverySec"), 120.0))
+
+    def feed(
+        self,
+        now: float,
+        reason: str,
+        cls: AlertClassification,
+        accounts: List[AccountRecord],
+        scope: str = "",
+        route: int = 0,
+    ) -> Tuple[List[AccountRecord], Optional[AlertStorm]]:
+        """返回 (仍需逐条发送的账号, 本次新触发的风暴)；scope 区分不同后台的同名原因，
+        route 非 0 时表示只发往该范围群的那一路告警，单独计数。"""
+        key = (scope, route, reason.lower())
+        storm = self.active.get(key)
+        if storm is not None:
+            storm.absorb(now, accounts)
+            return [], None
+        q = self._events.get(key)
+        if q is None:
+            q = self._events[key] = deque()
+        q.extend([now] * len(accounts))
+        while q and q[0] < now - self.window_sec:
+            q.popleft()
+        if len(q) < self.threshold:
+            return accounts, None
+        del self._events[key]
+        storm = self.active[key] = AlertStorm(scope, reason, cls, now, route)
+        storm.absorb(now, accounts)
+        return [], storm
+
+    def recovered(self, now: float) -> List[AlertStorm]:
+        done = [k for k, st in self.active.items() if now - st.last_at >= self.recovery_sec]
+        # 顺带清理窗口外的计数，避免原因字符串无限累积
+        for k in [k for k, q in self._events.items() if not q or q[-1] < now - self.window_sec]:
+            del self._events[k]
+        return [self.active.pop(k) for k in done]
+
+
+ALERT_DEDUP_TTL_SEC = 3 * 86400
+ALERT_DEDUP_MAX_SIZE = 200000
+# 达到上限时多淘汰 max_size 的 1/N，避免之后每次新增都触发一次淘汰
+ALERT_DEDUP_EVICT_DIVISOR = 20
+# 签名摘要缓存：不同的 status|reason 组合很少，条目共用同一个摘要对象
+ALERT_DEDUP_SIG_CACHE = 4096
+# 持久化键/值为 16 位十六进制摘要
+_DIGEST_RE = re.compile(r"^[0-9a-f]{16}$")
+
+
+def _digest(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class AlertDedup:
+    """告警去重：账号最近一次告警的 status|reason 签名，账号 key 与签名都只存 8 字节摘要。
+
+    仍在快照里的账号一直保留（不重复告警的语义不变）；账号从快照中消失后再保留 ttl_sec，
+    期间重新出现（换绑、后台抖动）不会重复告警，到期淘汰。max_size 为 LRU 硬上限。
+    """
+
+    def __init__(
+        self,
+        persist: Optional[Callable[[str, str, Union[str, bytes, None]], None]] = None,
+        ttl_sec: float = ALERT_DEDUP_TTL_SEC,
+        max_size: int = ALERT_DEDUP_MAX_SIZE,
+    ):
+        self._persist = persist
+        self.ttl_sec = ttl_sec
+        self.max_size = max_size
+        # 账号摘要 → 签名摘要，按最近检查时间排序；用普通 dict（插入有序）而不是 OrderedDict，
+        # 省掉每条约 50 字节的链表节点，重新插入即“移到末尾”
+        self._sigs: Dict[int, int] = {}
+        # 已从快照消失的账号摘要 → 消失时间，按时间排序
+        self._gone: Dict[int, float] = {}
+        # 签名 → 摘要；让各条目的值共用同一个 int 对象
+        self._sig_cache: Dict[str, int] = {}
+        # 从持久化加载、尚未与快照核对过的账号
+        self._unverified: Optional[set] = None
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._sigs)
+
+    @property
+    def gone(self) -> int:
+        return len(self._gone)
+
+    def configure(self, cfg: Dict[str, Any]) -> None:
+        self.ttl_sec = max(60.0, _safe_float(cfg.get("alertDedupTtlSec"), ALERT_DEDUP_TTL_SEC))
+        self.max_size = max(1000, _safe_int(cfg.get("alertDedupMaxSize"), ALERT_DEDUP_MAX_SIZE))
+
+    def load(self, rows: Dict[str, str]) -> None:
+        for key, sig in rows.items():
+            if _DIGEST_RE.match(key) and _DIGEST_RE.match(sig):
+                self._sigs[int(key, 16)] = int(sig, 16)
+                continue
+            # 旧版本按原始 key/签名保存，转换后改写
+            k = _digest(key)
+            self._sigs[k] = _digest(sig)
+            if self._persist:
+                self._persist("alert_sig", key, None)
+                self._persist("alert_sig", f"{k:016x}", f"{self._sigs[k]:016x}")
+        self._unverified = set(self._sigs) if self._sigs else None
+
+    def check(self, key: str, sig: str) -> bool:
+        """签名与上次相同返回 False；否则记录新签名并返回 True。"""
+        k = _digest(key)
+        s = self._sig_cache.get(sig)
+        if s is None:
+            if len(self._sig_cache) >= ALERT_DEDUP_SIG_CACHE:
+                self._sig_cache.clear()
+            s = self._sig_cache[sig] = _digest(sig)
+        old = self._sigs.pop(k, None)
+        self._sigs[k] = s
+        if old == s:
+            return False
+        if self._persist:
+            self._persist("alert_sig", f"{k:016x}", f"{s:016x}")
+        if len(self._sigs) > self.max_size:
+            # 从 dict 头部删除会留下空槽，下次遍历要重新跳过；超限时一次多淘汰一批，摊平这部分开销
+            excess = len(self._sigs) - self.max_size + self.max_size // ALERT_DEDUP_EVICT_DIVISOR
+            for old_k in list(itertools.islice(self._sigs, excess)):
+                del self._sigs[old_k]
+                self._forget(old_k)
+        return True
+
+    def present(self, keys: Iterable[str]) -> None:
+        """账号重新出现在快照里：取消待淘汰。"""
+        if self._gone:
+            for key in keys:
+                self._gone.pop(_digest(key), None)
+
+    def removed(self, keys: Iterable[str], now: float) -> None:
+        for key in keys:
+            k = _digest(key)
+            if k in self._sigs:
+                self._gone.pop(k, None)
+                self._gone[k] = now
+
+    def reconcile(self, present_keys: Iterable[str], now: float) -> None:
+        """加载后的第一份快照：持久化里有、快照里没有的账号开始计时淘汰。"""
+        if self._unverified is None:
+            return
+        missing = self._unverified - {_digest(key) for key in present_keys}
+        self._unverified = None
+        for k in missing:
+            if k in self._sigs:
+                self._gone[k] = now
+
+    def expire(self, now: float) -> int:
+        due = []
+        for k, at in self._gone.items():
+            if now - at < self.ttl_sec:
+                break
+            due.append(k)
+        n = 0
+        for k in due:
+            del self._gone[k]
+            if self._sigs.pop(k, None) is not None:
+                self._forget(k)
+                n += 1
+        return n
+
+    def _forget(self, k: int) -> None:
+        self._gone.pop(k, None)
+        self.evicted += 1
+        if self._persist:
+            self._persist("alert_sig", f"{k:016x}", None)
+
+
+STATE_DB_PATH = os.path.join("data", "plugin_data", "farm_rank_bot", "state.db")
+
+DASHBOARD_CHUNK_SIZE = 64 * 1024
+
+LOOP_PROBE_INTERVAL_SEC = 0.5
+
+PROFILE_TOP_N = 12
+PROFILE_DUMP_ROWS = 60
+PROFILE_MAX_SEC = 120
+
+RECORD_DIR = os.path.join(os.path.dirname(STATE_DB_PATH), "recordings")
+RECORD_KINDS = ("dashboard", "settings", "announcement")
+RECORD_KEYFRAME_SEC = 300
+RECORD_RETENTION_DAYS = 3
+RECORD_QUEUE_SIZE = 64
+# 卸载时等待写线程收尾的上限
+RECORD_CLOSE_TIMEOUT_SEC = 10.0
+RECORD_ZLIB_LEVEL = 6
+# 帧标记：FRAME_KEY 为完整内容，不依赖前一帧；FRAME_RESYNC 为关键帧时刻补写的其它流最新状态
+FRAME_KEY = 1
+FRAME_RESYNC = 2
+# 帧头：负载长度, crc32, 时间戳, 类型, 标记, 流名长度；之后是流名和 zlib 压缩的 JSON
+_FRAME = struct.Struct("<IIdBBH")
+# .idx：关键帧时刻, 在 .frr 中的偏移
+_FRAME_INDEX = struct.Struct("<dQ")
+
+
+def _keyed(items: List[Any], key: Callable[[Any], str]) -> Tuple[List[str], Dict[str, Any]]:
+    """按 key 建 (顺序, key → 元素)；key 重复时（如没有 id/gid 的账号）按出现顺序编号。"""
+    order: List[str] = []
+    by_key: Dict[str, Any] = {}
+    dups: Dict[str, int] = {}
+    for item in items:
+        k = key(item)
+        if k in by_key:
+            dups[k] = n = dups.get(k, 0) + 1
+            k = f"{k}#{n}"
+        by_key[k] = item
+        order.append(k)
+    return order, by_key
+
+
+def _card_key(card: Dict[str, Any]) -> str:
+    return str(card.get("id") or card.get("code") or "")
+
+
+class DashboardDeltaCodec:
+    """同一个流相邻 dashboard 的差分编码；写端和读端各持一份。
+
+    卡密整张比较（dict 相等比较在 C 里完成，卡内账号很少），变化的卡密整张写入；
+    未绑定账号可能很多，逐个账号比较。顺序只在变化时写入。
+    """
+
+    SECTIONS = ("cards", "unbound")
+
+    def __init__(self):
+        self._meta: Dict[str, Any] = {}
+        self._parts: Optional[Dict[str, Tuple[List[str], Dict[str, Any]]]] = None
+
+    def full(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"meta": self._meta}
+        for name in self.SECTIONS:
+            out[f"{name}Order"], out[name] = self._parts[name]
+        return out
+
+    def encode(self, data: Dict[str, Any], key: bool = False) -> Tuple[Dict[str, Any], bool]:
+        """返回 (负载, 是否完整帧)；没有上一帧或 key 为 True 时写完整帧。"""
+        prev, prev_meta = self._parts, self._meta
+        self._meta = {k: v for k, v in data.items() if k not in ("cards", "unboundAccounts")}
+        self._parts = {
+            "cards": _keyed(data.get("cards") or [], _card_key),
+            "unbound": _keyed(data.get("unboundAccounts") or [], _acc_key),
+        }
+        if key or prev is None:
+            return self.full(), True
+        out: Dict[str, Any] = {}
+        if self._meta != prev_meta:
+            out["meta"] = self._meta
+        for name in self.SECTIONS:
+            order, by_key = self._parts[name]
+            prev_order, prev_by_key = prev[name]
+            if order != prev_order:
+                out[f"{name}Order"] = order
+                # 顺序不变时 key 集合也不变
+                removed = [k for k in prev_by_key if k not in by_key]
+                if removed:
+                    out[f"{name}Removed"] = removed
+            changed = {}
+            for k, item in by_key.items():
+                old = prev_by_key.get(k)
+                if old is not item and old != item:
+                    changed[k] = item
+            if changed:
+                out[name] = changed
+        return out, False
+
+    def decode(self, payload: Dict[str, Any], key: bool) -> Dict[str, Any]:
+        if key:
+            self._meta = payload["meta"]
+            self._parts = {name: (payload[f"{name}Order"], payload[name]) for name in self.SECTIONS}
+        else:
+            self._meta = payload.get("meta", self._meta)
+            for name in self.SECTIONS:
+                order, by_key = self._parts[name]
+                by_key.update(payload.get(name) or {})
+                for k in payload.get(f"{name}Removed") or ():
+                    by_key.pop(k, None)
+                self._parts[name] = (payload.get(f"{name}Order", order), by_key)
+        out = dict(self._meta)
+        for name, field in zip(self.SECTIONS, ("cards", "unboundAccounts")):
+            order, by_key = self._parts[name]
+            out[field] = [by_key[k] for k in order]
+        return out
+
+
+class SnapshotRecorder:
+    """把收到的 dashboard/settings/公告 追加写入录制文件，供 replay 复现线上流量。
+
+    每次启动和每天各开一个新段（YYYYMMDD-HHMMSS.frr + .idx）；dashboard 与同一流的上一帧做差分，
+    每 keyframe_sec 给所有流写一次完整帧并在 .idx 记下偏移。差分、压缩和写盘都在后台线程里做，
+    事件循环只把快照引用放进有界队列（快照收到后不会再被修改），队列满时丢弃并计数。
+    """
+
+    def __init__(self, directory: str = RECORD_DIR):
+        self.directory = directory
+        self.enabled = False
+        self.keyframe_sec = float(RECORD_KEYFRAME_SEC)
+        self.retention_days = RECORD_RETENTION_DAYS
+        self.stats: Dict[str, int] = {"frames": 0, "keyframes": 0, "bytes": 0, "dropped": 0, "errors": 0}
+        self._queue: "queue.Queue[Optional[Tuple[float, int, str, Any]]]" = queue.Queue(RECORD_QUEUE_SIZE)
+        self._thread: Optional[threading.Thread] = None
+        # 以下只在后台线程中访问
+        self._file: Optional[io.BufferedWriter] = None
+        self._index: Optional[io.BufferedWriter] = None
+        self._day = ""
+        self._epoch_at = 0.0
+        self._codecs: Dict[str, DashboardDeltaCodec] = {}
+        self._latest: Dict[Tuple[int, str], Any] = {}
+
+    def configure(self, cfg: Dict[str, Any]) -> None:
+        self.enabled = bool(cfg.get("recordEnabled", False))
+        self.keyframe_sec = max(10.0, _safe_float(cfg.get("recordKeyframeSec", RECORD_KEYFRAME_SEC), RECORD_KEYFRAME_SEC))
+        self.retention_days = max(0, _safe_int(cfg.get("recordRetentionDays", RECORD_RETENTION_DAYS), RECORD_RETENTION_DAYS))
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def record(self, kind: str, stream: str, payload: Any, ts: Optional[float] = None) -> None:
+        if not self.enabled or payload is None:
+            return
+        if self._thread is None or not self._thread.is_alive():
+            if self._thread is not None:
+                logger.warning("[FarmRankBot] snapshot recorder thread exited unexpectedly, restarting")
+            self._thread = threading.Thread(target=self._run, name="farm-rank-rec", daemon=True)
+            self._thread.start()
+        try:
+            self._queue.put_nowait((time.time() if ts is None else ts, RECORD_KINDS.index(kind), stream, payload))
+        except queue.Full:
+            self.stats["dropped"] += 1
+
+    def close(self) -> None:
+        """写完队列中剩余的帧后关闭文件（阻塞，最多等 RECORD_CLOSE_TIMEOUT_SEC 秒）。"""
+        thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        if not thread.is_alive():
+            self._close_file()
+            return
+        deadline = time.monotonic() + RECORD_CLOSE_TIMEOUT_SEC
+        try:
+            self._queue.put(None, timeout=RECORD_CLOSE_TIMEOUT_SEC)
+        except queue.Full:
+            # 写线程卡住（如磁盘很慢）：放弃剩余帧，不阻塞插件卸载
+            logger.warning("[FarmRankBot] snapshot recorder queue still full on close, dropping pending frames")
+            return
+        thread.join(max(0.0, deadline - time.monotonic()))
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                self._write(*item)
+                # 写失败后文件已关闭，之后未变化的配置/公告帧不会重新打开文件
+                if self._queue.empty() and self._file is not None:
+                    self._file.flush()
+                    self._index.flush()
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"[FarmRankBot] snapshot recorder write failed: {e}")
+                # 下一帧另开新段重新从关键帧开始
+                self._close_file()
+        self._close_file()
+
+    def _write(self, ts: float, kind: int, stream: str, payload: Any) -> None:
+        if kind != 0 and self._latest.get((kind, stream)) == payload:
+            # 公告/配置按周期轮询，内容未变化时不写
+            return
+        day = time.strftime("%Y%m%d", time.localtime(ts))
+        if self._file is None or day != self._day:
+            self._open(ts, day)
+        key = False
+        if ts - self._epoch_at >= self.keyframe_sec:
+            self._keyframes(ts, (kind, stream))
+            key = True
+        if kind == 0:
+            codec = self._codecs.get(stream)
+            if codec is None:
+                codec = self._codecs[stream] = DashboardDeltaCodec()
+            body, key = codec.encode(payload, key)
+        else:
+            body, key = payload, True
+            self._latest[(kind, stream)] = payload
+        self._frame(ts, kind, stream, FRAME_KEY if key else 0, body)
+
+    def _keyframes(self, ts: float, current: Tuple[int, str]) -> None:
+        self._epoch_at = ts
+        self._index.write(_FRAME_INDEX.pack(ts, self._file.tell()))
+        for stream, codec in self._codecs.items():
+            if (0, stream) != current:
+                self._frame(ts, 0, stream, FRAME_KEY | FRAME_RESYNC, codec.full())
+        for (kind, stream), payload in self._latest.items():
+            if (kind, stream) != current:
+                self._frame(ts, kind, stream, FRAME_KEY | FRAME_RESYNC, payload)
+        self.stats["keyframes"] += 1
+
+    def _frame(self, ts: float, kind: int, stream: str, flags: int, body: Any) -> None:
+        data = zlib.compress(_json_dumps(body), RECORD_ZLIB_LEVEL)
+        name = stream.encode("utf-8")
+        self._file.write(_FRAME.pack(len(data), zlib.crc32(data), ts, kind, flags, len(name)) + name + data)
+        self.stats["frames"] += 1
+        self.stats["bytes"] += _FRAME.size + len(name) + len(data)
+
+    def _open(self, ts: float, day: str) -> None:
+        self._close_file()
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, time.strftime("%Y%m%d-%H%M%S", time.localtime(ts)))
+        self._file = open(base + ".frr", "ab")
+        self._index = open(base + ".idx", "ab")
+        self._day = day
+        # 新段从关键帧开始，可以单独读取
+        self._epoch_at = float("-inf")
+        self._prune(ts)
+
+    def _close_file(self) -> None:
+        for f in (self._file, self._index):
+            if f is not None:
+                try:
+                    f.close()
+                except Exception:
+                    pass
+        self._file = self._index = None
+
+    def _prune(self, ts: float) -> None:
+        if self.retention_days <= 0:
+            return
+        cutoff = time.strftime("%Y%m%d", time.localtime(ts - self.retention_days * 86400))
+        for name in os.listdir(self.directory):
+            if name.endswith((".frr", ".idx")) and name[:8] < cutoff:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+
+def recording_files(directory: str) -> List[str]:
+    return sorted(os.path.join(directory, n) for n in os.listdir(directory) if n.endswith(".frr"))
+
+
+def _recording_index(path: str) -> List[Tuple[float, int]]:
+    try:
+        with open(path[: -len(".frr")] + ".idx", "rb") as f:
+            blob = f.read()
+    except OSError:
+        return []
+    n = len(blob) // _FRAME_INDEX.size
+    return [_FRAME_INDEX.unpack_from(blob, i * _FRAME_INDEX.size) for i in range(n)]
+
+
+def read_recording(
+    paths: Iterable[str], start: float = 0.0, end: float = 0.0
+) -> Iterator[Tuple[float, str, str, Dict[str, Any]]]:
+    """按时间顺序读出录制：(时间戳, 类型, 流名, 负载)，dashboard 差分帧已还原成完整快照。
+
+    指定 start 时从 start 之前最近的关键帧开始读（此后到 start 之间的帧也会给出，用于预热状态）；
+    遇到截断或校验失败的帧时结束该段。
+    """
+    paths = list(paths)
+    offsets = [0] * len(paths)
+    if start:
+        first = 0
+        for i, path in enumerate(paths):
+            index = _recording_index(path)
+            if index and index[0][0] <= start:
+                first = i
+                offsets[i] = max(off for ts, off in index if ts <= start)
+        paths, offsets = paths[first:], offsets[first:]
+    for path, offset in zip(paths, offsets):
+        codecs: Dict[str, DashboardDeltaCodec] = {}
+        seen = set()
+        with open(path, "rb") as f:
+            f.seek(offset)
+            while True:
+                head = f.read(_FRAME.size)
+                if len(head) < _FRAME.size:
+                    break
+                size, crc, ts, kind, flags, name_len = _FRAME.unpack(head)
+                name = f.read(name_len).decode("utf-8", "replace")
+                data = f.read(size)
+                if len(data) < size or zlib.crc32(data) != crc:
+                    logger.warning(f"[FarmRankBot] recording {path} truncated at offset {f.tell()}")
+                    break
+                if end and ts > end:
+                    return
+                stream = (kind, name)
+                # 顺序读取时补写的状态已经读到过，跳过
+                if flags & FRAME_RESYNC and stream in seen:
+                    continue
+                if kind == 0:
+                    codec = codecs.get(name)
+                    if codec is None:
+                        if not flags & FRAME_KEY:
+                            continue
+                        codec = codecs[name] = DashboardDeltaCodec()
+                    payload = codec.decode(_json_loads(zlib.decompress(data)), bool(flags & FRAME_KEY))
+                else:
+                    payload = _json_loads(zlib.decompress(data))
+                seen.add(stream)
+                yield ts, RECORD_KINDS[kind], name, payload
+
+
+RANK_TOP_K = 10
+# 每个榜单缓存的名次数，留出余量以减少入选账号下榜后的重算
+TOPK_CAPACITY = 64
+
+
+class TopKBoard:
+    """按单个数值字段降序的前 K 名缓存，随账号快照增量更新，读取为 O(K)。
+
+    _top 始终是全体分数中最好的一段前缀（未入选的账号都不优于 _top[-1]），
+    入选账号被移除导致前缀不足 K 条时，才用 heapq 对全体分数重新取一次前 capacity 名。
+    """
+
+    __slots__ = ("attr", "accept", "capacity", "_scores", "_recs", "_top")
+
+    def __init__(self, attr: str, accept: Callable[[AccountRecord], bool], capacity: int = TOPK_CAPACITY):
+        self.attr = attr
+        self.accept = accept
+        self.capacity = capacity
+        self._scores: Dict[str, float] = {}
+        self._recs: Dict[str, AccountRecord] = {}
+        # (-score, key) 升序即分数降序；分数相同时按 key 稳定排序
+        self._top: List[Tuple[float, str]] = []
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def update(self, rec: AccountRecord) -> None:
+        self.remove(rec.key)
+        if not self.accept(rec):
+            return
+        score = float(getattr(rec, self.attr))
+        self._scores[rec.key] = score
+        self._recs[rec.key] = rec
+        entry = (-score, rec.key)
+        top = self._top
+        if len(top) == len(self._scores) - 1 or (top and entry < top[-1]):
+            bisect.insort(top, entry)
+            if len(top) > self.capacity:
+                top.pop()
+
+    def update_many(self, recs: List[AccountRecord]) -> None:
+        # 大批量变化（如首次构建）只更新分数表，前缀留到下次读取时重算
+        if len(recs) * 4 < len(self._scores):
+            for rec in recs:
+                self.update(rec)
+            return
+        for rec in recs:
+            if self.accept(rec):
+                self._scores[rec.key] = float(getattr(rec, self.attr))
+                self._recs[rec.key] = rec
+            elif self._scores.pop(rec.key, None) is not None:
+                self._recs.pop(rec.key, None)
+        self._top = []
+
+    def remove(self, key: str) -> None:
+        score = self._scores.pop(key, None)
+        if score is None:
+            return
+        del self._recs[key]
+        entry = (-score, key)
+        top = self._top
+        i = bisect.bisect_left(top, entry)
+        if i < len(top) and top[i] == entry:
+            del top[i]
+
+    def top(self, k: int) -> List[AccountRecord]:
+        if len(self._top) < min(k, len(self._scores)):
+            self._top = heapq.nsmallest(self.capacity, ((-v, key) for key, v in self._scores.items()))
+        return [self._recs[key] for _, key in self._top[:k]]
+
+
+class Leaderboards:
+    """等级 / 运行时长（全部与仅在线）及金币 / 经验收益榜单。"""
+
+    def __init__(self):
+        self.level = TopKBoard("level", lambda r: r.level > 0)
+        self.runtime = TopKBoard("runtime_sec", lambda r: r.runtime_sec > 0)
+        self.level_online = TopKBoard("level", lambda r: r.online and r.level > 0)
+        self.runtime_online = TopKBoard("runtime_sec", lambda r: r.online and r.runtime_sec > 0)
+        self.gold = TopKBoard("gold_gain", lambda r: r.online)
+        self.exp = TopKBoard("exp_gain", lambda r: r.online)
+        self._boards = (self.level, self.runtime, self.level_online, self.runtime_online, self.gold, self.exp)
+
+    def apply(self, changed: List[AccountRecord], removed: Iterable[str]) -> None:
+        for key in removed:
+            for board in self._boards:
+                board.remove(key)
+        for board in self._boards:
+            board.update_many(changed)
+
+
+# ("card", 卡密) 或 ("agent", 代理ID)；非主后台的值带 "后台名:" 前缀
+Scope = Tuple[str, str]
+
+
+def _scope_key(backend: str, value: str) -> str:
+    return f"{backend}:{value}" if backend else value
+
+
+class LeaderboardShard:
+    """一张卡密或一个代理名下的账号；榜单在第一次查询时才建立，之后随快照增量更新。"""
+
+    __slots__ = ("records", "boards", "owner")
+
+    def __init__(self):
+        self.records: Dict[str, AccountRecord] = {}
+        self.boards: Optional[Leaderboards] = None
+        # 卡密分片所属的代理，用于范围群的权限判断
+        self.owner: Optional[Scope] = None
+
+    def board(self, name: str) -> TopKBoard:
+        if self.boards is None:
+            self.boards = Leaderboards()
+            self.boards.apply(list(self.records.values()), ())
+        return getattr(self.boards, name)
+
+
+class ShardedLeaderboards:
+    """按卡密 / 代理分片的账号索引与榜单，范围查询只触及对应分片。"""
+
+    def __init__(self):
+        self.cards: Dict[str, LeaderboardShard] = {}
+        self.agents: Dict[str, LeaderboardShard] = {}
+        self._member: Dict[str, Tuple[Scope, ...]] = {}
+
+    @staticmethod
+    def scopes(rec: AccountRecord) -> Tuple[Scope, ...]:
+        out: Tuple[Scope, ...] = ()
+        if rec.card_code:
+            out += (("card", _scope_key(rec.backend, rec.card_code)),)
+        if rec.creator_id:
+            out += (("agent", _scope_key(rec.backend, rec.creator_id)),)
+        return out
+
+    def get(self, scope: Scope) -> Optional[LeaderboardShard]:
+        return (self.cards if scope[0] == "card" else self.agents).get(scope[1])
+
+    def apply(self, changed: List[AccountRecord], removed: Iterable[str]) -> None:
+        # 先按分片归批，每个分片的榜单只更新一次
+        batches: Dict[Scope, Tuple[List[AccountRecord], List[str]]] = {}
+
+        def batch(scope: Scope) -> Tuple[List[AccountRecord], List[str]]:
+            b = batches.get(scope)
+            if b is None:
+                b = batches[scope] = ([], [])
+            return b
+
+        for key in removed:
+            for scope in self._member.pop(key, ()):
+                batch(scope)[1].append(key)
+        for rec in changed:
+            new = self.scopes(rec)
+            # 换绑卡密/代理的账号先从旧分片移除
+            for scope in self._member.get(rec.key, ()):
+                if scope not in new:
+                    batch(scope)[1].append(rec.key)
+            if new:
+                self._member[rec.key] = new
+            else:
+                self._member.pop(rec.key, None)
+            for scope in new:
+                batch(scope)[0].append(rec)
+        for scope, (recs, gone) in batches.items():
+            shards = self.cards if scope[0] == "card" else self.agents
+            shard = shards.get(scope[1])
+            if shard is None:
+                shard = shards[scope[1]] = LeaderboardShard()
+            for key in gone:
+                shard.records.pop(key, None)
+            for rec in recs:
+                shard.records[rec.key] = rec
+                if scope[0] == "card" and rec.creator_id:
+                    shard.owner = ("agent", _scope_key(rec.backend, rec.creator_id))
+            if not shard.records:
+                del shards[scope[1]]
+            elif shard.boards is not None:
+                shard.boards.apply(recs, gone)
+
+    def _union(self, scopes: Iterable[Scope]) -> Dict[str, AccountRecord]:
+        out: Dict[str, AccountRecord] = {}
+        for scope in scopes:
+            shard = self.get(scope)
+            if shard is not None:
+                out.update(shard.records)
+        return out
+
+    def size(self, scopes: Iterable[Scope]) -> int:
+        return len(self._union(scopes))
+
+    def keys(self, scopes: Iterable[Scope]) -> List[str]:
+        return list(self._union(scopes))
+
+    def online(self, scopes: Iterable[Scope]) -> List[AccountRecord]:
+        return [rec for rec in self._union(scopes).values() if rec.online]
+
+    def top(self, scopes: Iterable[Scope], name: str, k: int) -> List[AccountRecord]:
+        """多个分片的前 K 名归并；同一账号可能同时属于卡密和代理分片，按 key 去重。"""
+        shards = [shard for shard in map(self.get, scopes) if shard is not None]
+        if len(shards) == 1:
+            return shards[0].board(name).top(k)
+        merged: Dict[str, AccountRecord] = {}
+        attr = ""
+        for shard in shards:
+            board = shard.board(name)
+            attr = board.attr
+            for rec in board.top(k):
+                merged[rec.key] = rec
+        return sorted(merged.values(), key=lambda r: (-float(getattr(r, attr)), r.key))[:k]
+
+
+# (在线状态或 None, 名称, 数值文本)
+RankRow = Tuple[Optional[bool], str, str]
+# (标题, 行, 无数据时的提示)
+RankSection = Tuple[str, List[RankRow], str]
+
+IMAGE_FONT_CANDIDATES = (
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/google-noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",
+    "/usr/share/fonts/wqy-microhei/wqy-microhei.ttc",
+    "/usr/share/fonts/truetype/droid/DroidSansFallbackFull.ttf",
+    "/System/Library/Fonts/PingFang.ttc",
+    "C:/Windows/Fonts/msyh.ttc",
+    "C:/Windows/Fonts/simhei.ttf",
+)
+IMAGE_RENDER_WORKERS = 2
+IMAGE_CACHE_SIZE = 16
+IMAGE_ONLINE_MAX_ROWS = 100
+
+# 常见字体缺少彩色 emoji，图片里去掉这些字符，避免渲染成方框
+_EMOJI_RE = re.compile("[\U00010000-\U0010ffff\u2300-\u23ff\u2600-\u27bf\u2b00-\u2bff\ufe0f\u200d]")
+
+
+def _strip_emoji(text: str) -> str:
+    return _EMOJI_RE.sub("", text).strip()
+
+
+class LeaderboardImageRenderer:
+    """把若干榜单分段渲染成一张 PNG。
+
+    按布局预先栅格化的模板（背景、标题栏、名次徽章）和头像占位圆都会缓存；同样内容的榜单
+    在同一分钟内直接返回缓存的 PNG（页脚时间精确到分钟，并计入缓存键，复用的图片不会带旧时间）。
+    render 在线程池中调用，共享缓存由锁保护；FreeTypeFont 不能跨线程共用，字体按线程缓存。
+    """
+
+    WIDTH = 720
+    PAD = 24
+    HEADER_H = 60
+    ROW_H = 52
+    GAP = 20
+    FOOTER_H = 36
+    BG = (243, 244, 248)
+    CARD = (255, 255, 255)
+    STRIPE = (248, 249, 252)
+    ACCENTS = ((91, 108, 255), (0, 150, 136), (255, 152, 0), (233, 30, 99), (63, 81, 181))
+    MEDALS = ((255, 193, 7), (176, 190, 197), (205, 127, 50))
+    AVATAR_COLORS = (
+        (239, 83, 80), (171, 71, 188), (92, 107, 192), (41, 182, 246),
+        (38, 166, 154), (156, 204, 101), (255, 167, 38), (141, 110, 99),
+    )
+
+    def __init__(self, font_path: str, max_size: int = IMAGE_CACHE_SIZE):
+        self.font_path = font_path
+        self.max_size = max_size
+        self.stats: Dict[str, int] = {"renders": 0, "hits": 0}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._templates: "OrderedDict[Tuple, Any]" = OrderedDict()
+        self._avatars: Dict[int, Any] = {}
+        self._pngs: "OrderedDict[Tuple, bytes]" = OrderedDict()
+
+    @staticmethod
+    def available() -> bool:
+        return Image is not None
+
+    @staticmethod
+    def find_font(configured: str = "") -> str:
+        for path in ((configured,) if configured else ()) + IMAGE_FONT_CANDIDATES:
+            if path and os.path.exists(path):
+                return path
+        return ""
+
+    @staticmethod
+    def signature(sections: List[RankSection]) -> Tuple:
+        """缓存键：页脚文字 + 各分段内容；跨过整分钟后自然换键。"""
+        footer = datetime.now().strftime("生成于 %Y-%m-%d %H:%M")
+        return (footer,) + tuple((title, tuple(rows), empty) for title, rows, empty in sections)
+
+    def cached(self, sig: Tuple) -> Optional[bytes]:
+        with self._lock:
+            png = self._pngs.get(sig)
+            if png is not None:
+                self._pngs.move_to_end(sig)
+                self.stats["hits"] += 1
+            return png
+
+    def render(self, sections: List[RankSection]) -> bytes:
+        sig = self.signature(sections)
+        png = self.cached(sig)
+        if png is not None:
+            return png
+        img = self._template(sections).copy()
+        draw = ImageDraw.Draw(img)
+        name_font = self._font(24)
+        value_font = self._font(22)
+        y = self.PAD
+        for title, rows, empty in sections:
+            y += self.HEADER_H
+            if not rows:
+                w = draw.textlength(empty, font=value_font)
+                draw.text(((self.WIDTH - w) / 2, y + 14), empty, fill=(140, 140, 150), font=value_font)
+            for online, name, value in rows:
+                self._draw_row(img, draw, y, online, name, value, name_font, value_font)
+                y += self.ROW_H
+            y += max(0, 1 - len(rows)) * self.ROW_H + 12 + self.GAP
+        draw.text((self.PAD, img.height - self.PAD - 22), sig[0], fill=(150, 150, 160), font=self._font(18))
+        buf = io.BytesIO()
+        img.save(buf, format="PNG")
+        png = buf.getvalue()
+        with self._lock:
+            self.stats["renders"] += 1
+            self._pngs[sig] = png
+            while len(self._pngs) > self.max_size:
+                self._pngs.popitem(last=False)
+        return png
+
+    def _draw_row(self, img: Any, draw: Any, y: int, online: Optional[bool], name: str, value: str,
+                  name_font: Any, value_font: Any) -> None:
+        x = self.PAD + 72
+        avatar = self._avatar(sum(map(ord, name)) % len(self.AVATAR_COLORS))
+        img.paste(avatar, (x, y + 8), avatar)
+        initial = name[:1] or "?"
+        w = draw.textlength(initial, font=self._font(20))
+        draw.text((x + 18 - w / 2, y + 13), initial, fill=(255, 255, 255), font=self._font(20))
+        x += 48
+        if online is not None:
+            draw.ellipse((x, y + 21, x + 10, y + 31), fill=(76, 175, 80) if online else (229, 57, 53))
+            x += 18
+        value_w = draw.textlength(value, font=value_font) if value else 0
+        right = self.WIDTH - self.PAD - 20
+        name = self._fit(draw, name, name_font, right - value_w - 16 - x)
+        draw.text((x, y + 12), name, fill=(33, 33, 40), font=name_font)
+        if value:
+            draw.text((right - value_w, y + 14), value, fill=(90, 90, 100), font=value_font)
+
+    @staticmethod
+    def _fit(draw: Any, text: str, font: Any, max_w: float) -> str:
+        if draw.textlength(text, font=font) <= max_w:
+            return text
+        while text and draw.textlength(text + "…", font=font) > max_w:
+            text = text[:-1]
+        return text + "…"
+
+    def _font(self, size: int) -> Any:
+        fonts = getattr(self._local, "fonts", None)
+        if fonts is None:
+            fonts = self._local.fonts = {}
+        font = fonts.get(size)
+        if font is None:
+            font = fonts[size] = ImageFont.truetype(self.font_path, size)
+        return font
+
+    def _avatar(self, color: int) -> Any:
+        with self._lock:
+            avatar = self._avatars.get(color)
+            if avatar is None:
+                # 4 倍超采样后缩小，得到抗锯齿的圆；生成后只读，可跨线程粘贴
+                big = Image.new("RGBA", (144, 144), (0, 0, 0, 0))
+                ImageDraw.Draw(big).ellipse((0, 0, 143, 143), fill=self.AVATAR_COLORS[color] + (255,))
+                avatar = self._avatars[color] = big.resize((36, 36), Image.LANCZOS)
+            return avatar
+
+    def _template(self, sections: List[RankSection]) -> Any:
+        """背景、卡片、标题栏、斑马纹和名次徽章只与标题和行数有关，按布局缓存。"""
+        key = tuple((title, len(rows)) for title, rows, _ in sections)
+        with self._lock:
+            tpl = self._templates.get(key)
+            if tpl is not None:
+                self._templates.move_to_end(key)
+                return tpl
+        height = self.PAD * 2 + self.FOOTER_H
+        for _, rows, _ in sections:
+            height += self.HEADER_H + max(1, len(rows)) * self.ROW_H + 12 + self.GAP
+        height -= self.GAP
+        tpl = Image.new("RGB", (self.WIDTH, height), self.BG)
+        draw = ImageDraw.Draw(tpl)
+        title_font = self._font(28)
+        rank_font = self._font(20)
+        y = self.PAD
+        for i, (title, rows, _) in enumerate(sections):
+            n = max(1, len(rows))
+            bottom = y + self.HEADER_H + n * self.ROW_H + 12
+            accent = self.ACCENTS[i % len(self.ACCENTS)]
+            draw.rounded_rectangle((self.PAD, y, self.WIDTH - self.PAD, bottom), radius=16, fill=self.CARD)
+            draw.rounded_rectangle((self.PAD, y, self.WIDTH - self.PAD, y + self.HEADER_H), radius=16, fill=accent)
+            draw.rectangle((self.PAD, y + self.HEADER_H - 16, self.WIDTH - self.PAD, y + self.HEADER_H), fill=accent)
+            draw.text((self.PAD + 20, y + 13), title, fill=(255, 255, 255), font=title_font)
+            row_y = y + self.HEADER_H
+            for r in range(len(rows)):
+                if r % 2:
+                    draw.rectangle((self.PAD, row_y, self.WIDTH - self.PAD, row_y + self.ROW_H), fill=self.STRIPE)
+                cx, cy = self.PAD + 40, row_y + self.ROW_H // 2
+                color = self.MEDALS[r] if r < len(self.MEDALS) else (224, 224, 230)
+                draw.ellipse((cx - 16, cy - 16, cx + 16, cy + 16), fill=color)
+                label = str(r + 1)
+                w = draw.textlength(label, font=rank_font)
+                draw.text((cx - w / 2, cy - 12), label, fill=(255, 255, 255) if r < 3 else (90, 90, 100), font=rank_font)
+                row_y += self.ROW_H
+            y = bottom + self.GAP
+        with self._lock:
+            self._templates[key] = tpl
+            while len(self._templates) > self.max_size:
+                self._templates.popitem(last=False)
+        return tpl
+
+
+HTTP_TIMEOUT_SEC = 10
+HTTP_POOL_LIMIT = 20
+HTTP_POOL_LIMIT_PER_HOST = 8
+HTTP_DNS_TTL_SEC = 300
+HTTP_KEEPALIVE_SEC = 60
+
+# _get_json 收到 401 时的哨兵值，与“请求失败”的 None 区分
+_UNAUTHORIZED = object()
+
+WS_HEARTBEAT_SEC = 30
+WS_SNAPSHOT_STALE_SEC = 10
+WS_BACKOFF_MIN_SEC = 1.0
+WS_BACKOFF_MAX_SEC = 60.0
+
+# 配置/公告：后台在 WebSocket 上推送变更事件时只做低频兜底核对，否则按原节奏做条件请求
+SETTINGS_POLL_SEC = 300
+SETTINGS_PUSH_POLL_SEC = 1800
+ANNOUNCEMENT_PUSH_POLL_SEC = 600
+ANNOUNCEMENT_PATH = "/system/announcement"
+
+BREAKER_FAILURE_THRESHOLD = 3
+BREAKER_COOLDOWN_MIN_SEC = 5.0
+BREAKER_COOLDOWN_MAX_SEC = 300.0
+# 熔断期间沿用最后一次成功的快照，超过该时长后丢弃，避免把失联后台的账号一直当作在线
+BACKEND_STALE_SEC = 600
+
+
+TOKEN_DEFAULT_TTL_SEC = 6 * 3600
+# 后台给出的有效期已过或极短（时钟偏差等）时按该值计，很快续期，而不是退回默认的 6 小时
+TOKEN_MIN_TTL_SEC = 30
+# 剩余寿命低于该比例时在后台提前续期，请求继续使用旧 token
+TOKEN_RENEW_FRACTION = 0.2
+LOGIN_BACKOFF_MIN_SEC = 2.0
+LOGIN_BACKOFF_MAX_SEC = 300.0
+
+
+class TokenManager:
+    """后台登录 token 的生命周期：单飞刷新、到期前续期、失败指数退避、登录次数统计。
+
+    login 回调返回 (token, 秒数)：成功时秒数为有效期（0 表示使用默认值），
+    失败时 token 为空、秒数为服务端要求的重试等待（0 表示按退避计算）。
+    """
+
+    def __init__(self):
+        self.token = ""
+        self.issued_at = 0.0
+        self.expires_at = 0.0
+        self.failures = 0
+        self.retry_at = 0.0
+        self.stats: Dict[str, int] = {"logins": 0, "failures": 0, "coalesced": 0, "renewals": 0}
+        self._logins: Deque[float] = deque()
+        self._task: Optional[asyncio.Future] = None
+
+    def reset(self) -> None:
+        self.token = ""
+        self.expires_at = 0.0
+        self.failures = 0
+        self.retry_at = 0.0
+
+    def logins_last_hour(self) -> int:
+        cutoff = time.time() - 3600
+        while self._logins and self._logins[0] < cutoff:
+            self._logins.popleft()
+        return len(self._logins)
+
+    def _should_renew(self, now: float) -> bool:
+        lifetime = self.expires_at - self.issued_at
+        return now >= self.expires_at - lifetime * TOKEN_RENEW_FRACTION
+
+    async def get(self, login: Callable[[], Awaitable[Tuple[str, float]]]) -> str:
+        """返回可用 token；临近过期时在后台续期，已过期或没有 token 时等待登录。"""
+        now = time.time()
+        if self.token and now < self.expires_at:
+            if self._task is None and now >= self.retry_at and self._should_renew(now):
+                self.stats["renewals"] += 1
+                self._start(login)
+            return self.token
+        return await self.refresh(login)
+
+    async def refresh(self, login: Callable[[], Awaitable[Tuple[str, float]]]) -> str:
+        if self._task is None:
+            # 退避期内直接失败，不再打登录接口
+            if time.time() < self.retry_at:
+                return ""
+            self._start(login)
+        else:
+            self.stats["coalesced"] += 1
+        return await asyncio.shield(self._task)
+
+    async def reject(self, token: str, login: Callable[[], Awaitable[Tuple[str, float]]]) -> str:
+        """token 被服务端拒绝（401）：已被其它请求换新时直接用新的，否则重新登录。"""
+        if self.token and self.token != token:
+            return self.token
+        self.token = ""
+        return await self.refresh(login)
+
+    def _start(self, login: Callable[[], Awaitable[Tuple[str, float]]]) -> None:
+        self._task = asyncio.ensure_future(self._login(login))
+        self._task.add_done_callback(self._clear_task)
+
+    def _clear_task(self, _task: asyncio.Future) -> None:
+        self._task = None
+
+    async def _login(self, login: Callable[[], Awaitable[Tuple[str, float]]]) -> str:
+        now = time.time()
+        self._logins.append(now)
+        self.stats["logins"] += 1
+        try:
+            token, sec = await login()
+        except Exception as e:
+            logger.error(f"[FarmRankBot] admin login error: {e}")
+            token, sec = "", 0.0
+        now = time.time()
+        if token:
+            self.token = token
+            self.issued_at = now
+            self.expires_at = now + (sec if sec > 0 else TOKEN_DEFAULT_TTL_SEC)
+            self.failures = 0
+            self.retry_at = 0.0
+            return token
+        self.failures += 1
+        self.stats["failures"] += 1
+        backoff = min(LOGIN_BACKOFF_MAX_SEC, LOGIN_BACKOFF_MIN_SEC * 2 ** (self.failures - 1))
+        self.retry_at = now + max(backoff, sec)
+        # 续期失败时旧 token 仍在有效期内可以继续使用
+        return self.token if now < self.expires_at else ""
+
+
+class CircuitBreaker:
+    """连续失败达到阈值后熔断一段时间（指数增长），冷却结束放行一次探测请求。"""
+
+    def __init__(
+        self,
+        threshold: int = BREAKER_FAILURE_THRESHOLD,
+        cooldown_min: float = BREAKER_COOLDOWN_MIN_SEC,
+        cooldown_max: float = BREAKER_COOLDOWN_MAX_SEC,
+    ):
+        self.threshold = threshold
+        self.cooldown_min = cooldown_min
+        self.cooldown_max = cooldown_max
+        self.failures = 0
+        self.open_until = 0.0
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        if self.failures < self.threshold:
+            return "closed"
+        return "open" if time.time() < self.open_until else "half-open"
+
+    def allow(self) -> bool:
+        if self.failures < self.threshold:
+            return True
+        now = time.time()
+        if now < self.open_until:
+            return False
+        # 半开：放行这一次，失败则重新计时
+        self.open_until = now + self._cooldown()
+        return True
+
+    def success(self) -> None:
+        self.failures = 0
+        self.open_until = 0.0
+
+    def failure(self) -> bool:
+        """记录一次失败，返回是否因此进入熔断。"""
+        self.failures += 1
+        if self.failures == self.threshold:
+            self.trips += 1
+            self.open_until = time.time() + self._cooldown()
+            return True
+        if self.failures > self.threshold:
+            self.open_until = time.time() + self._cooldown()
+        return False
+
+    def _cooldown(self) -> float:
+        return min(self.cooldown_max, self.cooldown_min * 2 ** max(0, self.failures - self.threshold))
+
+
+class AdminBackend:
+    """一个农场后台：独立的凭据、条件请求缓存、WebSocket 状态、熔断器和告警群路由。"""
+
+    def __init__(
+        self,
+        name: str,
+        api_url: str,
+        password: str,
+        group_ids: Optional[List[int]] = None,
+        timeout_sec: float = HTTP_TIMEOUT_SEC,
+    ):
+        self.name = name
+        self.api_url = api_url
+        self.password = password
+        self.group_ids: List[int] = group_ids or []
+        self.timeout_sec = timeout_sec
+        self.auth = TokenManager()
+        self.cond_cache: Dict[str, Dict[str, Any]] = {}
+        self.breaker = CircuitBreaker()
+        self.dashboard: Optional[Dict[str, Any]] = None
+        self.dashboard_at = 0.0
+        # 最近一轮 /dashboard 是否拉取成功；失败时 dashboard 只是保留下来的旧快照
+        self.fetch_ok = False
+        self.ws_connected = False
+        self.ws_dashboard: Optional[Dict[str, Any]] = None
+        self.ws_dashboard_at = 0.0
+        self.ws_reconnects = 0
+        self.ws_task: Optional[asyncio.Task] = None
+        # auth_ok 中声明会推送的事件类型（旧后台不声明）
+        self.ws_events: frozenset = frozenset()
+        self.announcement_at = 0.0
+
+    @property
+    def label(self) -> str:
+        return self.name or "主后台"
+
+    def configure(self, api_url: str, password: str, group_ids: List[int], timeout_sec: float) -> None:
+        if api_url != self.api_url or password != self.password:
+            self.auth.reset()
+            self.cond_cache.clear()
+        if api_url != self.api_url:
+            # 换了服务器：旧快照作废，断开旧地址的 WebSocket 订阅，由 ws_loop 按新地址重连
+            self.dashboard = self.ws_dashboard = None
+            self.fetch_ok = self.ws_connected = False
+            if self.ws_task is not None:
+                self.ws_task.cancel()
+        self.api_url = api_url
+        self.password = password
+        self.group_ids = group_ids
+        self.timeout_sec = timeout_sec
+
+    def pushes(self, event: str) -> bool:
+        return self.ws_connected and event in self.ws_events
+
+    def ws_fresh(self) -> bool:
+        return (
+            self.ws_connected
+            and self.ws_dashboard is not None
+            and time.time() - self.ws_dashboard_at <= WS_SNAPSHOT_STALE_SEC
+        )
+
+    def snapshot_fresh(self) -> bool:
+        return self.dashboard is not None and (self.fetch_ok or self.ws_fresh())
+
+
+def _admin_api_url(admin_url: str) -> str:
+    return admin_url.strip().rstrip("/") + "/api/admin"
+
+
+def _redact_settings(bot_cfg: Dict[str, Any]) -> Dict[str, Any]:
+    """录制用的配置副本：去掉各后台的密码。"""
+    backends = bot_cfg.get("backends")
+    if isinstance(backends, list):
+        backends = [{k: v for k, v in b.items() if k != "password"} if isinstance(b, dict) else b for b in backends]
+        bot_cfg = dict(bot_cfg, backends=backends)
+    return {"botConfig": bot_cfg}
+
+
+def _parse_str_list(raw: Any) -> List[str]:
+    items = raw if isinstance(raw, list) else str(raw or "").replace("，", ",").split(",")
+    return [str(p).strip() for p in items if str(p).strip()]
+
+
+def _parse_id_list(raw: Any) -> List[int]:
+    out: List[int] = []
+    for p in str(raw or "").replace("，", ",").split(","):
+        p = p.strip()
+        if not p:
+            continue
+        try:
+            out.append(int(p))
+        except Exception:
+            continue
+    return out
 
 
 @register("farm_rank_bot", "Codex", "Farm Ranking & Alert Bot", "3.0.0")
@@ -49,30 +2880,71 @@ class FarmRankBot(Star):
 
         self.api_url = "http://YOUR_SERVER_IP:2222/api/admin"
         self.admin_password = "YOUR_ADMIN_PASSWORD"
-        self.token = ""
+        # 主后台：配置从这里同步；botConfig.backends 中的其它后台追加在后面
+        self._primary = AdminBackend("", self.api_url, self.admin_password)
+        self._backends: List[AdminBackend] = [self._primary]
+        self._backends_src = "[]"
+        self._merge_src: Tuple = ()
+        self._merged: Optional[Dict[str, Any]] = None
+        self._settings_js: Optional[Dict[str, Any]] = None
 
-        self.ERROR_MAP = {
-            "remote_login": "该账号在其他设备登录",
-            "other_login": "被挤号/异地登录",
-            "reconnect_failed": "尝试重连失败，请检查网络",
-            "relogin_failed": "自动重新登录失败",
-            "password_error": "密码错误或失效",
-            "verify_code": "需要验证码/滑块验证",
-            "device_lock": "触发设备锁，需验证",
-            "network_error": "网络连接中断",
-            "timeout": "请求超时",
-            "unknown": "未知错误",
-        }
+        self.ERROR_MAP = dict(ERROR_MAP)
+        self._alert_rules_src = "[]"
+        self._classifier = AlertClassifier(default_alert_rules(self.ERROR_MAP))
+        self._storms = AlertStormDetector()
 
         self.cfg: Dict[str, Any] = {}
         self._running = True
-        self._last_settings_sync = 0.0
-        self._last_push_at = 0.0
-        self._last_alert_sig: Dict[str, str] = {}
+        self._alert_dedup = AlertDedup(self._persist)
+        self._removed_keys: List[str] = []
         self._gain_base: Dict[str, Dict[str, float]] = {}
-        self._last_announcement_ts = 0.0
+        self._announcement_ts: Dict[str, float] = {}
+        self._state: Optional[StateStore] = None
+        self._state_flush: Optional[asyncio.Future] = None
+        self._history = MetricHistory(self._persist)
+        self._load_state()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._http_stats: Dict[str, int] = {"connections": 0, "requests": 0}
+        self._cond_stats: Dict[str, int] = {"modified": 0, "not_modified": 0}
+        self._dashboard: Optional[Dict[str, Any]] = None
+        self._dashboard_version = 0
+        self._acc_fingerprints: Dict[str, Tuple] = {}
+        self._diffed_dashboard: Optional[Dict[str, Any]] = None
+        self._index_src: Optional[Dict[str, Any]] = None
+        self._index = AccountIndex(None)
+        self._pending_changes: Dict[str, AccountRecord] = {}
+        self._leaderboards = Leaderboards()
+        self._shards = ShardedLeaderboards()
+        self._scope_groups_src: Optional[str] = None
+        self._group_scopes: Dict[int, Tuple[Scope, ...]] = {}
+        self._scope_routes: Dict[Scope, List[int]] = {}
+        self._dashboard_at = 0.0
+        self._dashboard_task: Optional[asyncio.Future] = None
+        self._ingest_lock = asyncio.Lock()
+        self._executors: Dict[str, Executor] = {}
+        self._fetch_stats: Dict[str, int] = {"fetches": 0, "coalesced": 0}
+        self._render_cache = RenderCache()
+        self._image_renderer: Optional[LeaderboardImageRenderer] = None
+        self._image_pool: Optional[ThreadPoolExecutor] = None
+        self._image_inflight: Dict[Tuple, asyncio.Future] = {}
+        self._image_font_warned = False
+        self._bots = BotPool(self._discover_bots, self._send_via)
+        self._dispatcher = OutboundDispatcher(self._bots.send, self._bots.wait_budget)
+        self._metrics = Metrics()
+        self._metrics.add_collector(self._collect_metrics)
+        self._metrics_runner: Optional[web.AppRunner] = None
+        self._metrics_bind: Tuple[str, int] = ("", 0)
+        self._rss_start = _rss_bytes()
+        self._profiling = False
+        self._scheduler = JobScheduler(self._metrics)
+        self._poll = PollController()
+        self._status_changes = 0
+        self._recorder = SnapshotRecorder()
 
-        asyncio.get_event_loop().create_task(self.scheduler_loop())
+        loop = asyncio.get_event_loop()
+        loop.create_task(self.scheduler_loop())
+        loop.create_task(self.ws_loop())
+        loop.create_task(self.loop_lag_probe())
 
     # ----------------------------
     # Config
@@ -88,8 +2960,58 @@ class FarmRankBot(Star):
             "reportIntervalSec": 300,
             "buyText": "云端代挂购买链接：\nhttps://YOUR_SHOP_URL/buy\n\n可私聊管理员获取最新优惠。",
             "alertEnabled": True,
+            "wsEnabled": True,
+            "incrementalEnabled": True,
+            "renderCacheTtlSec": 5,
+            "renderCacheSize": 64,
+            "sendConcurrency": 3,
+            "groupRatePerMin": 20,
+            "groupBurst": 5,
+            "alertMergeWindowSec": 3,
+            "sendMaxRetries": 3,
+            "historyEnabled": True,
+            "alertRules": [],
+            "stormThreshold": 20,
+            "stormWindowSec": 60,
+            "stormRecoverySec": 120,
+            "backends": [],
+            "tokenTtlSec": TOKEN_DEFAULT_TTL_SEC,
+            "metricsPort": 0,
+            "metricsHost": "127.0.0.1",
+            "streamParseEnabled": True,
+            "imageRankEnabled": True,
+            "imageFontPath": "",
+            "scopeGroups": [],
+            "snapshotExecutor": "",
+            "alertDedupTtlSec": ALERT_DEDUP_TTL_SEC,
+            "alertDedupMaxSize": ALERT_DEDUP_MAX_SIZE,
+            "recordEnabled": False,
+            "recordKeyframeSec": RECORD_KEYFRAME_SEC,
+            "recordRetentionDays": RECORD_RETENTION_DAYS,
+            "botRatePerMin": BOT_RATE_PER_MIN,
+            "botBurst": BOT_BURST,
+            "botFailThreshold": BOT_FAIL_THRESHOLD,
+            "botCooldownSec": BOT_COOLDOWN_SEC,
+            "pollAdaptive": True,
+            "pollMinSec": POLL_MIN_SEC,
+            "pollMaxSec": POLL_MAX_SEC,
         }
 
+    def _reload_alert_rules(self) -> None:
+        # botConfig.alertRules 中的规则优先于内置规则；内容变化时才重新编译
+        custom = self.merged_cfg().get("alertRules") or []
+        if not isinstance(custom, list):
+            custom = []
+        src = json.dumps(custom, sort_keys=True, ensure_ascii=False)
+        if src == self._alert_rules_src:
+            return
+        try:
+            self._classifier = AlertClassifier(custom + default_alert_rules(self.ERROR_MAP))
+            self._alert_rules_src = src
+            logger.info(f"[FarmRankBot] Alert rules compiled: {len(custom)} custom + built-in")
+        except Exception as e:
+            logger.error(f"[FarmRankBot] invalid alertRules, keeping previous rules: {e}")
+
     def merged_cfg(self) -> Dict[str, Any]:
         c = self.default_cfg()
         c.update(self.cfg or {})
@@ -99,16 +3021,21 @@ class FarmRankBot(Star):
         c = self.merged_cfg()
         raw_multi = str(c.get("groupIds") or "").strip()
         raw_single = str(c.get("groupId") or "").strip()
-        raw = raw_multi if raw_multi else raw_single
-        out: List[int] = []
-        for p in raw.replace("，", ",").split(","):
-            p = p.strip()
-            if not p:
-                continue
-            try:
-                out.append(int(p))
-            except Exception:
-                continue
+        return _parse_id_list(raw_multi if raw_multi else raw_single)
+
+    def backend_group_ids(self, backend: str) -> List[int]:
+        """告警/公告路由：后台配置了 groupIds 时发往这些群，否则发往全局群。"""
+        for b in self._backends:
+            if b.name == backend:
+                return b.group_ids or self.parse_group_ids()
+        return self.parse_group_ids()
+
+    def all_group_ids(self) -> List[int]:
+        out = list(self.parse_group_ids())
+        for b in self._backends:
+            for gid in b.group_ids:
+                if gid not in out:
+                    out.append(gid)
         return out
 
     def bot_enabled(self) -> bool:
@@ -117,6 +3044,38 @@ class FarmRankBot(Star):
     def alert_enabled(self) -> bool:
         return bool(self.merged_cfg().get("alertEnabled", True))
 
+    def ws_enabled(self) -> bool:
+        return bool(self.merged_cfg().get("wsEnabled", True))
+
+    def incremental_enabled(self) -> bool:
+        return bool(self.merged_cfg().get("incrementalEnabled", True))
+
+    def history_enabled(self) -> bool:
+        return bool(self.merged_cfg().get("historyEnabled", True))
+
+    def stream_parse_enabled(self) -> bool:
+        return bool(self.merged_cfg().get("streamParseEnabled", True))
+
+    def snapshot_executor(self) -> str:
+        """快照处理的执行方式：""（事件循环内）、"thread" 或 "process"。"""
+        mode = str(self.merged_cfg().get("snapshotExecutor") or "").strip().lower()
+        return mode if mode in ("thread", "process") else ""
+
+    def image_rank_enabled(self) -> bool:
+        return bool(self.merged_cfg().get("imageRankEnabled", True))
+
+    def settings_interval_sec(self) -> float:
+        return SETTINGS_PUSH_POLL_SEC if self._primary.pushes("settings") else SETTINGS_POLL_SEC
+
+    def token_ttl_sec(self) -> float:
+        return max(60.0, _safe_float(self.merged_cfg().get("tokenTtlSec"), TOKEN_DEFAULT_TTL_SEC))
+
+    def render_cache_ttl_sec(self) -> float:
+        return max(0.0, _safe_float(self.merged_cfg().get("renderCacheTtlSec"), 5.0))
+
+    def render_cache_size(self) -> int:
+        return max(1, _safe_int(self.merged_cfg().get("renderCacheSize"), 64))
+
     def rank_interval_sec(self) -> int:
         c = self.merged_cfg()
         sec = _safe_int(c.get("reportIntervalSec"), 0)
@@ -135,399 +3094,1459 @@ class FarmRankBot(Star):
         text = str(self.merged_cfg().get("buyText") or "").strip()
         return text or "云端代挂购买链接：\nhttps://example.com/buy"
 
+    # ----------------------------
+    # Persistent state
+    # ----------------------------
+    def _load_state(self) -> None:
+        # 重载插件后恢复告警签名/收益基线/公告时间，避免重复告警
+        started = time.perf_counter()
+        try:
+            self._state = StateStore(STATE_DB_PATH)
+            self._alert_dedup.load(self._state.load("alert_sig"))
+            self._gain_base = {k: json.loads(v) for k, v in self._state.load("gain_base").items()}
+            meta = self._state.load("meta")
+            for k, v in meta.items():
+                if k == "last_announcement_ts" or k.startswith("last_announcement_ts:"):
+                    self._announcement_ts[k.partition(":")[2]] = _safe_float(v)
+            self._history.load(self._state.load("history_keys"), self._state.load("history"), time.time())
+        except Exception as e:
+            logger.error(f"[FarmRankBot] state store unavailable, running in-memory only: {e}")
+            self._state = None
+            return
+        logger.info(
+            f"[FarmRankBot] State loaded: {len(self._alert_dedup)} alert sigs, "
+            f"{len(self._gain_base)} gain bases in {(time.perf_counter() - started) * 1000:.1f}ms"
+        )
+
+    def _persist(self, table: str, key: str, value: Union[str, bytes, None]) -> None:
+        if self._state is not None:
+            self._state.put(table, key, value)
+
+    async def flush_state(self) -> None:
+        if self._state is None or not self._state.dirty:
+            return
+        loop = asyncio.get_running_loop()
+        self._state_flush = loop.run_in_executor(None, self._state.flush)
+        try:
+            await self._state_flush
+        finally:
+            self._state_flush = None
+
     # ----------------------------
     # HTTP helpers
     # ----------------------------
-    async def get_token(self) -> bool:
-        login_url = f"{self.api_url}/login"
+    async def _on_connection_create(self, session, ctx, params) -> None:
+        self._http_stats["connections"] += 1
+
+    async def _on_request_end(self, session, ctx, params) -> None:
+        self._http_stats["requests"] += 1
+
+    def _http(self) -> aiohttp.ClientSession:
+        # 单个长连接池：复用 TCP 连接并缓存 DNS，避免每 2 秒新建一次 connector
+        if self._session is None or self._session.closed:
+            trace = aiohttp.TraceConfig()
+            trace.on_connection_create_end.append(self._on_connection_create)
+            trace.on_request_end.append(self._on_request_end)
+            connector = aiohttp.TCPConnector(
+                limit=HTTP_POOL_LIMIT,
+                limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+                ttl_dns_cache=HTTP_DNS_TTL_SEC,
+                keepalive_timeout=HTTP_KEEPALIVE_SEC,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT_SEC),
+                trace_configs=[trace],
+            )
+        return self._session
+
+    async def close_http(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def http_stats_text(self) -> str:
+        conns = self._http_stats["connections"]
+        reqs = self._http_stats["requests"]
+        ratio = f"{reqs / conns:.1f}" if conns else "-"
+        return f"HTTP连接: 新建{conns} / 请求{reqs} (复用比 {ratio})"
+
+    async def get_token(self, backend: Optional[AdminBackend] = None) -> bool:
+        """强制重新登录（与其它正在进行的登录合并）。"""
+        b = backend or self._primary
+        return bool(await b.auth.refresh(self._login_func(b)))
+
+    def _login_func(self, b: AdminBackend) -> Callable[[], Awaitable[Tuple[str, float]]]:
+        async def login() -> Tuple[str, float]:
+            return await self._login(b)
+        return login
+
+    async def _login(self, b: AdminBackend) -> Tuple[str, float]:
+        login_url = f"{b.api_url}/login"
         logger.info(f"[FarmRankBot] Attempting login at: {login_url}")
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(login_url, json={"password": self.admin_password}, timeout=10) as resp:
-                    if resp.status != 200:
-                        logger.error(f"[FarmRankBot] Login failed with status {resp.status}")
-                        return False
-                    js = await resp.json()
-                    if js.get("ok") and js.get("token"):
-                        self.token = str(js["token"])
-                        logger.info(f"[FarmRankBot] Login successful, token acquired")
-                        return True
-            return False
+            async with self._http().post(
+                login_url, json={"password": b.password}, timeout=aiohttp.ClientTimeout(total=b.timeout_sec)
+            ) as resp:
+                if resp.status == 429:
+                    # 后台登录接口按 IP 限流（5次/分钟），按提示的时间等待
+                    text = await resp.text()
+                    m = re.search(r"Retry in (\d+)s", text)
+                    retry = _safe_float(resp.headers.get("Retry-After") or (m.group(1) if m else 0))
+                    logger.error(f"[FarmRankBot] Login throttled ({b.label}), retry in {retry:.0f}s")
+                    return "", retry
+                if resp.status != 200:
+                    logger.error(f"[FarmRankBot] Login failed with status {resp.status}")
+                    return "", 0.0
+                js = _json_loads(await resp.read())
+                if js.get("ok") and js.get("token"):
+                    logger.info(f"[FarmRankBot] Login successful, token acquired ({b.label})")
+                    return str(js["token"]), self._token_ttl(js)
+            return "", 0.0
         except Exception as e:
-            logger.error(f"[FarmRankBot] admin login failed: {e}")
-            return False
+            logger.error(f"[FarmRankBot] admin login failed ({b.label}): {e}")
+            return "", 0.0
 
-    async def _authed_get(self, path: str) -> Optional[Dict[str, Any]]:
-        if not self.token and not await self.get_token():
+    def _token_ttl(self, js: Dict[str, Any]) -> float:
+        # 后台返回有效期时以其为准（expiresAt 为毫秒时间戳），否则使用 tokenTtlSec
+        if js.get("expiresIn"):
+            ttl = _safe_float(js.get("expiresIn"))
+        elif js.get("expiresAt"):
+            ttl = _safe_float(js.get("expiresAt")) / 1000 - time.time()
+        else:
+            return self.token_ttl_sec()
+        if ttl < TOKEN_MIN_TTL_SEC:
+            logger.warning(f"[FarmRankBot] admin token expires in {ttl:.0f}s (clock skew?), renewing within {TOKEN_MIN_TTL_SEC}s")
+        return max(float(TOKEN_MIN_TTL_SEC), ttl)
+
+    async def _authed_get(
+        self, path: str, conditional: bool = False, backend: Optional[AdminBackend] = None
+    ) -> Optional[Dict[str, Any]]:
+        b = backend or self._primary
+        login = self._login_func(b)
+        token = await b.auth.get(login)
+        if not token:
             return None
-        headers = {"Authorization": f"Bearer {self.token}"}
-        url = f"{self.api_url}{path}"
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers, timeout=10) as resp:
-                    if resp.status == 401:
-                        if not await self.get_token():
-                            return None
-                        headers = {"Authorization": f"Bearer {self.token}"}
-                        async with session.get(url, headers=headers, timeout=10) as resp2:
-                            if resp2.status != 200:
-                                return None
-                            return await resp2.json()
-                    if resp.status != 200:
-                        return None
-                    return await resp.json()
+            js = await self._get_json(b, token, path, conditional)
+            if js is _UNAUTHORIZED:
+                # 并发请求同时收到 401 时只有一个会真正重新登录
+                token = await b.auth.reject(token, login)
+                if not token:
+                    return None
+                js = await self._get_json(b, token, path, conditional)
+            return None if js is _UNAUTHORIZED else js
         except Exception:
             return None
 
+    async def _get_json(self, b: AdminBackend, token: str, path: str, conditional: bool) -> Any:
+        headers = {"Authorization": f"Bearer {token}"}
+        cached = b.cond_cache.get(path) if conditional else None
+        if cached:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+        timeout = aiohttp.ClientTimeout(total=b.timeout_sec)
+        started = time.perf_counter()
+        status = "error"
+        try:
+            async with self._http().get(f"{b.api_url}{path}", headers=headers, timeout=timeout) as resp:
+                status = str(resp.status)
+                if resp.status == 401:
+                    return _UNAUTHORIZED
+                if resp.status == 304 and cached:
+                    # 未变化：直接复用上一次的解析结果（同一对象），调用方据此跳过处理
+                    self._cond_stats["not_modified"] += 1
+                    return cached["body"]
+                if resp.status != 200:
+                    return None
+                if path == "/dashboard":
+                    js = await self._read_dashboard(resp)
+                else:
+                    js = _json_loads(await resp.read())
+                if conditional:
+                    self._cond_stats["modified"] += 1
+                    etag = resp.headers.get("ETag")
+                    last_modified = resp.headers.get("Last-Modified")
+                    if etag or last_modified:
+                        b.cond_cache[path] = {"etag": etag, "last_modified": last_modified, "body": js}
+                return js
+        finally:
+            backend = b.name or "primary"
+            self._metrics.observe("farm_http_request_ms", (time.perf_counter() - started) * 1000, path=path, backend=backend)
+            self._metrics.inc("farm_http_requests_total", path=path, backend=backend, status=status)
+
+    async def _read_dashboard(self, resp: aiohttp.ClientResponse) -> Dict[str, Any]:
+        """读取 /dashboard 响应，只保留 DASHBOARD_*_FIELDS 中的字段。"""
+        if self.snapshot_executor() or not self.stream_parse_enabled():
+            body = await resp.read()
+            return await self._offload("decode", decode_dashboard_body, body, self.stream_parse_enabled(), process=True)
+        parser = DashboardStreamParser()
+        async for chunk in resp.content.iter_chunked(DASHBOARD_CHUNK_SIZE):
+            parser.feed(chunk)
+        return parser.close()
+
     async def get_dashboard(self) -> Optional[Dict[str, Any]]:
-        js = await self._authed_get("/dashboard")
-        if not js or not js.get("ok"):
+        # 所有后台的 WebSocket 快照都足够新时直接合并，不再请求 /dashboard
+        if all(b.ws_fresh() for b in self._backends):
+            return await self._merge_dashboards()
+        # 并发调用共享同一个进行中的请求
+        if self._dashboard_task is None:
+            self._dashboard_task = asyncio.ensure_future(self._fetch_dashboard())
+            self._dashboard_task.add_done_callback(self._clear_dashboard_task)
+        else:
+            self._fetch_stats["coalesced"] += 1
+        return await asyncio.shield(self._dashboard_task)
+
+    def _clear_dashboard_task(self, _task: asyncio.Future) -> None:
+        self._dashboard_task = None
+
+    async def _fetch_dashboard(self) -> Optional[Dict[str, Any]]:
+        # 各后台并发拉取，单个后台超时/熔断不影响其它后台
+        results = await asyncio.gather(*(self._fetch_backend(b) for b in self._backends))
+        if not any(results):
+            # 本轮没有任何后台拿到新快照：不能拿保留的旧快照冒充最新数据（也不刷新 _dashboard_at）
+            return None
+        return await self._merge_dashboards()
+
+    async def _fetch_backend(self, b: AdminBackend) -> bool:
+        """拉取一个后台的快照，返回本轮是否拿到了新数据（WebSocket 快照足够新也算）。"""
+        if b.ws_fresh():
+            return True
+        b.fetch_ok = False
+        if b.breaker.allow():
+            self._fetch_stats["fetches"] += 1
+            started = time.monotonic()
+            try:
+                js = await asyncio.wait_for(self._authed_get("/dashboard", True, b), timeout=b.timeout_sec)
+            except asyncio.TimeoutError:
+                js = None
+            self._poll.observe_fetch(time.monotonic() - started, bool(js and js.get("ok")))
+            if js and js.get("ok"):
+                b.breaker.success()
+                data = js.get("data") or {}
+                # 304 时拿到的是同一个对象，不重复录制
+                if data is not b.dashboard:
+                    self._recorder.record("dashboard", b.name, data)
+                b.dashboard = data
+                b.dashboard_at = time.time()
+                b.fetch_ok = True
+                return True
+            if b.breaker.failure():
+                logger.warning(f"[FarmRankBot] backend {b.label} circuit opened after {b.breaker.failures} failures")
+        if b.dashboard is not None and time.time() - b.dashboard_at > BACKEND_STALE_SEC:
+            logger.warning(f"[FarmRankBot] backend {b.label} snapshot expired, dropping its accounts")
+            b.dashboard = None
+        return False
+
+    async def _merge_dashboards(self) -> Optional[Dict[str, Any]]:
+        """把各后台的最新快照合并成一个；所有后台快照都未变化时返回同一对象。"""
+        src = tuple(b.dashboard for b in self._backends)
+        if len(src) == 1:
+            # 单后台直接使用原始快照（拉取失败的轮次在 _fetch_dashboard 中已返回 None）
+            merged = src[0]
+        elif len(src) == len(self._merge_src) and all(x is y for x, y in zip(src, self._merge_src)):
+            merged = self._merged
+        else:
+            shards = [(b.name, b.dashboard) for b in self._backends if b.dashboard is not None]
+            merged = {"shards": shards} if shards else None
+        self._merge_src = src
+        self._merged = merged
+        if merged is None:
             return None
-        return js.get("data") or {}
+        return await self._note_dashboard(merged)
+
+    async def recent_dashboard(self) -> Optional[Dict[str, Any]]:
+        """命令使用：TTL 内直接复用最近一次快照，否则拉取（与其它调用合并）。"""
+        if self._dashboard is not None and time.time() - self._dashboard_at <= self.render_cache_ttl_sec():
+            return self._dashboard
+        return await self.get_dashboard()
+
+    async def _note_dashboard(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        self._dashboard_at = time.time()
+        # 304 / 未收到新推送时拿到的是同一个对象，版本号保持不变
+        if data is not self._dashboard:
+            if self.snapshot_executor():
+                # 先在工作线程里建好索引，版本号在应用之后才前进，命令不会读到半新半旧的榜单
+                await self._ingest_offloaded(data)
+            self._dashboard = data
+            self._dashboard_version += 1
+            self._ingest_snapshot(data)
+        return data
 
     async def sync_settings(self) -> None:
-        logger.info("[FarmRankBot] Syncing settings from API...")
-        js = await self._authed_get("/settings")
+        # 条件请求：配置未变化时后台返回 304，拿到的是上次的同一个对象，直接跳过
+        js = await self._authed_get("/settings", True)
         if not js or not js.get("ok"):
             logger.error(f"[FarmRankBot] Failed to sync settings: {js}")
             return
-        settings = js.get("data") or {}
+        if js is self._settings_js:
+            return
+        self._settings_js = js
+        logger.info("[FarmRankBot] Settings changed, applying...")
+        await self.apply_settings(js.get("data") or {})
+
+    async def apply_settings(self, settings: Dict[str, Any]) -> None:
+        """应用 /settings 的内容（replay 直接调用）。"""
         bot_cfg = settings.get("botConfig") or {}
         self.cfg = bot_cfg
+        self._recorder.configure(self.merged_cfg())
+        self._recorder.record("settings", "", _redact_settings(bot_cfg))
+        self._dispatcher.configure(self.merged_cfg())
+        self._bots.configure(self.merged_cfg())
+        self._poll.configure(self.merged_cfg())
+        self._reload_alert_rules()
+        self._storms.configure(self.merged_cfg())
+        self._alert_dedup.configure(self.merged_cfg())
+        await self._ensure_metrics_server()
         logger.info(f"[FarmRankBot] Settings synced. enabled={bot_cfg.get('enabled')}, groupIds={bot_cfg.get('groupIds')}")
         admin_url = str(bot_cfg.get("adminUrl") or "").strip()
         if admin_url:
-            self.api_url = admin_url.rstrip("/") + "/api/admin"
+            self.api_url = _admin_api_url(admin_url)
+            p = self._primary
+            p.configure(self.api_url, p.password, p.group_ids, p.timeout_sec)
+        self._reload_backends()
+        self._reload_scope_groups()
+
+    def _reload_scope_groups(self) -> None:
+        """按 botConfig.scopeGroups 建立 群 → 卡密/代理 范围，这些群只看到范围内的账号与告警。
+
+        条目格式：{"groupIds": "123,456", "cards": "卡密1,卡密2", "agents": "代理ID", "backend": "后台名"}；
+        同时配置在 groupIds 里的群视为管理群，仍看到全部数据。
+        """
+        raw = self.merged_cfg().get("scopeGroups") or []
+        if not isinstance(raw, list):
+            raw = []
+        src = json.dumps(raw, sort_keys=True, ensure_ascii=False)
+        if src == self._scope_groups_src:
+            return
+        self._scope_groups_src = src
+        group_scopes: Dict[int, List[Scope]] = {}
+        for item in raw:
+            if not isinstance(item, dict):
+                continue
+            backend = str(item.get("backend") or "").strip()
+            scopes = [("card", _scope_key(backend, c)) for c in _parse_str_list(item.get("cards"))]
+            scopes += [("agent", _scope_key(backend, a)) for a in _parse_str_list(item.get("agents"))]
+            group_ids = _parse_id_list(item.get("groupIds"))
+            if not group_ids or not scopes:
+                logger.error(f"[FarmRankBot] invalid scopeGroups entry skipped: {item!r}")
+                continue
+            for gid in group_ids:
+                bucket = group_scopes.setdefault(gid, [])
+                bucket.extend(sc for sc in scopes if sc not in bucket)
+        routes: Dict[Scope, List[int]] = {}
+        for gid, scopes in group_scopes.items():
+            for scope in scopes:
+                routes.setdefault(scope, []).append(gid)
+        self._group_scopes = {gid: tuple(scopes) for gid, scopes in group_scopes.items()}
+        self._scope_routes = routes
+        logger.info(f"[FarmRankBot] Scoped groups: {len(self._group_scopes)} ({len(routes)} scopes)")
+
+    def scoped_group_ids(self) -> List[int]:
+        """只看自己范围的群（不含同时配置为全局群的）。"""
+        unscoped = set(self.all_group_ids())
+        return [gid for gid in self._group_scopes if gid not in unscoped]
+
+    def _scoped_alert_targets(self, accounts: List[AccountRecord]) -> Dict[int, List[AccountRecord]]:
+        out: Dict[int, List[AccountRecord]] = {}
+        if not self._scope_routes:
+            return out
+        for acc in accounts:
+            gids = set()
+            for scope in ShardedLeaderboards.scopes(acc):
+                gids.update(self._scope_routes.get(scope, ()))
+            for gid in gids:
+                out.setdefault(gid, []).append(acc)
+        return out
+
+    def _event_scopes(self, event: AstrMessageEvent) -> Tuple[Scope, ...]:
+        get_group_id = getattr(event, "get_group_id", None)
+        gid = _safe_int(get_group_id() if callable(get_group_id) else 0, 0)
+        if not gid or gid in self.all_group_ids():
+            return ()
+        return self._group_scopes.get(gid, ())
+
+    def _find_scope(self, kind: str, value: str) -> Optional[Scope]:
+        # 用户输入的是原始卡密/代理ID，依次在主后台和各后台的分片里查找
+        for b in self._backends:
+            scope = (kind, _scope_key(b.name, value))
+            if self._shards.get(scope) is not None:
+                return scope
+        return None
+
+    def _resolve_scopes(self, event: AstrMessageEvent, arg: str) -> Tuple[Tuple[Scope, ...], str]:
+        """命令参数 "<卡密>" 或 "代理 <ID>" 解析为查询范围；返回 (范围, 错误提示)。"""
+        allowed = self._event_scopes(event)
+        if not arg:
+            return allowed, ""
+        kind, _, value = arg.partition(" ")
+        if kind in ("代理", "agent") and value.strip():
+            kind, label, value = "agent", "代理", value.strip()
+        else:
+            kind, label, value = "card", "卡密", arg
+        scope = self._find_scope(kind, value)
+        if scope is None:
+            return (), f"未找到{label} {value} 下的账号。"
+        if allowed and scope not in allowed and self._shards.get(scope).owner not in allowed:
+            return (), "本群只能查询自己范围内的卡密/代理。"
+        return (scope,), ""
+
+    @staticmethod
+    def _scope_label(scopes: Tuple[Scope, ...]) -> str:
+        names = [("卡密 " if kind == "card" else "代理 ") + key for kind, key in scopes[:3]]
+        more = f" 等{len(scopes)}个" if len(scopes) > 3 else ""
+        return "、".join(names) + more
+
+    def _reload_backends(self) -> None:
+        """按 botConfig.backends 增删后台；同名后台保留 token/连接状态，只更新配置。"""
+        raw = self.merged_cfg().get("backends") or []
+        if not isinstance(raw, list):
+            raw = []
+        src = json.dumps(raw, sort_keys=True, ensure_ascii=False)
+        if src == self._backends_src:
+            return
+        self._backends_src = src
+        existing = {b.name: b for b in self._backends[1:]}
+        backends = [self._primary]
+        for item in raw:
+            if not isinstance(item, dict):
+                continue
+            name = str(item.get("name") or "").strip()
+            admin_url = str(item.get("adminUrl") or "").strip()
+            if not name or not admin_url or any(b.name == name for b in backends):
+                logger.error(f"[FarmRankBot] invalid backend entry skipped: name={name!r}")
+                continue
+            api_url = _admin_api_url(admin_url)
+            password = str(item.get("password") or "")
+            group_ids = _parse_id_list(item.get("groupIds"))
+            timeout_sec = max(1.0, _safe_float(item.get("timeoutSec"), HTTP_TIMEOUT_SEC))
+            b = existing.pop(name, None)
+            if b is None:
+                b = AdminBackend(name, api_url, password, group_ids, timeout_sec)
+            else:
+                b.configure(api_url, password, group_ids, timeout_sec)
+            backends.append(b)
+        for b in existing.values():
+            if b.ws_task is not None:
+                b.ws_task.cancel()
+        self._backends = backends
+        logger.info(f"[FarmRankBot] Backends: {', '.join(b.label for b in backends)}")
+
+    # ----------------------------
+    # WebSocket ingestion
+    # ----------------------------
+    def ws_url(self, backend: Optional[AdminBackend] = None) -> str:
+        base = (backend or self._primary).api_url
+        if base.endswith("/api/admin"):
+            base = base[: -len("/api/admin")]
+        if base.startswith("https://"):
+            base = "wss://" + base[len("https://"):]
+        elif base.startswith("http://"):
+            base = "ws://" + base[len("http://"):]
+        return f"{base}/ws"
+
+    async def ws_loop(self) -> None:
+        # 每个后台一个订阅任务；后台列表变化时补齐新任务（被移除的后台在 _reload_backends 中取消）
+        await asyncio.sleep(2)
+        while self._running:
+            for b in self._backends:
+                if b.ws_task is None or b.ws_task.done():
+                    b.ws_task = asyncio.ensure_future(self._ws_backend_loop(b))
+            await asyncio.sleep(5)
+        for b in self._backends:
+            if b.ws_task is not None:
+                b.ws_task.cancel()
+
+    async def _ws_backend_loop(self, b: AdminBackend) -> None:
+        # 订阅 /ws 的 snapshot/alert 推送，断线后指数退避重连；
+        # 断线期间 scheduler_loop 自动回退到 HTTP 轮询
+        backoff = WS_BACKOFF_MIN_SEC
+        while self._running:
+            if not self.bot_enabled() or not self.ws_enabled():
+                await asyncio.sleep(5)
+                continue
+            try:
+                if await self._ws_session(b):
+                    backoff = WS_BACKOFF_MIN_SEC
+            except asyncio.CancelledError:
+                b.ws_connected = False
+                raise
+            except Exception as e:
+                logger.warning(f"[FarmRankBot] admin ws error ({b.label}): {e}")
+            finally:
+                pushed = bool(b.ws_events)
+                b.ws_connected = False
+                # 断线后立刻回退到 HTTP 拉取一次
+                self._scheduler.wake("alerts")
+                if pushed:
+                    # 收不到变更事件了：回到原来的轮询节奏
+                    self._notify_changed(b, "settings")
+            if not self._running:
+                break
+            b.ws_reconnects += 1
+            await asyncio.sleep(backoff + random.uniform(0, backoff / 2))
+            backoff = min(WS_BACKOFF_MAX_SEC, backoff * 2)
+
+    async def _ws_session(self, b: AdminBackend) -> bool:
+        """单次 WebSocket 会话，返回是否曾认证成功。"""
+        token = await b.auth.get(self._login_func(b))
+        if not token:
+            return False
+        authed = False
+        async with self._http().ws_connect(self.ws_url(b), heartbeat=WS_HEARTBEAT_SEC) as ws:
+            await ws.send_json({"type": "auth", "token": token})
+            async for msg in ws:
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    if msg.type in (aiohttp.WSMsgType.ERROR, aiohttp.WSMsgType.CLOSED):
+                        break
+                    continue
+                try:
+                    frame = await self._offload("decode", decode_ws_frame, msg.data, process=True)
+                except Exception:
+                    continue
+                kind = frame.get("type")
+                if kind == "auth_ok":
+                    authed = True
+                    b.ws_connected = True
+                    b.ws_events = frozenset(frame.get("events") or ())
+                    logger.info(f"[FarmRankBot] admin ws connected ({b.label})")
+                    # 断线期间可能错过变更事件：连上后各核对一次（未变化时是 304）
+                    self._notify_changed(b, "settings")
+                    self._notify_changed(b, "announcement")
+                elif kind == "auth_fail":
+                    # token 失效：作废后下次重连前重新登录（已被换新则不受影响）
+                    if b.auth.token == token:
+                        b.auth.token = ""
+                    break
+                elif kind == "snapshot":
+                    dashboard = frame["data"]["dashboard"]
+                    if isinstance(dashboard, dict):
+                        b.ws_dashboard = b.dashboard = dashboard
+                        b.ws_dashboard_at = b.dashboard_at = time.time()
+                        self._recorder.record("dashboard", b.name, dashboard)
+                        b.breaker.success()
+                        # 快照每秒推送一次：按轮询间隔节流，避免每帧都做一次完整比对；
+                        # 账号状态变化另有 alert 帧，收到即唤醒
+                        self._scheduler.wake("alerts", min_interval=self._poll.interval())
+                elif kind == "alert":
+                    self._scheduler.wake("alerts")
+                elif kind in ("settings", "announcement"):
+                    self._notify_changed(b, kind)
+        return authed
+
+    def _notify_changed(self, b: AdminBackend, kind: str) -> None:
+        if kind == "announcement":
+            b.announcement_at = 0.0
+            self._scheduler.wake("announcement")
+        elif b is self._primary:
+            # 配置只从主后台同步
+            self._scheduler.wake("settings")
+
+    # ----------------------------
+    # Snapshot executor
+    # ----------------------------
+    def _executor(self, kind: str) -> Executor:
+        pool = self._executors.get(kind)
+        if pool is None:
+            if kind == "process":
+                # spawn：事件循环进程里有多个线程，fork 出的子进程可能继承被占用的锁
+                pool = ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn"))
+            else:
+                pool = ThreadPoolExecutor(1, thread_name_prefix="farm-snapshot")
+            self._executors[kind] = pool
+        return pool
+
+    async def _offload(self, stage: str, func: Callable[..., Any], *args: Any, process: bool = False) -> Any:
+        """snapshotExecutor 开启时把快照处理交给单个工作线程/进程，关闭时直接在事件循环中执行。
+
+        process=True 的任务（只处理字节、结果可序列化）在 process 模式下进入子进程，其余始终用线程。
+        """
+        mode = self.snapshot_executor()
+        if not mode:
+            return func(*args)
+        kind = "process" if process and mode == "process" else "thread"
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor(kind), func, *args)
+        except BrokenExecutor as e:
+            logger.error(f"[FarmRankBot] snapshot {kind} worker died ({e}), running {stage} inline")
+            self._executors.pop(kind, None)
+            return func(*args)
+        finally:
+            self._metrics.observe("farm_offload_ms", (time.perf_counter() - started) * 1000, stage=stage, executor=kind)
+
+    def _shutdown_executors(self) -> None:
+        for pool in self._executors.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        self._executors.clear()
+
+    async def loop_lag_probe(self) -> None:
+        """定期测量事件循环的调度延迟：sleep 实际醒来的时间比预期晚了多少。"""
+        while self._running:
+            started = time.perf_counter()
+            await asyncio.sleep(LOOP_PROBE_INTERVAL_SEC)
+            lag = time.perf_counter() - started - LOOP_PROBE_INTERVAL_SEC
+            self._metrics.observe("farm_loop_lag_ms", max(0.0, lag) * 1000)
 
     # ----------------------------
     # Data shaping
     # ----------------------------
-    def _flatten_accounts(self, dashboard: Dict[str, Any]) -> List[Dict[str, Any]]:
-        if not dashboard:
-            return []
-        out: List[Dict[str, Any]] = []
-        for card in dashboard.get("cards") or []:
-            for acc in card.get("accounts") or []:
-                out.append(acc)
-        accounts = []
-        # 1. Card bound accounts
-        cards = dashboard.get("cards") or []
-        for card in cards:
-            accs = card.get("accounts") or []
-            accounts.extend(accs)
-        # 2. Unbound accounts
-        unbound = dashboard.get("unboundAccounts") or []
-        accounts.extend(unbound)
-        return accounts
-
-    def _online_accounts(self, dashboard: Dict[str, Any]) -> List[Dict[str, Any]]:
-        return [a for a in self._flatten_accounts(dashboard) if str(a.get("status") or "") == "online"]
-
-    def _all_accounts(self, dashboard: Dict[str, Any]) -> List[Dict[str, Any]]:
-        return self._flatten_accounts(dashboard)
-
-    def _acc_key(self, acc: Dict[str, Any]) -> str:
-        return str(acc.get("id") or f"gid-{acc.get('gid')}")
-
-    def _acc_display(self, acc: Dict[str, Any]) -> str:
-        name = str(acc.get("name") or "未知账号")
-        qq = str(acc.get("qqNumber") or "").strip()
-        platform = str(acc.get("platform") or "qq")
-        gid = _safe_int(acc.get("gid"), 0)
-        if platform == "qq" and qq:
-            return f"{name}(QQ:{qq})"
-        if qq:
-             return f"{name}(QQ:{qq})"
-        return f"{name}(GID:{gid})"
-
-    def _update_gain_base(self, online_accounts: List[Dict[str, Any]]) -> None:
+    def _account_index(self, dashboard: Optional[Dict[str, Any]]) -> AccountIndex:
+        # 同一快照对象只建一次索引，排行榜/告警/命令共享
+        if dashboard is not self._index_src:
+            self._index = AccountIndex(dashboard)
+            self._index_src = dashboard
+        return self._index
+
+    def _ingest_snapshot(self, dashboard: Dict[str, Any]) -> None:
+        """对新快照做一次指纹比对，把变化的账号推给榜单和告警；同一快照对象只处理一次。"""
+        if dashboard is self._diffed_dashboard:
+            return
+        started = time.perf_counter()
+        delta = build_snapshot_delta(dashboard, self._acc_fingerprints, self._account_index(dashboard))
+        self._apply_snapshot(dashboard, delta, started)
+
+    async def _ingest_offloaded(self, dashboard: Dict[str, Any]) -> None:
+        # 串行化：比对必须基于上一份已应用的指纹
+        async with self._ingest_lock:
+            if dashboard is self._diffed_dashboard:
+                return
+            delta = await self._offload("index", build_snapshot_delta, dashboard, self._acc_fingerprints)
+            self._apply_snapshot(dashboard, delta, time.perf_counter())
+
+    def _apply_snapshot(self, dashboard: Dict[str, Any], delta: SnapshotDelta, started: float) -> None:
+        self._diffed_dashboard = dashboard
+        self._index = delta.index
+        self._index_src = dashboard
+        # 用新字典整体替换，被删除的账号随之淘汰
+        self._acc_fingerprints = delta.fingerprints
+        changed, removed = delta.changed, delta.removed
+        self._status_changes += delta.status_changes
+        self._leaderboards.apply(changed, removed)
+        self._shards.apply(changed, removed)
+        if self.history_enabled():
+            self._history.ingest(time.time(), changed, removed)
+        for key in removed:
+            self._pending_changes.pop(key, None)
+        # 告警只看告警字段变化的账号；只有运行时长/收益变化的在线账号不进入告警检查
+        for rec in delta.alert_changed:
+            self._pending_changes[rec.key] = rec
+        # 消失的账号交给告警去重计时淘汰（在 _check_alerts 中按其时钟处理）
+        self._removed_keys.extend(removed)
+        if len(self._removed_keys) > self._alert_dedup.max_size:
+            # 长时间没有执行告警检查（如机器人未启用）时就地处理，避免列表本身无限增长
+            self._alert_dedup.removed(self._removed_keys, time.time())
+            self._removed_keys.clear()
+        # 事件循环上实际花费的时间；卸载模式下建索引的耗时记在 farm_offload_ms
+        self._metrics.observe("farm_ingest_ms", (time.perf_counter() - started) * 1000)
+        self._metrics.inc("farm_accounts_changed_total", len(changed))
+
+    def _changed_accounts(self, dashboard: Dict[str, Any]) -> List[AccountRecord]:
+        """返回自上次调用以来新出现或告警字段（status/reason/卡密/创建者）变化的账号。"""
+        self._ingest_snapshot(dashboard)
+        changed = list(self._pending_changes.values())
+        self._pending_changes.clear()
+        return changed
+
+    def _online_accounts(self, dashboard: Dict[str, Any]) -> List[AccountRecord]:
+        return self._account_index(dashboard).online
+
+    def _all_accounts(self, dashboard: Dict[str, Any]) -> List[AccountRecord]:
+        return self._account_index(dashboard).records
+
+    def _update_gain_base(self, online_accounts: List[AccountRecord]) -> None:
         online_keys = set()
         for acc in online_accounts:
-            key = self._acc_key(acc)
+            key = acc.key
             online_keys.add(key)
-            gold = float(acc.get("gold") or 0.0)
-            exp = float(acc.get("exp") or 0.0)
             if key not in self._gain_base:
-                self._gain_base[key] = {"gold_base": gold, "exp_base": exp, "created_at": float(_now_ts())}
+                base = {"gold_base": acc.gold, "exp_base": acc.exp, "created_at": float(_now_ts())}
+                self._gain_base[key] = base
+                self._persist("gain_base", key, json.dumps(base))
         # Clean up offline accounts from gain base?
         # Actually, if we want session gain, we should remove them.
         for key in list(self._gain_base.keys()):
             if key not in online_keys:
                 del self._gain_base[key]
+                self._persist("gain_base", key, None)
 
     # ----------------------------
     # Ranking builders
     # ----------------------------
-    def _rank_level(self, accounts: List[Dict[str, Any]]) -> str:
-        # Filter valid level > 0
-        valid = [a for a in accounts if _safe_int(a.get("level"), 0) > 0]
-        rows = sorted(valid, key=lambda x: _safe_int(x.get("level"), 0), reverse=True)[:10]
-        lines = ["🏆 等级排行榜"]
-        for i, acc in enumerate(rows, 1):
-            lv = _safe_int(acc.get("level"), 0)
-            status = "🟢" if str(acc.get("status")) == "online" else "🔴"
-            lines.append(f"{i}. {status} {self._acc_display(acc)} · Lv{lv}")
-        if len(lines) == 1:
-            lines.append("暂无数据。")
-        return "\n".join(lines)
+    def _top(self, name: str, scopes: Tuple[Scope, ...]) -> List[AccountRecord]:
+        if scopes:
+            return self._shards.top(scopes, name, RANK_TOP_K)
+        return getattr(self._leaderboards, name).top(RANK_TOP_K)
 
-    def _rank_online_time(self, accounts: List[Dict[str, Any]]) -> str:
-        # Filter runtime > 0
-        valid = [a for a in accounts if _safe_int(a.get("runtimeSec"), 0) > 0]
-        rows = sorted(valid, key=lambda x: _safe_int(x.get("runtimeSec"), 0), reverse=True)[:10]
-        lines = ["⏱ 累计运行时长排行榜"]
-        for i, acc in enumerate(rows, 1):
-            sec = _safe_int(acc.get("runtimeSec"), 0)
-            status = "🟢" if str(acc.get("status")) == "online" else "🔴"
-            lines.append(f"{i}. {status} {self._acc_display(acc)} · {_fmt_duration(sec)}")
-        if len(lines) == 1:
-            lines.append("暂无数据。")
-        return "\n".join(lines)
+    def _board_section(self, name: str, scopes: Tuple[Scope, ...] = ()) -> RankSection:
+        """榜单的结构化内容，文本和图片两种输出共用；scopes 非空时只取对应分片。"""
+        section = self._board_section_all(name, scopes)
+        if not scopes:
+            return section
+        title, rows, empty = section
+        return f"{title}｜{self._scope_label(scopes)}", rows, empty
 
-    def _rank_gold_gain(self, online_accounts: List[Dict[str, Any]]) -> str:
-        rows: List[Tuple[float, Dict[str, Any]]] = []
-        for acc in online_accounts:
-            income = acc.get("income") or {}
-            gain = float(income.get("gold") or 0.0)
-            rows.append((gain, acc))
-        rows.sort(key=lambda x: x[0], reverse=True)
-        lines = ["💰 金币收益排行榜（本轮在线）"]
-        for i, (gain, acc) in enumerate(rows[:10], 1):
-            lines.append(f"{i}. {self._acc_display(acc)} · +{int(gain):,}")
-        if len(lines) == 1:
-            lines.append("暂无可统计数据（账号在线一段时间后再查看）。")
-        return "\n".join(lines)
+    def _board_section_all(self, name: str, scopes: Tuple[Scope, ...]) -> RankSection:
+        if name in ("level", "level_online"):
+            rows = [(acc.online, acc.display, f"Lv{acc.level}") for acc in self._top(name, scopes)]
+            return "🏆 等级排行榜", rows, "暂无数据。"
+        if name in ("runtime", "runtime_online"):
+            rows = [(acc.online, acc.display, _fmt_duration(acc.runtime_sec)) for acc in self._top(name, scopes)]
+            return "⏱ 累计运行时长排行榜", rows, "暂无数据。"
+        if name == "gold":
+            rows = [(None, acc.display, f"+{int(acc.gold_gain):,}") for acc in self._top(name, scopes)]
+            return "💰 金币收益排行榜（本轮在线）", rows, "暂无可统计数据（账号在线一段时间后再查看）。"
+        if name == "exp":
+            rows = [(None, acc.display, f"+{int(acc.exp_gain):,}") for acc in self._top(name, scopes)]
+            return "📈 经验收益排行榜（本轮在线）", rows, "暂无可统计数据（账号在线一段时间后再查看）。"
+        if name == "online":
+            # 只用于图片：人数多时截断，标题里给出总数
+            online = sorted(self._scoped_online(scopes), key=lambda x: x.name)
+            title = f"👥 当前在线用户数：{len(online)}"
+            if len(online) > IMAGE_ONLINE_MAX_ROWS:
+                title += f"（显示前{IMAGE_ONLINE_MAX_ROWS}个）"
+            rows = [(None, acc.display, "") for acc in online[:IMAGE_ONLINE_MAX_ROWS]]
+            return title, rows, "当前没有在线账号。"
+        raise KeyError(name)
 
-    def _rank_exp_gain(self, online_accounts: List[Dict[str, Any]]) -> str:
-        rows: List[Tuple[float, Dict[str, Any]]] = []
-        for acc in online_accounts:
-            income = acc.get("income") or {}
-            gain = float(income.get("exp") or 0.0)
-            rows.append((gain, acc))
-        rows.sort(key=lambda x: x[0], reverse=True)
-        lines = ["📈 经验收益排行榜（本轮在线）"]
-        for i, (gain, acc) in enumerate(rows[:10], 1):
-            lines.append(f"{i}. {self._acc_display(acc)} · +{int(gain):,}")
-        if len(lines) == 1:
-            lines.append("暂无可统计数据（账号在线一段时间后再查看）。")
+    def _scoped_online(self, scopes: Tuple[Scope, ...]) -> List[AccountRecord]:
+        return self._shards.online(scopes) if scopes else self._index.online
+
+    @staticmethod
+    def _section_text(section: RankSection) -> str:
+        title, rows, empty = section
+        lines = [title]
+        for i, (online, display, value) in enumerate(rows, 1):
+            status = "" if online is None else ("🟢 " if online else "🔴 ")
+            lines.append(f"{i}. {status}{display} · {value}")
+        if not rows:
+            lines.append(empty)
         return "\n".join(lines)
 
-    def _online_summary(self, online_accounts: List[Dict[str, Any]]) -> str:
+    def _rank_level(self, online_only: bool = False, scopes: Tuple[Scope, ...] = ()) -> str:
+        return self._section_text(self._board_section("level_online" if online_only else "level", scopes))
+
+    def _rank_online_time(self, online_only: bool = False, scopes: Tuple[Scope, ...] = ()) -> str:
+        return self._section_text(self._board_section("runtime_online" if online_only else "runtime", scopes))
+
+    def _rank_gold_gain(self, scopes: Tuple[Scope, ...] = ()) -> str:
+        return self._section_text(self._board_section("gold", scopes))
+
+    def _rank_exp_gain(self, scopes: Tuple[Scope, ...] = ()) -> str:
+        return self._section_text(self._board_section("exp", scopes))
+
+    def _online_summary(self, online_accounts: List[AccountRecord]) -> str:
         lines = [f"👥 当前在线用户数：{len(online_accounts)}"]
         if not online_accounts:
             lines.append("当前没有在线账号。")
             return "\n".join(lines)
-        for acc in sorted(online_accounts, key=lambda x: str(x.get("name") or "")):
-            lines.append(f"- {self._acc_display(acc)}")
+        for acc in sorted(online_accounts, key=lambda x: x.name):
+            lines.append(f"- {acc.display}")
+        return "\n".join(lines)
+
+    def _rank_window(self, window_sec: int, scopes: Tuple[Scope, ...] = ()) -> str:
+        now = time.time()
+        label = _fmt_window(window_sec)
+        start = self._history.window_start(now, window_sec)
+        if start < now - window_sec:
+            label += f"（自{datetime.fromtimestamp(start).strftime('%m-%d %H:%M')}起）"
+        if scopes:
+            # 分片只含当前快照中的账号，已删除的账号不再计入范围榜
+            lines = [f"📊 近{label}收益排行榜｜{self._scope_label(scopes)}"]
+            keys: Optional[List[str]] = self._shards.keys(scopes)
+        else:
+            lines = [f"📊 近{label}收益排行榜（含已离线账号）"]
+            keys = None
+        for title, field in (("💰 金币", 0), ("📈 经验", 1)):
+            lines.append(title)
+            rows = self._history.top(now, window_sec, field, RANK_TOP_K, keys)
+            for i, (display, gain) in enumerate(rows, 1):
+                lines.append(f"{i}. {display} · +{int(gain):,}")
+            if not rows:
+                lines.append("暂无数据。")
+        return "\n".join(lines)
+
+    def _render(self, name: str, scopes: Tuple[Scope, ...] = ()) -> str:
+        """渲染指定榜单，同一快照版本内命中缓存直接返回。"""
+        cache = self._render_cache
+        cache.ttl_sec = self.render_cache_ttl_sec()
+        cache.max_size = self.render_cache_size()
+        key = (name, scopes, self._dashboard_version)
+        text = cache.get(key)
+        if text is None:
+            started = time.perf_counter()
+            text = self._build_rank(name, scopes)
+            board = name.partition(":")[0]
+            self._metrics.observe("farm_render_ms", (time.perf_counter() - started) * 1000, board=board)
+            cache.put(key, text)
+        return text
+
+    def _build_rank(self, name: str, scopes: Tuple[Scope, ...] = ()) -> str:
+        if name == "level":
+            return self._rank_level(scopes=scopes)
+        if name == "level_online":
+            return self._rank_level(online_only=True, scopes=scopes)
+        if name == "runtime":
+            return self._rank_online_time(scopes=scopes)
+        if name == "runtime_online":
+            return self._rank_online_time(online_only=True, scopes=scopes)
+        if name == "gold":
+            return self._rank_gold_gain(scopes)
+        if name == "exp":
+            return self._rank_exp_gain(scopes)
+        if name == "online":
+            return self._online_summary(self._scoped_online(scopes))
+        if name.startswith("window:"):
+            return self._rank_window(int(name[len("window:"):]), scopes)
+        raise KeyError(name)
+
+    def _image_renderer_get(self) -> Optional[LeaderboardImageRenderer]:
+        if not self.image_rank_enabled() or not LeaderboardImageRenderer.available():
+            return None
+        font = LeaderboardImageRenderer.find_font(str(self.merged_cfg().get("imageFontPath") or "").strip())
+        if not font:
+            if not self._image_font_warned:
+                self._image_font_warned = True
+                logger.warning("[FarmRankBot] no CJK font found (set imageFontPath), leaderboards fall back to text")
+            return None
+        if self._image_renderer is None or self._image_renderer.font_path != font:
+            self._image_renderer = LeaderboardImageRenderer(font)
+        return self._image_renderer
+
+    async def _render_image(self, names: List[str], scopes: Tuple[Scope, ...] = ()) -> Optional[str]:
+        """把若干榜单渲染成一张图片，返回 CQ 码；不可用或失败时返回 None，由调用方退回文本。
+
+        图片按榜单内容缓存，前 K 名不变时直接复用；绘制在线程池中进行，同样内容的并发请求只画一次。
+        """
+        renderer = self._image_renderer_get()
+        if renderer is None:
+            return None
+        sections: List[RankSection] = []
+        for name in names:
+            title, rows, empty = self._board_section(name, scopes)
+            rows = [(online, _strip_emoji(display) or display, value) for online, display, value in rows]
+            sections.append((_strip_emoji(title), rows, empty))
+        sig = renderer.signature(sections)
+        png = renderer.cached(sig)
+        if png is None:
+            fut = self._image_inflight.get(sig)
+            owner = fut is None
+            if owner:
+                if self._image_pool is None:
+                    self._image_pool = ThreadPoolExecutor(IMAGE_RENDER_WORKERS, thread_name_prefix="farm-rank-img")
+                started = time.perf_counter()
+                fut = asyncio.get_running_loop().run_in_executor(self._image_pool, renderer.render, sections)
+                self._image_inflight[sig] = fut
+            try:
+                png = await asyncio.shield(fut)
+            except Exception as e:
+                logger.error(f"[FarmRankBot] leaderboard image render failed: {e}")
+                return None
+            finally:
+                if owner:
+                    self._image_inflight.pop(sig, None)
+            if owner:
+                board = "image:" + "+".join(names)
+                self._metrics.observe("farm_render_ms", (time.perf_counter() - started) * 1000, board=board)
+        return f"[CQ:image,file=base64://{base64.b64encode(png).decode()}]"
+
+    def backends_status_text(self) -> str:
+        breaker_text = {"closed": "正常", "open": "熔断中", "half-open": "探测中"}
+        lines = []
+        for b in self._backends:
+            if b.dashboard is None:
+                age = "无数据"
+            else:
+                age = f"{time.time() - b.dashboard_at:.0f}秒前" + ("" if b.snapshot_fresh() else "(拉取失败，已过期)")
+            lines.append(
+                f"[{b.label}] {b.api_url}\n"
+                f"  Token: {'已设置' if b.auth.token else '未设置'} · 近1小时登录{b.auth.logins_last_hour()}次"
+                f" · {breaker_text[b.breaker.state]}"
+                f"(熔断{b.breaker.trips}次) · 快照{age}\n"
+                f"  推送通道: {'WebSocket' if b.ws_connected else 'HTTP轮询'} (重连{b.ws_reconnects}次)"
+            )
         return "\n".join(lines)
 
+    def render_cache_stats_text(self) -> str:
+        c = self._render_cache
+        total = c.hits + c.misses
+        rate = f"{c.hits * 100 / total:.0f}%" if total else "-"
+        r = self._image_renderer
+        image = f"绘制{r.stats['renders']}次 / 复用{r.stats['hits']}次" if r is not None else "未启用"
+        return (
+            f"渲染缓存: 命中{c.hits} / 未命中{c.misses} (命中率 {rate}, {len(c)}条)\n"
+            f"图片榜单: {image}\n"
+            f"Dashboard拉取: {self._fetch_stats['fetches']}次 (合并{self._fetch_stats['coalesced']}次)"
+        )
+
     # ----------------------------
     # Send and alert
     # ----------------------------
-    async def send_group_msg(self, group_id: int, text: str) -> None:
-        if not self.bot:
-            # Retry fetching bot
-            if hasattr(self.context, "get_bot"):
-                self.bot = self.context.get_bot()
-            elif hasattr(self.context, "bot"):
-                self.bot = self.context.bot
-        
+    async def send_group_msg(self, group_id: int, text: str, merge: bool = False) -> None:
+        """放入发送队列后立即返回；merge=True 的告警会在合并窗口内汇总成一条。"""
+        self._dispatcher.submit(int(group_id), text, merge)
+
+    def _discover_bots(self) -> List[Tuple[str, Any]]:
+        """发送池的 bot 来源：各平台适配器的客户端、context.get_bots()，以及从指令事件里捕获的 self.bot。"""
+        found: List[Tuple[str, Any]] = []
+        seen_objs: set = set()
+
+        def add(key: Any, bot: Any) -> None:
+            if bot is None or id(bot) in seen_objs or not hasattr(bot, "send_group_msg"):
+                return
+            key = str(key)
+            keys = {k for k, _ in found}
+            base, n = key, 1
+            while key in keys:
+                n += 1
+                key = f"{base}#{n}"
+            seen_objs.add(id(bot))
+            found.append((key, bot))
+
+        ctx = self.context
+        manager = getattr(ctx, "platform_manager", None)
+        for inst in list(getattr(manager, "platform_insts", None) or []):
+            client = inst.get_client() if hasattr(inst, "get_client") else None
+            meta = inst.meta() if hasattr(inst, "meta") else None
+            add(getattr(meta, "id", None) or f"platform{len(found)}", client)
+        if hasattr(ctx, "get_bots"):
+            for bot in ctx.get_bots() or []:
+                add(getattr(bot, "self_id", None) or f"bot{len(found)}", bot)
         if not self.bot:
-            logger.error("[FarmRankBot] bot instance missing (still None after retry)")
-            return
+            if hasattr(ctx, "get_bot"):
+                self.bot = ctx.get_bot()
+            elif hasattr(ctx, "bot"):
+                self.bot = ctx.bot
+        add(getattr(self.bot, "self_id", None) or "default", self.bot)
+        return found
 
+    async def _send_via(self, bot: Any, group_id: int, text: str) -> None:
+        started = time.perf_counter()
         try:
-            await self.bot.send_group_msg(group_id=int(group_id), message=text)
-        except Exception as e:
-            logger.error(f"[FarmRankBot] send_group_msg failed: {e}")
+            await bot.send_group_msg(group_id=group_id, message=text)
+        except Exception:
+            self._metrics.inc("farm_send_attempts_total", result="error")
+            raise
+        self._metrics.inc("farm_send_attempts_total", result="ok")
+        self._metrics.observe("farm_send_ms", (time.perf_counter() - started) * 1000)
+
+    def bots_status_text(self) -> str:
+        pool = self._bots
+        pool.refresh()
+        owned: Dict[str, int] = {}
+        for gid in set(self.all_group_ids()) | set(self._group_scopes):
+            key = pool.owner(gid)
+            if key:
+                owned[key] = owned.get(key, 0) + 1
+        st = pool.stats
+        budget = f"每个{pool.rate_per_min:g}条/分钟" if pool.rate_per_min > 0 else "额度不限"
+        lines = [
+            f"发送账号: {len(pool.live)}个 ({budget} · 顺延{st['failovers']} · 溢出{st['spills']} · 额度等待{st['waits']})"
+        ]
+        now = time.monotonic()
+        for slot in pool.slots.values():
+            if slot.bot is None:
+                state = "已消失"
+            elif slot.down_until > now:
+                state = f"冷却{slot.down_until - now:.0f}s"
+            else:
+                state = "正常"
+            avg = slot.send_sec / slot.sent * 1000 if slot.sent else 0.0
+            lines.append(
+                f"  [{slot.key}] {state} · 群{owned.get(slot.key, 0)}个 · 成功{slot.sent} · 失败{slot.failed} · "
+                f"接管{slot.took_over} · 平均{avg:.0f}ms"
+            )
+        return "\n".join(lines)
+
+    def poll_status_text(self) -> str:
+        p = self._poll
+        mode = "自适应" if p.enabled else "固定"
+        return (
+            f"轮询间隔: {p.interval():.1f}秒 ({mode} {p.min_sec:g}-{p.max_sec:g}秒 · "
+            f"后台延迟{p.latency * 1000:.0f}ms · 错误率{p.error_rate * 100:.0f}%)"
+        )
+
+    def recorder_status_text(self) -> str:
+        r = self._recorder
+        if not r.enabled:
+            return "快照录制: 关闭"
+        st = r.stats
+        return (
+            f"快照录制: {st['frames']}帧 (关键帧{st['keyframes']}次) · {st['bytes'] / 1048576:.1f}MB · "
+            f"积压{r.depth} · 丢弃{st['dropped']} · 失败{st['errors']}"
+        )
+
+    def send_stats_text(self) -> str:
+        d = self._dispatcher
+        avg, p95 = d.latency_ms()
+        return (
+            f"发送队列: 积压{d.depth} · 成功{d.stats['sent']} · 失败{d.stats['failed']} · "
+            f"重试{d.stats['retries']} · 合并{d.stats['merged']}\n"
+            f"发送延迟: 平均{avg:.0f}ms / P95 {p95:.0f}ms"
+        )
 
     async def _push_random_rank(self, dashboard: Dict[str, Any]) -> None:
-        group_ids = self.parse_group_ids()
-        if not group_ids:
+        # 合并后的全局榜单推送到全局群以及各后台的群
+        group_ids = self.all_group_ids()
+        scoped = self.scoped_group_ids()
+        if not group_ids and not scoped:
             return
+        self._ingest_snapshot(dashboard)
         online = self._online_accounts(dashboard)
-        all_accs = self._all_accounts(dashboard)
 
         self._update_gain_base(online)
 
-        def rank_level_wrapper(_): return self._rank_level(all_accs)
-        def rank_time_wrapper(_): return self._rank_online_time(all_accs)
-        def rank_gold_wrapper(_): return self._rank_gold_gain(online)
-        def rank_exp_wrapper(_): return self._rank_exp_gain(online)
-        def online_summary_wrapper(_): return self._online_summary(online)
-
-        builders = [
-            rank_level_wrapper,
-            rank_time_wrapper,
-            rank_gold_wrapper,
-            rank_exp_wrapper,
-            online_summary_wrapper,
-        ]
-        text = random.choice(builders)(None)
-        final_text = f"{text}\n\n{self.ad_text()}"
-        for gid in group_ids:
-            await self.send_group_msg(gid, final_text)
+        name = random.choice(["level", "runtime", "gold", "exp", "online"])
+        if group_ids:
+            text = await self._render_image([name]) or self._render(name)
+            final_text = f"{text}\n\n{self.ad_text()}"
+            for gid in group_ids:
+                await self.send_group_msg(gid, final_text)
+        # 范围群推送自己分片的同一榜单；范围内暂无账号的群跳过
+        for gid in scoped:
+            scopes = self._group_scopes[gid]
+            if not self._shards.size(scopes):
+                continue
+            text = await self._render_image([name], scopes) or self._render(name, scopes)
+            await self.send_group_msg(gid, f"{text}\n\n{self.ad_text()}")
 
-    async def _check_alerts(self, dashboard: Dict[str, Any]) -> None:
+    async def _check_alerts(self, dashboard: Dict[str, Any], now: Optional[float] = None) -> None:
+        now = time.time() if now is None else now
+        # 告警关闭时也要淘汰去重状态，否则消失账号的 key 会一直攒着
+        self._ingest_snapshot(dashboard)
+        self._expire_alert_dedup(dashboard, now)
         if not self.alert_enabled():
             return
-        group_ids = self.parse_group_ids()
-        if not group_ids:
+        if not self.all_group_ids() and not self._group_scopes:
             return
 
+        # 用户偏好的格式
+        time_str = datetime.fromtimestamp(now).strftime('%H:%M')
+
+        # 增量模式只检查告警字段变化的账号（未变化账号的 status|reason 签名必然相同）
+        if self.incremental_enabled():
+            candidates = self._changed_accounts(dashboard)
+        else:
+            candidates = self._all_accounts(dashboard)
+        self._alert_dedup.present(acc.key for acc in candidates)
 
-        # 遍历所有账号，检查是否需要发送告警
-        for acc in self._flatten_accounts(dashboard):
-            status = str(acc.get("status") or "")
-            reason = str(acc.get("statusReason") or "").strip()
+        # 先按 (后台, 原因) 归组，再交给风暴检测决定逐条发送还是汇总
+        groups: "OrderedDict[Tuple[str, str], Tuple[AlertClassification, List[AccountRecord]]]" = OrderedDict()
+        for acc in candidates:
+            status = acc.status
+            reason = acc.reason
             if not reason and status == "online":
                 continue
 
-            key = self._acc_key(acc)
-            sig = f"{status}|{reason}"
-            if self._last_alert_sig.get(key) == sig:
+            if not self._alert_dedup.check(acc.key, f"{status}|{reason}"):
                 continue
-            self._last_alert_sig[key] = sig
-
-            reason_low = reason.lower()
-            is_alert = (
-                ("remote_login" in reason_low)
-                or ("reconnect_failed" in reason_low)
-                or ("error" in reason_low)
-                or (status in ("offline", "error") and reason)
-            )
+
+            cls = self._classifier.classify(reason)
+            is_alert = cls.force_alert or (status in ("offline", "error") and reason)
             if not is_alert:
                 continue
+            group = groups.get((acc.backend, reason))
+            if group is None:
+                group = groups[(acc.backend, reason)] = (cls, [])
+            group[1].append(acc)
 
-            title = "⚠ 账号状态告警"
-            error_desc = self.ERROR_MAP.get(reason_low, reason)
-            
-            # 尝试通过关键词匹配 ERROR_MAP
-            if not error_desc or error_desc == reason:
-                for k, v in self.ERROR_MAP.items():
-                    if k in reason_low:
-                        error_desc = v
-                        break
-
-            if "remote_login" in reason_low:
-                title = "🚨 异地登录告警"
-            elif "reconnect_failed" in reason_low:
-                title = "🚨 重连失败告警"
-            elif "password" in reason_low or "verify" in reason_low:
-                title = "🔑 密码/验证码错误"
-            elif "network" in reason_low or "timeout" in reason_low:
-                title = "🌐 网络连接超时"
-
-            # 用户偏好的格式
-            from datetime import datetime
-            time_str = datetime.now().strftime('%H:%M')
-            qq_num = str(acc.get("qqNumber") or "")
-            account_id = str(acc.get("id") or "")
-            note = self._acc_display(acc)
-            final_reason = title
-            matched_raw = reason
-            
-            logger.info(f"[FarmRankBot] Alert Triggered for {qq_num}: {reason_low}")
-
-            content = (
-                f"⛈️ 【庄园灾害预警】\n"
-                f"伙计: {note} (工号:{account_id})\n"
-                f"判定: {final_reason} ({error_desc})\n"
-                f"原始: {matched_raw}\n"
-                f"时间: {time_str}\n"
-                f"处理: 已将该伙计遣返。"
-            )
+        for (backend, reason), (cls, accounts) in groups.items():
+            group_ids = self.backend_group_ids(backend)
+            # (路由, 目标群, 账号)：路由 0 是后台的全局群，范围群各自一路，风暴也各自计数
+            routes = [(0, group_ids, accounts)] if group_ids else []
+            for gid, scoped in self._scoped_alert_targets(accounts).items():
+                if gid not in group_ids:
+                    routes.append((gid, [gid], scoped))
+            for route, gids, accs in routes:
+                accs, storm = self._storms.feed(now, reason, cls, accs, scope=backend, route=route)
+                if storm is not None:
+                    logger.warning(
+                        f"[FarmRankBot] Alert storm detected: {backend or '-'} {reason} x{storm.suppressed}"
+                        f"{f' (group {route})' if route else ''}"
+                    )
+                    msg = self._storm_message(storm, time_str)
+                    for gid in gids:
+                        await self.send_group_msg(gid, msg)
+                for acc in accs:
+                    await self._send_account_alert(acc, cls, time_str, gids)
 
-            # 获取 QQ 号用于 @ 提醒（如果有的话）
-            at_qq = str(acc.get("qqNumber") or "").strip()
-            
-            # 发送告警到所有配置的群
-            for gid in group_ids:
-                # 使用 CQ 码格式，参考 main_example.py
-                msg = content
-                if at_qq:
-                    msg = f"[CQ:at,qq={at_qq}]\n{content}"
-                
+        index = self._account_index(dashboard)
+        for storm in self._storms.recovered(now):
+            logger.info(f"[FarmRankBot] Alert storm recovered: {storm.scope or '-'} {storm.reason}")
+            msg = self._storm_recovery_message(storm, index, now)
+            for gid in [storm.route] if storm.route else self.backend_group_ids(storm.scope):
                 await self.send_group_msg(gid, msg)
 
+    def _expire_alert_dedup(self, dashboard: Dict[str, Any], now: float) -> None:
+        dedup = self._alert_dedup
+        dedup.reconcile((rec.key for rec in self._account_index(dashboard).records), now)
+        dedup.removed(self._removed_keys, now)
+        self._removed_keys.clear()
+        expired = dedup.expire(now)
+        if expired:
+            logger.info(f"[FarmRankBot] Alert dedup: expired {expired} entries of removed accounts")
+
+    async def _send_account_alert(
+        self, acc: AccountRecord, cls: AlertClassification, time_str: str, group_ids: List[int]
+    ) -> None:
+        title = cls.title
+        error_desc = cls.desc
+
+        qq_num = acc.qq
+        account_id = acc.id
+        note = acc.display
+        final_reason = title
+        matched_raw = acc.reason
+
+        logger.info(f"[FarmRankBot] Alert Triggered for {qq_num}: {acc.reason}")
+
+        content = (
+            f"⛈️ 【庄园灾害预警】\n"
+            f"{self._backend_line(acc.backend)}"
+            f"伙计: {note} (工号:{account_id})\n"
+            f"判定: {final_reason} ({error_desc})\n"
+            f"原始: {matched_raw}\n"
+            f"时间: {time_str}\n"
+            f"处理: 已将该伙计遣返。"
+        )
+
+        # 获取 QQ 号用于 @ 提醒（如果有的话）
+        at_qq = acc.qq
+
+        # 发送告警到所有配置的群
+        for gid in group_ids:
+            # 使用 CQ 码格式，参考 main_example.py
+            msg = content
+            if at_qq:
+                msg = f"[CQ:at,qq={at_qq}]\n{content}"
+
+            await self.send_group_msg(gid, msg, merge=True)
+
+    def _backend_line(self, backend: str) -> str:
+        # 只有配置了多个后台时才标注来源
+        if len(self._backends) <= 1:
+            return ""
+        return f"后台: {backend or self._primary.label}\n"
+
+    def _storm_message(self, storm: AlertStorm, time_str: str) -> str:
+        samples = "、".join(storm.samples)
+        more = f" 等{storm.suppressed}个" if storm.suppressed > len(storm.samples) else ""
+        return (
+            f"🌩️ 【庄园告警风暴】\n"
+            f"{self._backend_line(storm.scope)}"
+            f"判定: {storm.title} ({storm.desc})\n"
+            f"原始: {storm.reason}\n"
+            f"规模: {int(self._storms.window_sec)}秒内 {storm.suppressed} 个账号，涉及卡密 {len(storm.cards)} 张\n"
+            f"示例: {samples}{more}\n"
+            f"时间: {time_str}\n"
+            f"处理: 同类告警暂停逐条推送，恢复后汇总通知。"
+        )
+
+    def _storm_recovery_message(self, storm: AlertStorm, index: AccountIndex, now: float) -> str:
+        back_online = sum(1 for k in storm.keys if (rec := index.by_key.get(k)) is not None and rec.online)
+        return (
+            f"🌤️ 【告警风暴已平息】\n"
+            f"{self._backend_line(storm.scope)}"
+            f"原始: {storm.reason}\n"
+            f"持续: {_fmt_duration(int(storm.last_at - storm.started_at))}\n"
+            f"影响: {len(storm.keys)} 个账号 / 卡密 {len(storm.cards)} 张，累计 {storm.suppressed} 条告警已合并\n"
+            f"现状: 已恢复在线 {back_online}/{len(storm.keys)}"
+        )
+
     async def _check_announcement(self) -> None:
-        group_ids = self.parse_group_ids()
+        await asyncio.gather(*(self._check_backend_announcement(b) for b in self._backends))
+
+    async def _check_backend_announcement(self, b: AdminBackend) -> None:
+        group_ids = self.backend_group_ids(b.name)
         if not group_ids:
             return
+        # 熔断中的后台跳过，等恢复后再检查
+        if b.breaker.state == "open":
+            return
+        # 后台会推送公告变更时，只在收到事件后或兜底间隔到了才请求
+        now = time.time()
+        if b.pushes("announcement") and now - b.announcement_at < ANNOUNCEMENT_PUSH_POLL_SEC:
+            return
 
         # Use base API URL (remove /admin suffix if present)
-        base_url = self.api_url.replace("/api/admin", "/api")
-        url = f"{base_url}/system/announcement"
+        base_url = b.api_url.replace("/api/admin", "/api")
+        url = f"{base_url}{ANNOUNCEMENT_PATH}"
         
+        headers = {}
+        cached = b.cond_cache.get(ANNOUNCEMENT_PATH)
+        if cached:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, timeout=10) as resp:
-                    if resp.status != 200:
-                        return
-                    js = await resp.json()
-                    if not js or not js.get("ok"):
-                        return
-                    data = js.get("data") or {}
+            async with self._http().get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=b.timeout_sec)) as resp:
+                if resp.status == 304 and cached:
+                    self._cond_stats["not_modified"] += 1
+                    b.announcement_at = now
+                    return
+                if resp.status != 200:
+                    return
+                js = _json_loads(await resp.read())
+                if not js or not js.get("ok"):
+                    return
+                data = js.get("data") or {}
+                b.announcement_at = now
+                self._cond_stats["modified"] += 1
+                etag = resp.headers.get("ETag")
+                last_modified = resp.headers.get("Last-Modified")
+                if etag or last_modified:
+                    b.cond_cache[ANNOUNCEMENT_PATH] = {"etag": etag, "last_modified": last_modified}
         except Exception as e:
-            logger.error(f"[FarmRankBot] check announcement failed: {e}")
+            logger.error(f"[FarmRankBot] check announcement failed ({b.label}): {e}")
             return
+        self._recorder.record("announcement", b.name, data)
+        await self._handle_announcement(b, data)
 
+    async def _handle_announcement(self, b: AdminBackend, data: Dict[str, Any]) -> None:
+        group_ids = self.backend_group_ids(b.name)
         if not data.get("enabled"):
             return
             
         content = str(data.get("content") or "").strip()
         update_time = float(data.get("updatedAt") or 0)
         level = str(data.get("level") or "info")
+        last_ts = self._announcement_ts.get(b.name, 0.0)
         
         # Only push if it's a new update (buffer 10s to avoid duplicate if clock skew?)
         # Actually just strictly greater
-        if update_time > self._last_announcement_ts and self._last_announcement_ts > 0:
+        if update_time > last_ts and last_ts > 0:
             logger.info(f"[FarmRankBot] New announcement detected: {content[:20]}...")
             
             prefix = "📢 公告"
             if level == "warning": prefix = "⚠️ 重要通知"
             if level == "alert": prefix = "🚨 紧急警报"
             
-            msg = f"{prefix}\n━━━━━━━━━━━━━━━\n{content}\n━━━━━━━━━━━━━━━\n"
+            msg = f"{prefix}\n{self._backend_line(b.name)}━━━━━━━━━━━━━━━\n{content}\n━━━━━━━━━━━━━━━\n"
             
             for gid in group_ids:
                 await self.send_group_msg(gid, msg)
         
         # Update timestamp (even if we didn't push because it was the first fetch)
         # On startup we don't push old announcements, only new ones starting now.
-        if self._last_announcement_ts == 0.0:
-             self._last_announcement_ts = update_time
-        else:
-             self._last_announcement_ts = max(self._last_announcement_ts, update_time)
+        new_ts = update_time if last_ts == 0.0 else max(last_ts, update_time)
+        if new_ts != last_ts:
+            self._announcement_ts[b.name] = new_ts
+            meta_key = f"last_announcement_ts:{b.name}" if b.name else "last_announcement_ts"
+            self._persist("meta", meta_key, str(new_ts))
+
+    # ----------------------------
+    # Metrics and profiling
+    # ----------------------------
+    def _collect_metrics(self) -> Iterable[Tuple[str, Dict[str, Any], float]]:
+        # 抓取时才计算的瞬时值
+        d = self._dispatcher
+        yield "farm_send_queue_depth", {}, d.depth
+        for k, v in d.stats.items():
+            yield "farm_send_messages_total", {"result": k}, v
+        yield "farm_send_queue_latency_p95_ms", {}, d.latency_ms()[1]
+        yield "farm_accounts", {}, len(self._index.records)
+        yield "farm_accounts_online", {}, len(self._index.online)
+        yield "farm_dashboard_version", {}, self._dashboard_version
+        yield "farm_render_cache_hits_total", {}, self._render_cache.hits
+        yield "farm_render_cache_misses_total", {}, self._render_cache.misses
+        yield "farm_dashboard_fetches_total", {}, self._fetch_stats["fetches"]
+        yield "farm_dashboard_coalesced_total", {}, self._fetch_stats["coalesced"]
+        yield "farm_history_keys", {}, len(self._history.keys)
+        yield "farm_alert_storms_active", {}, len(self._storms.active)
+        yield "farm_alert_dedup_entries", {}, len(self._alert_dedup)
+        yield "farm_alert_dedup_pending_expiry", {}, self._alert_dedup.gone
+        yield "farm_alert_dedup_evicted_total", {}, self._alert_dedup.evicted
+        yield "farm_state_dirty", {}, self._state.dirty if self._state is not None else 0
+        r = self._recorder
+        yield "farm_record_frames_total", {}, r.stats["frames"]
+        yield "farm_record_bytes_total", {}, r.stats["bytes"]
+        yield "farm_record_dropped_total", {}, r.stats["dropped"]
+        yield "farm_record_queue_depth", {}, r.depth
+        yield "farm_process_rss_bytes", {}, _rss_bytes()
+        for b in self._backends:
+            labels = {"backend": b.name or "primary"}
+            yield "farm_backend_ws_connected", labels, int(b.ws_connected)
+            yield "farm_backend_circuit_open", labels, int(b.breaker.state == "open")
+            yield "farm_backend_snapshot_age_ms", labels, (time.time() - b.dashboard_at) * 1000 if b.dashboard_at else -1
+            yield "farm_backend_snapshot_fresh", labels, int(b.snapshot_fresh())
+            yield "farm_backend_logins_last_hour", labels, b.auth.logins_last_hour()
+        for job in self._scheduler.jobs.values():
+            yield "farm_job_skips_total", {"job": job.name}, job.skips
+        now = time.monotonic()
+        for slot in self._bots.slots.values():
+            labels = {"bot": slot.key}
+            yield "farm_bot_up", labels, int(slot.bot is not None and slot.down_until <= now)
+            yield "farm_bot_sent_total", labels, slot.sent
+            yield "farm_bot_failed_total", labels, slot.failed
+            yield "farm_bot_took_over_total", labels, slot.took_over
+            # 与各 *_ms 直方图统一用毫秒
+            yield "farm_bot_send_ms_total", labels, slot.send_sec * 1000
+        for k, v in self._bots.stats.items():
+            yield "farm_bot_pool_events_total", {"event": k}, v
+        p = self._poll
+        yield "farm_poll_interval_ms", {}, p.interval() * 1000
+        yield "farm_poll_latency_ewma_ms", {}, p.latency * 1000
+        yield "farm_poll_error_rate", {}, p.error_rate
+        for k, v in p.stats.items():
+            yield "farm_poll_adjustments_total", {"direction": k}, v
+
+    async def _metrics_handler(self, request: web.Request) -> web.Response:
+        return web.Response(text=self._metrics.render_prometheus(), content_type="text/plain", charset="utf-8")
+
+    async def _ensure_metrics_server(self) -> None:
+        """metricsPort > 0 时在本地端口暴露 Prometheus 文本格式的 /metrics；配置变化时重启。"""
+        c = self.merged_cfg()
+        bind = (str(c.get("metricsHost") or "127.0.0.1"), _safe_int(c.get("metricsPort"), 0))
+        if bind == self._metrics_bind:
+            return
+        await self._stop_metrics_server()
+        self._metrics_bind = bind
+        if bind[1] <= 0:
+            return
+        app = web.Application()
+        app.router.add_get("/metrics", self._metrics_handler)
+        runner = web.AppRunner(app, access_log=None)
+        try:
+            await runner.setup()
+            await web.TCPSite(runner, bind[0], bind[1]).start()
+        except Exception as e:
+            logger.error(f"[FarmRankBot] metrics endpoint on {bind[0]}:{bind[1]} failed: {e}")
+            await runner.cleanup()
+            return
+        self._metrics_runner = runner
+        logger.info(f"[FarmRankBot] metrics endpoint: http://{bind[0]}:{bind[1]}/metrics")
+
+    async def _stop_metrics_server(self) -> None:
+        if self._metrics_runner is not None:
+            await self._metrics_runner.cleanup()
+            self._metrics_runner = None
+        self._metrics_bind = ("", 0)
+
+    def metrics_status_text(self) -> str:
+        m = self._metrics
+        lines = []
+        for name in m.label_values("farm_job_duration_ms", "job"):
+            h = m.histogram("farm_job_duration_ms", job=name)
+            lines.append(f"- {name}: P50 {h.quantile(0.5):.0f}ms / P95 {h.quantile(0.95):.0f}ms ({h.count}次)")
+        http = m.histogram("farm_http_request_ms")
+        render = m.histogram("farm_render_ms")
+        send = m.histogram("farm_send_ms")
+        ingest = m.histogram("farm_ingest_ms")
+        rss = _rss_bytes()
+        growth = (rss - self._rss_start) / 1048576 if rss and self._rss_start else 0.0
+        lines.append(f"HTTP耗时: P50 {http.quantile(0.5):.0f}ms / P95 {http.quantile(0.95):.0f}ms ({http.count}次)")
+        lines.append(f"快照比对: P95 {ingest.quantile(0.95):.1f}ms · 榜单渲染: P95 {render.quantile(0.95):.1f}ms")
+        lines.append(f"单条发送: P95 {send.quantile(0.95):.0f}ms")
+        lag = m.histogram("farm_loop_lag_ms")
+        mode = {"thread": "工作线程", "process": "工作进程"}.get(self.snapshot_executor(), "事件循环内")
+        lines.append(f"事件循环延迟: P50 {lag.quantile(0.5):.0f}ms / P99 {lag.quantile(0.99):.0f}ms (快照处理: {mode})")
+        lines.append(f"内存: RSS {rss / 1048576:.0f}MB (启动以来 {growth:+.1f}MB)")
+        return "\n".join(lines)
+
+    async def profile_window(self, seconds: float) -> str:
+        """在 seconds 秒内对事件循环做 cProfile 采样，返回自身耗时最高的函数，完整报告写入数据目录。"""
+        if self._profiling:
+            return "已有性能分析在进行中。"
+        self._profiling = True
+        prof = cProfile.Profile()
+        ticks_before = sum(job.runs for job in self._scheduler.jobs.values())
+        prof.enable()
+        try:
+            self._scheduler.wake("alerts")
+            await asyncio.sleep(seconds)
+        finally:
+            prof.disable()
+            self._profiling = False
+        ticks = sum(job.runs for job in self._scheduler.jobs.values()) - ticks_before
+
+        stream = io.StringIO()
+        stats = pstats.Stats(prof, stream=stream)
+        stats.sort_stats("tottime").print_stats(PROFILE_DUMP_ROWS)
+        path = os.path.join(os.path.dirname(STATE_DB_PATH), f"profile-{datetime.now():%Y%m%d-%H%M%S}.txt")
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(stream.getvalue())
+        except Exception as e:
+            logger.error(f"[FarmRankBot] write profile failed: {e}")
+            path = ""
+
+        # 事件循环空闲时阻塞在 select/epoll 上，不算热点
+        busy = [kv for kv in stats.stats.items() if not (kv[0][0] == "~" and "poll" in kv[0][2])]
+        rows = sorted(busy, key=lambda kv: kv[1][2], reverse=True)[:PROFILE_TOP_N]
+        lines = [f"🔬 性能分析 {seconds:.0f}秒 · 任务执行{ticks}次 · 总耗时{stats.total_tt * 1000:.0f}ms"]
+        for (filename, lineno, func), (_cc, calls, tottime, cumtime, _callers) in rows:
+            where = f"{os.path.basename(filename)}:{lineno}" if lineno else filename
+            lines.append(f"{tottime * 1000:.1f}ms / 累计{cumtime * 1000:.1f}ms · {calls}次 · {func} ({where})")
+        if path:
+            lines.append(f"完整报告: {path}")
+        return "\n".join(lines)
 
     # ----------------------------
     # Scheduler
     # ----------------------------
     async def scheduler_loop(self) -> None:
         await asyncio.sleep(2)
-        while self._running:
-            now = time.time()
-            try:
-                # 每5分钟同步一次配置（降低频率）
-                if now - self._last_settings_sync >= 300:
-                    await self.sync_settings()
-                    self._last_settings_sync = now
+        if not self._running:
+            return
+        s = self._scheduler
+        # 主后台推送配置变更事件时收到即同步，定时任务只做兜底
+        s.add("settings", self.sync_settings, self.settings_interval_sec, jitter=5, timeout=20)
+        # WebSocket 推送到达时会被提前唤醒
+        # 间隔由 PollController 按状态变化与后台延迟调整
+        s.add("alerts", self._job_alerts, self._poll.interval, jitter=0.2, timeout=30, enabled=self.bot_enabled)
+        s.add("announcement", self._check_announcement, lambda: 2, jitter=0.5, timeout=15, enabled=self.bot_enabled)
+        s.add("rank_push", self._job_rank_push, self.rank_interval_sec, timeout=60, enabled=self.bot_enabled)
+        s.add("state_flush", self.flush_state, lambda: 5, timeout=30)
+        await s.run()
 
-                if not self.bot_enabled():
-                    await asyncio.sleep(5)
-                    continue
+    async def _job_alerts(self) -> None:
+        dashboard = await self.get_dashboard()
+        if dashboard:
+            await self._check_alerts(dashboard)
+        if self._poll.update(self._status_changes):
+            # 下次执行时间是按旧的长间隔排的，提前
+            self._scheduler.reschedule("alerts")
+        self._status_changes = 0
 
-                dashboard = await self.get_dashboard()
-                if dashboard:
-                    await self._check_alerts(dashboard)
-                    await self._check_announcement()
-                    if now - self._last_push_at >= self.rank_interval_sec():
-                        await self._push_random_rank(dashboard)
-                        self._last_push_at = now
-            except Exception as e:
-                logger.error(f"[FarmRankBot] scheduler error: {e}")
+    async def _job_rank_push(self) -> None:
+        # 与告警任务共享同一份快照（TTL 内不重复拉取）
+        dashboard = await self.recent_dashboard()
+        if dashboard:
+            await self._push_random_rank(dashboard)
 
-            await asyncio.sleep(2)
+    async def terminate(self) -> None:
+        # 插件卸载/重载时由 AstrBot 调用
+        self._running = False
+        # 先停掉进行中的告警/推送/落盘任务，再关闭发送队列、HTTP 会话和状态库
+        await self._scheduler.stop()
+        for b in self._backends:
+            if b.ws_task is not None:
+                b.ws_task.cancel()
+        await self._dispatcher.close()
+        await self._stop_metrics_server()
+        if self._image_pool is not None:
+            self._image_pool.shutdown(wait=False)
+            self._image_pool = None
+        self._shutdown_executors()
+        await asyncio.get_running_loop().run_in_executor(None, self._recorder.close)
+        await self.close_http()
+        if self._state_flush is not None and not self._state_flush.done():
+            # 线程池里还在写的那一批先写完，最后一次 flush 才能接着写剩下的
+            try:
+                await asyncio.shield(self._state_flush)
+            except Exception as e:
+                logger.error(f"[FarmRankBot] state flush in progress failed: {e}")
+        if self._state is not None:
+            try:
+                self._state.flush()
+            except Exception as e:
+                logger.error(f"[FarmRankBot] state flush on shutdown failed: {e}")
+            self._state.close()
+            self._state = None
 
     # ----------------------------
     # Commands
@@ -568,40 +4587,81 @@ class FarmRankBot(Star):
             self.bot = event.bot
             logger.info("[FarmRankBot] Captured bot instance from online_cmd")
 
-        dashboard = await self.get_dashboard()
+        dashboard = await self.recent_dashboard()
         if not dashboard:
             yield event.plain_result("读取在线数据失败，请稍后重试。")
             return
-        online = self._online_accounts(dashboard)
-        yield event.plain_result(self._online_summary(online))
+        arg = str(getattr(event, "message_str", "") or "").strip()
+        scopes, err = self._resolve_scopes(event, re.sub(r"^/?在线人数", "", arg).strip())
+        if err:
+            yield event.plain_result(err)
+            return
+        image = await self._render_image(["online"], scopes)
+        yield event.plain_result(image or self._render("online", scopes))
 
     @filter.command("排行榜")
     async def rank_cmd(self, event: AstrMessageEvent):
+        """全体或指定范围的排行榜，如：/排行榜、/排行榜 <卡密>、/排行榜 代理 <ID>"""
         if not self.bot and hasattr(event, "bot"):
             self.bot = event.bot
             logger.info("[FarmRankBot] Captured bot instance from rank_cmd")
 
-        dashboard = await self.get_dashboard()
+        dashboard = await self.recent_dashboard()
         if not dashboard:
             yield event.plain_result("读取排行榜失败，请稍后重试。")
             return
+        arg = str(getattr(event, "message_str", "") or "").strip()
+        scopes, err = self._resolve_scopes(event, re.sub(r"^/?排行榜", "", arg).strip())
+        if err:
+            yield event.plain_result(err)
+            return
         online = self._online_accounts(dashboard)
         self._update_gain_base(online)
+        image = await self._render_image(["level_online", "runtime_online", "gold", "exp"], scopes)
+        if image:
+            # 图片底部自带生成时间
+            yield event.plain_result(f"{image}\n{self.ad_text()}")
+            return
         # 添加当前时间戳
-        from datetime import datetime
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         timestamp_header = f"📅 {current_time}\n━━━━━━━━━━━━━━━\n"
         
         text = "\n\n".join(
             [
-                self._rank_level(online),
-                self._rank_online_time(online),
-                self._rank_gold_gain(online),
-                self._rank_exp_gain(online),
+                self._render("level_online", scopes),
+                self._render("runtime_online", scopes),
+                self._render("gold", scopes),
+                self._render("exp", scopes),
             ]
         )
         yield event.plain_result(f"{timestamp_header}{text}\n\n{self.ad_text()}")
 
+    @filter.command("收益榜")
+    async def window_rank_cmd(self, event: AstrMessageEvent):
+        """按时间窗口统计收益排行，如：/收益榜 24h、/收益榜 7d"""
+        arg = str(getattr(event, "message_str", "") or "").strip()
+        arg = re.sub(r"^/?收益榜", "", arg).strip()
+        window = _parse_window(arg)
+        if window is None:
+            yield event.plain_result(f"窗口格式示例：/收益榜 30m、/收益榜 24h、/收益榜 7d（最长{HISTORY_DAY_RETENTION}天）")
+            return
+        dashboard = await self.recent_dashboard()
+        if not dashboard:
+            yield event.plain_result("读取排行榜失败，请稍后重试。")
+            return
+        scopes = self._event_scopes(event)
+        yield event.plain_result(f"{self._render(f'window:{window}', scopes)}\n\n{self.ad_text()}")
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("性能分析")
+    async def profile_cmd(self, event: AstrMessageEvent):
+        """对插件做一段时间的 cProfile 采样，如：/性能分析 30"""
+        arg = str(getattr(event, "message_str", "") or "").strip()
+        arg = re.sub(r"^/?性能分析", "", arg).strip()
+        seconds = min(PROFILE_MAX_SEC, max(1, _safe_int(arg, 10)))
+        yield event.plain_result(f"开始采样 {seconds} 秒...")
+        yield event.plain_result(await self.profile_window(seconds))
+
     @filter.command("状态")
     async def test_cmd(self, event: AstrMessageEvent):
         """测试指令：检查机器人状态和连接"""
@@ -619,15 +4679,21 @@ class FarmRankBot(Star):
         
         # 尝试获取dashboard数据
         dashboard = await self.get_dashboard()
-        api_status = "✅ API连接正常" if dashboard else "❌ API连接失败"
+        if not dashboard:
+            api_status = "❌ API连接失败"
+        elif all(b.snapshot_fresh() for b in self._backends):
+            api_status = "✅ API连接正常"
+        else:
+            stale = "、".join(b.label for b in self._backends if not b.snapshot_fresh())
+            api_status = f"⚠️ 部分后台快照过期: {stale}"
         
         # 统计在线账号数
         online_count = 0
         total_accounts = 0
         if dashboard:
-            online = self._online_accounts(dashboard)
-            online_count = len(online)
-            total_accounts = sum(len(c.get("accounts", [])) for c in dashboard.get("cards", []))
+            index = self._account_index(dashboard)
+            online_count = len(index.online)
+            total_accounts = index.bound_count
         
         # 构建响应文本
         text = (
@@ -638,8 +4704,19 @@ class FarmRankBot(Star):
             f"{api_status}\n"
             f"在线账号: {online_count}/{total_accounts}\n"
             f"━━━━━━━━━━━━━━━\n"
-            f"配置URL: {self.api_url}\n"
-            f"Token: {'已设置' if self.token else '未设置'}\n"
+            f"{self.backends_status_text()}\n"
+            f"告警去重: {len(self._alert_dedup)}条 (待淘汰{self._alert_dedup.gone} · 已淘汰{self._alert_dedup.evicted})\n"
+            f"{self.recorder_status_text()}\n"
+            f"分片: 卡密{len(self._shards.cards)}张 · 代理{len(self._shards.agents)}个 · "
+            f"范围群{len(self._group_scopes)}个\n"
+            f"{self.http_stats_text()}\n"
+            f"{self.render_cache_stats_text()}\n"
+            f"{self.send_stats_text()}\n"
+            f"{self.bots_status_text()}\n"
+            f"调度任务:\n{self._scheduler.stats_text()}\n"
+            f"耗时分布:\n{self.metrics_status_text()}\n"
+            f"条件请求: 变化{self._cond_stats['modified']} / 未变化{self._cond_stats['not_modified']}\n"
+            f"{self.poll_status_text()}\n"
             f"推送间隔: {self.rank_interval_sec()}秒"
         )
         
@@ -0,0 +1,1692 @@
+"""FarmRankBot (main.py) 性能基准。
+
+需在装有 AstrBot 的 Python 环境中运行（main.py 依赖 astrbot.api）：
+
+    python scripts/bench-farm-rank-bot.py topk --sizes 10000,50000,100000
+    python scripts/bench-farm-rank-bot.py alerts
+    python scripts/bench-farm-rank-bot.py storm --accounts 500
+    python scripts/bench-farm-rank-bot.py auth --concurrency 50
+    python scripts/bench-farm-rank-bot.py load --accounts 1000,10000 --groups 50 --out results.json
+    python scripts/bench-farm-rank-bot.py load --compare results.json
+    python scripts/bench-farm-rank-bot.py parse --accounts 50000
+    python scripts/bench-farm-rank-bot.py lag --accounts 20000 --modes inline,thread,process
+    python scripts/bench-farm-rank-bot.py soak --accounts 3000 --days 28
+    python scripts/bench-farm-rank-bot.py config --duration 60
+    python scripts/bench-farm-rank-bot.py bots --bots 1,4 --messages 300 --groups 30
+    python scripts/bench-farm-rank-bot.py poll --phase-sec 20
+    python scripts/bench-farm-rank-bot.py poll --phase-sec 20 --ws
+    python scripts/bench-farm-rank-bot.py record --accounts 20000 --out /tmp/farm-rec
+    python scripts/bench-farm-rank-bot.py replay data/plugin_data/farm_rank_bot/recordings --from "2026-10-16 22:00" --dump out.jsonl
+"""
+
+import argparse
+import asyncio
+import gc
+import hashlib
+import json
+import math
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import main as farm_main  # noqa: E402
+from main import (  # noqa: E402
+    ERROR_MAP,
+    RANK_TOP_K,
+    RECORD_QUEUE_SIZE,
+    TOKEN_MIN_TTL_SEC,
+    AccountIndex,
+    AccountRecord,
+    AlertClassifier,
+    AlertStormDetector,
+    FarmRankBot,
+    Leaderboards,
+    SnapshotRecorder,
+    _json_dumps,
+    default_alert_rules,
+    prune_dashboard,
+    read_recording,
+    recording_files,
+)
+
+# 后端实际写入的 statusReason（src/core/account.ts、src/store/account-store.ts、卡密管理等）
+STATUS_REASON_CORPUS = [
+    "", "cached", "paused", "server_restarted", "relogin_failed", "reconnect_failed", "remote_login",
+    "Card Disabled by Admin", "Card Deleted by Admin", "network_error", "timeout", "other_login",
+    "password_error", "verify_code", "device_lock", "unknown", "ECONNRESET", "ETIMEDOUT",
+    "socket hang up", "ws connection failed", "Request failed with status code 403",
+    "connect ETIMEDOUT 1.2.3.4:443 (network_error)", "SOCKS5 proxy handshake timeout",
+]
+
+
+def synth_account(i: int, rnd: random.Random) -> Dict[str, Any]:
+    # 字段与 src/admin/controllers/dashboard.ts 的 AdminAccountView 一致
+    return {
+        "id": f"acc-{i}",
+        "gid": 100000 + i,
+        "name": f"农场主{i}",
+        "platform": "qq" if i % 5 else "wx",
+        "level": rnd.randint(0, 120),
+        "status": "online" if rnd.random() < 0.7 else "offline",
+        "statusReason": "",
+        "runtimeSec": rnd.randint(0, 3_000_000),
+        "proxy": f"socks5://10.0.{i % 256}.{i % 97}:1080",
+        "latestLog": "[巡田] 收获 12 块地，种植 12 块地",
+        "recentLogs": ["[巡田] 收获 12 块地", "[好友] 偷菜 3 次", "[任务] 领取奖励", "[仓库] 出售果实", "[巡田] 浇水 4 次"],
+        "baseExp": rnd.randint(0, 2_000_000),
+        "qqNumber": str(10000000 + i),
+        "income": {"gold": rnd.randint(0, 5_000_000), "exp": rnd.randint(0, 200_000)},
+        "levelUpEtaSec": rnd.randint(0, 86400),
+    }
+
+
+def synth_dashboard(n: int, seed: int = 1, per_card: int = 3) -> Dict[str, Any]:
+    rnd = random.Random(seed)
+    cards = []
+    for c in range(0, n, per_card):
+        accounts = [synth_account(i, rnd) for i in range(c, min(n, c + per_card))]
+        # 字段与 AdminCardView 一致
+        cards.append({
+            "id": f"card-{c}",
+            "code": f"CARD{c:08d}",
+            "type": "月卡",
+            "expiresAt": 1_900_000_000_000,
+            "maxBind": per_card,
+            "boundUserId": "",
+            "boundCount": len(accounts),
+            "onlineCount": sum(1 for a in accounts if a["status"] == "online"),
+            "status": "active",
+            "statusText": "已激活",
+            "note": "",
+            "accounts": accounts,
+            "creatorId": f"agent-{c % 17}",
+        })
+    total = sum(card["onlineCount"] for card in cards)
+    return {"cards": cards, "totalSessions": total, "unboundAccounts": [], "agentBalance": 0, "role": "author", "id": "admin"}
+
+
+def churn_dashboard(dashboard: Dict[str, Any], rnd: random.Random, churn: float, drop: float) -> None:
+    """模拟一个 tick 内的变化：churn 比例的账号收益增长，drop 比例的账号掉线/恢复。"""
+    accounts = [acc for card in dashboard["cards"] for acc in card["accounts"]]
+    for acc in rnd.sample(accounts, max(1, int(len(accounts) * churn))):
+        acc["income"] = {"gold": acc["income"]["gold"] + rnd.randint(1, 5000), "exp": acc["income"]["exp"] + rnd.randint(1, 200)}
+        acc["runtimeSec"] += 2
+    for acc in rnd.sample(accounts, int(len(accounts) * drop)):
+        if acc["status"] == "online":
+            acc["status"] = "offline"
+            acc["statusReason"] = rnd.choice(STATUS_REASON_CORPUS[1:])
+        else:
+            acc["status"] = "online"
+            acc["statusReason"] = ""
+
+
+def full_sort_render(records: List[AccountRecord]) -> int:
+    # 旧实现：每次渲染对四个字段各做一次全量排序
+    online = [r for r in records if r.online]
+    rows = sorted([r for r in records if r.level > 0], key=lambda x: x.level, reverse=True)[:RANK_TOP_K]
+    rows += sorted([r for r in records if r.runtime_sec > 0], key=lambda x: x.runtime_sec, reverse=True)[:RANK_TOP_K]
+    rows += sorted(online, key=lambda x: x.gold_gain, reverse=True)[:RANK_TOP_K]
+    rows += sorted(online, key=lambda x: x.exp_gain, reverse=True)[:RANK_TOP_K]
+    return len(rows)
+
+
+def topk_render(boards: Leaderboards) -> int:
+    rows = boards.level.top(RANK_TOP_K)
+    rows += boards.runtime.top(RANK_TOP_K)
+    rows += boards.gold.top(RANK_TOP_K)
+    rows += boards.exp.top(RANK_TOP_K)
+    return len(rows)
+
+
+def bench_topk(sizes: List[int], ticks: int, churn: float) -> None:
+    print(f"{'accounts':>9} {'full sort/render':>17} {'top-K render':>13} {'top-K update/tick':>18} {'build':>9}")
+    for n in sizes:
+        rnd = random.Random(n)
+        index = AccountIndex(synth_dashboard(n))
+        records = index.records
+
+        t0 = time.perf_counter()
+        for _ in range(ticks):
+            full_sort_render(records)
+        full_ms = (time.perf_counter() - t0) * 1000 / ticks
+
+        t0 = time.perf_counter()
+        boards = Leaderboards()
+        boards.apply(records, [])
+        topk_render(boards)
+        build_ms = (time.perf_counter() - t0) * 1000
+
+        # 每个 tick 随机改动 churn 比例的账号，然后渲染四个榜单
+        changed_per_tick = max(1, int(n * churn))
+        update_s = 0.0
+        render_s = 0.0
+        for _ in range(ticks):
+            changed = []
+            for rec in rnd.sample(records, changed_per_tick):
+                acc = synth_account(int(rec.key.split("-")[1]), rnd)
+                changed.append(AccountRecord(acc))
+            t0 = time.perf_counter()
+            boards.apply(changed, [])
+            t1 = time.perf_counter()
+            topk_render(boards)
+            render_s += time.perf_counter() - t1
+            update_s += t1 - t0
+        print(
+            f"{n:>9} {full_ms:>14.2f} ms {render_s * 1000 / ticks:>10.3f} ms "
+            f"{update_s * 1000 / ticks:>15.2f} ms {build_ms:>6.0f} ms"
+        )
+
+
+def legacy_classify(error_map: Dict[str, str], status: str, reason: str):
+    # 旧版 _check_alerts 中逐账号执行的分类逻辑
+    reason_low = reason.lower()
+    is_alert = (
+        ("remote_login" in reason_low)
+        or ("reconnect_failed" in reason_low)
+        or ("error" in reason_low)
+        or (status in ("offline", "error") and reason)
+    )
+    if not is_alert:
+        return None
+    title = "⚠ 账号状态告警"
+    error_desc = error_map.get(reason_low, reason)
+    if not error_desc or error_desc == reason:
+        for k, v in error_map.items():
+            if k in reason_low:
+                error_desc = v
+                break
+    if "remote_login" in reason_low:
+        title = "🚨 异地登录告警"
+    elif "reconnect_failed" in reason_low:
+        title = "🚨 重连失败告警"
+    elif "password" in reason_low or "verify" in reason_low:
+        title = "🔑 密码/验证码错误"
+    elif "network" in reason_low or "timeout" in reason_low:
+        title = "🌐 网络连接超时"
+    return title, error_desc
+
+
+def bench_alerts(n: int) -> None:
+    error_map = dict(ERROR_MAP)
+    rules = default_alert_rules(error_map)
+
+    rnd = random.Random(7)
+    samples = [(rnd.choice(["offline", "error", "online"]), rnd.choice(STATUS_REASON_CORPUS)) for _ in range(n)]
+
+    engine = AlertClassifier(rules)
+    for status, reason in samples:
+        old = legacy_classify(error_map, status, reason)
+        cls = engine.classify(reason)
+        new = (cls.title, cls.desc) if (cls.force_alert or (status in ("offline", "error") and reason)) else None
+        assert old == new, (status, reason, old, new)
+
+    t0 = time.perf_counter()
+    for status, reason in samples:
+        legacy_classify(error_map, status, reason)
+    legacy_us = (time.perf_counter() - t0) * 1e6 / n
+
+    t0 = time.perf_counter()
+    cold = AlertClassifier(rules, memo_size=0)
+    for _, reason in samples:
+        cold.classify(reason)
+    cold_us = (time.perf_counter() - t0) * 1e6 / n
+
+    t0 = time.perf_counter()
+    for _, reason in samples:
+        engine.classify(reason)
+    warm_us = (time.perf_counter() - t0) * 1e6 / n
+
+    print(f"{n} classifications over {len(STATUS_REASON_CORPUS)} distinct reasons (results identical)")
+    print(f"legacy substring scan : {legacy_us:.2f} us/account")
+    print(f"compiled, no memo     : {cold_us:.2f} us/account")
+    print(f"compiled + memo       : {warm_us:.2f} us/account")
+
+
+def bench_storm(n: int, threshold: int) -> None:
+    # 场景：后端代理故障，n 个账号在 3 个 tick 内以同一原因掉线，
+    # 同时有零星的其他原因告警；之后全部恢复上线。
+    engine = AlertClassifier(default_alert_rules(dict(ERROR_MAP)))
+    detector = AlertStormDetector()
+    detector.configure({"stormThreshold": threshold, "stormWindowSec": 60, "stormRecoverySec": 120})
+    index = AccountIndex(synth_dashboard(n))
+    records = index.records
+
+    storm_reason = "SOCKS5 proxy handshake timeout"
+    sent_individual = 0
+    storms = []
+    now = 1_000_000.0
+    for tick in range(3):
+        batch = records[tick::3]
+        plan = {storm_reason: batch}
+        plan["remote_login"] = [records[tick]]
+        for reason, accounts in plan.items():
+            individual, storm = detector.feed(now, reason, engine.classify(reason), accounts)
+            sent_individual += len(individual)
+            if storm is not None:
+                storms.append(storm)
+        now += 2
+
+    assert len(storms) == 1 and storms[0].reason == storm_reason, storms
+    assert not detector.recovered(now + 60)
+    recovered = detector.recovered(now + 120)
+    assert [st.reason for st in recovered] == [storm_reason]
+
+    total = n + 3
+    print(f"{total} alerts in 3 ticks (threshold {threshold})")
+    print(f"without storm detection : {total} messages per group")
+    print(f"with storm detection    : {sent_individual} individual + {len(storms)} storm + {len(recovered)} recovery")
+    print(f"storm absorbed          : {recovered[0].suppressed} alerts / {len(recovered[0].cards)} cards")
+    asyncio.run(storm_replay(n, threshold))
+
+
+async def storm_replay(n: int, threshold: int) -> None:
+    """按快照序列走一遍 FarmRankBot._check_alerts（去重、群路由、风暴/恢复消息都是真实路径）：
+    全部在线 → 大批账号 network_error 掉线（其间一个账号 remote_login）→ 状态不变的快照 → 全部恢复 → 静默到恢复判定。"""
+    if n * 2 // 3 // 2 < threshold:
+        print(f"\nsnapshot replay skipped: needs at least {threshold * 3} accounts so the first wave reaches the threshold")
+        return
+    groups = (1, 2)
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp(prefix="farm-rank-bot-"))
+    try:
+        bot = FarmRankBot(SimpleNamespace(bot=SinkBot()))
+        bot._running = False
+        bot.cfg = {
+            "groupIds": ",".join(map(str, groups)), "historyEnabled": False,
+            "stormThreshold": threshold, "stormWindowSec": 60, "stormRecoverySec": 120,
+        }
+        bot._storms.configure(bot.merged_cfg())
+        sent: List[Tuple[int, str]] = []
+
+        async def capture(group_id: int, text: str, merge: bool = False) -> None:
+            sent.append((group_id, text))
+
+        bot.send_group_msg = capture
+        base = synth_dashboard(n)
+        accounts = [acc for card in base["cards"] for acc in card["accounts"]]
+        for acc in accounts:
+            acc["status"], acc["statusReason"] = "online", ""
+        dropped = accounts[: n * 2 // 3]
+        lone = accounts[-1]
+
+        def snapshot() -> Dict[str, Any]:
+            # 每个 tick 都是新对象，与真实拉取一致（同一对象只比对一次）
+            return json.loads(json.dumps(base))
+
+        now = 1_000_000.0
+        timeline: List[Tuple[float, str]] = []
+
+        async def tick(label: str) -> None:
+            before = len(sent)
+            await bot._check_alerts(snapshot(), now)
+            timeline.append((now, f"{label}: {len(sent) - before} messages"))
+
+        await tick("baseline, all online")
+        now += 2
+        for acc in dropped[: len(dropped) // 2]:
+            acc["status"], acc["statusReason"] = "offline", "network_error"
+        await tick(f"{len(dropped) // 2} accounts network_error")
+        now += 2
+        for acc in dropped[len(dropped) // 2:]:
+            acc["status"], acc["statusReason"] = "offline", "network_error"
+        lone["status"], lone["statusReason"] = "offline", "remote_login"
+        await tick(f"+{len(dropped) - len(dropped) // 2} network_error, 1 remote_login")
+        for _ in range(3):
+            now += 2
+            await tick("unchanged")
+        now += 4
+        for acc in accounts:
+            acc["status"], acc["statusReason"] = "online", ""
+        await tick("all back online")
+        while now < 1_000_000.0 + 4 + 120:
+            now += 10
+            await tick("quiet")
+        await bot.terminate()
+    finally:
+        os.chdir(cwd)
+
+    for gid in groups:
+        texts = [t for g, t in sent if g == gid]
+        storms = [t for t in texts if "【庄园告警风暴】" in t]
+        recoveries = [t for t in texts if "【告警风暴已平息】" in t]
+        individual = [t for t in texts if "【庄园灾害预警】" in t]
+        assert len(storms) == 1, (gid, storms)
+        assert len(recoveries) == 1, (gid, recoveries)
+        # 风暴原因的逐条告警全部被吞掉，只剩不同原因的那一条
+        assert len(individual) == 1 and "remote_login" in individual[0], (gid, individual)
+        assert len(texts) == 3, (gid, texts)
+    print(f"\nsnapshot replay through _check_alerts ({n} accounts, groups {groups}):")
+    for _, line in timeline:
+        if not line.startswith("quiet") or not line.endswith(" 0 messages"):
+            print(f"  {line}")
+    print(f"  per group: 1 storm + 1 recovery + 1 remote_login alert; {len(dropped)} network_error alerts suppressed")
+
+
+class StubAdminServer:
+    """本地模拟的后台管理接口：登录慢、按 5次/分钟 限流，token 可被整体作废（模拟后台重启）。"""
+
+    def __init__(self, login_delay: float = 0.05):
+        self.login_delay = login_delay
+        self.tokens: set = set()
+        self.login_hits: List[float] = []
+        self.throttled = 0
+        self.login_down = False
+        self.expires_in = 0
+        self.runner: Any = None
+        self.url = ""
+        self.dashboard_body: Optional[bytes] = None
+        self.bot_config: Dict[str, Any] = {"enabled": False}
+        self.announcement: Dict[str, Any] = {"id": "default", "content": "", "level": "info", "enabled": False, "updatedAt": 0}
+        self.hits: Dict[str, int] = {}
+        # etag：/settings 与公告带弱 ETag、支持 304；push：/ws 在 auth_ok 中声明并推送 settings/announcement 事件
+        self.etag = False
+        self.push = False
+        self.ws_clients: set = set()
+        # /dashboard 的额外延迟与故障注入
+        self.dashboard_delay = 0.0
+        self.dashboard_down = False
+
+    async def login(self, request: web.Request) -> web.Response:
+        now = time.time()
+        recent = [t for t in self.login_hits if now - t < 60]
+        self.login_hits.append(now)
+        if len(recent) >= 5:
+            self.throttled += 1
+            return web.json_response({"ok": False, "error": "Too many attempts. Retry in 60s"}, status=429)
+        await asyncio.sleep(self.login_delay)
+        if self.login_down:
+            return web.json_response({"ok": False, "error": "unavailable"}, status=503)
+        token = f"adm-{len(self.login_hits)}"
+        self.tokens.add(token)
+        body: Dict[str, Any] = {"ok": True, "token": token, "role": "author"}
+        if self.expires_in:
+            body["expiresIn"] = self.expires_in
+        return web.json_response(body)
+
+    def _authorized(self, request: web.Request) -> bool:
+        return request.headers.get("Authorization", "")[len("Bearer "):] in self.tokens
+
+    def set_dashboard(self, dashboard: Dict[str, Any]) -> None:
+        # 预先序列化，避免把模拟后台的 JSON 编码耗时算进插件的 tick
+        self.dashboard_body = json.dumps({"ok": True, "data": dashboard}, ensure_ascii=False).encode()
+
+    async def dashboard(self, request: web.Request) -> web.Response:
+        self.hits["dashboard"] = self.hits.get("dashboard", 0) + 1
+        if not self._authorized(request):
+            return web.json_response({"ok": False, "error": "Unauthorized"}, status=401)
+        if self.dashboard_delay:
+            await asyncio.sleep(self.dashboard_delay)
+        if self.dashboard_down:
+            return web.json_response({"ok": False, "error": "internal error"}, status=500)
+        if self.dashboard_body is None:
+            self.set_dashboard(synth_dashboard(30))
+        return web.Response(body=self.dashboard_body, content_type="application/json")
+
+    def _json(self, request: web.Request, name: str, payload: Dict[str, Any]) -> web.Response:
+        body = json.dumps(payload, ensure_ascii=False).encode()
+        if not self.etag:
+            return web.Response(body=body, content_type="application/json")
+        etag = f'W/"{hashlib.sha1(body).hexdigest()}"'
+        if request.headers.get("If-None-Match") == etag:
+            self.hits[f"{name}_304"] = self.hits.get(f"{name}_304", 0) + 1
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.Response(body=body, content_type="application/json", headers={"ETag": etag})
+
+    async def settings(self, request: web.Request) -> web.Response:
+        self.hits["settings"] = self.hits.get("settings", 0) + 1
+        if not self._authorized(request):
+            return web.json_response({"ok": False, "error": "Unauthorized"}, status=401)
+        return self._json(request, "settings", {"ok": True, "data": {"botConfig": self.bot_config}})
+
+    async def system_announcement(self, request: web.Request) -> web.Response:
+        self.hits["announcement"] = self.hits.get("announcement", 0) + 1
+        return self._json(request, "announcement", {"ok": True, "data": self.announcement})
+
+    async def ws(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        msg = await ws.receive_json()
+        if msg.get("token") not in self.tokens:
+            await ws.send_json({"type": "auth_fail"})
+            await ws.close()
+            return ws
+        ok: Dict[str, Any] = {"type": "auth_ok"}
+        if self.push:
+            ok["events"] = ["snapshot", "alert", "settings", "announcement"]
+        await ws.send_json(ok)
+        self.ws_clients.add(ws)
+        try:
+            while not ws.closed:
+                if self.dashboard_body is None:
+                    self.set_dashboard(synth_dashboard(30))
+                dashboard = json.loads(self.dashboard_body)["data"]
+                await ws.send_json({"type": "snapshot", "ts": int(time.time() * 1000), "data": {"dashboard": dashboard}})
+                await asyncio.sleep(1)
+        except (ConnectionResetError, aiohttp.ClientConnectionResetError):
+            pass
+        finally:
+            self.ws_clients.discard(ws)
+        return ws
+
+    async def broadcast(self, kind: str) -> None:
+        # 与 src/admin/server.ts 的 setSystemChangeCallback 一致：只通知类型，由客户端自行拉取
+        if self.push:
+            for ws in list(self.ws_clients):
+                await ws.send_json({"type": kind, "ts": int(time.time() * 1000)})
+
+    async def update_settings(self, bot_config: Dict[str, Any]) -> None:
+        self.bot_config = bot_config
+        await self.broadcast("settings")
+
+    async def update_announcement(self, content: str) -> None:
+        self.announcement = dict(self.announcement, content=content, enabled=True, updatedAt=int(time.time() * 1000))
+        await self.broadcast("announcement")
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post("/api/admin/login", self.login)
+        app.router.add_get("/api/admin/dashboard", self.dashboard)
+        app.router.add_get("/api/admin/settings", self.settings)
+        app.router.add_get("/api/system/announcement", self.system_announcement)
+        app.router.add_get("/ws", self.ws)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/api/admin"
+
+    def restart(self) -> None:
+        self.tokens.clear()
+        self.login_hits.clear()
+
+
+async def naive_burst(server: StubAdminServer, n: int) -> int:
+    # 旧实现：每个请求拿不到 token / 收到 401 时各自登录
+    token = ""
+
+    async def one(session: aiohttp.ClientSession) -> None:
+        nonlocal token
+        for _ in range(2):
+            if not token:
+                async with session.post(f"{server.url}/login", json={"password": "x"}) as resp:
+                    if resp.status != 200:
+                        return
+                    token = (await resp.json())["token"]
+            async with session.get(f"{server.url}/dashboard", headers={"Authorization": f"Bearer {token}"}) as resp:
+                if resp.status != 401:
+                    return
+                token = ""
+
+    before = len(server.login_hits)
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(one(session) for _ in range(n)))
+    return len(server.login_hits) - before
+
+
+async def bench_auth(n: int) -> None:
+    server = StubAdminServer()
+    await server.start()
+    cwd = os.getcwd()
+    tmp = tempfile.mkdtemp(prefix="farm-rank-bot-")
+    os.chdir(tmp)
+    try:
+        bot = FarmRankBot(SimpleNamespace())
+        bot._running = False
+        b = bot._primary
+        b.api_url = server.url
+        auth = b.auth
+
+        async def burst() -> int:
+            results = await asyncio.gather(*(bot._authed_get("/dashboard", backend=b) for _ in range(n)))
+            return sum(1 for js in results if js and js.get("ok"))
+
+        ok = await burst()
+        print(f"cold start     : {n} concurrent requests, {ok} ok, logins={auth.stats['logins']}")
+        assert ok == n and auth.stats["logins"] == 1
+
+        server.restart()
+        ok = await burst()
+        print(f"server restart : {n} concurrent 401s, {ok} ok, logins={auth.stats['logins']}, throttled={server.throttled}")
+        assert ok == n and auth.stats["logins"] == 2 and server.throttled == 0
+
+        server.restart()
+        naive = naive_burst(server, n)
+        print(f"naive client   : {await naive} login attempts for the same burst, throttled={server.throttled}")
+        server.restart()
+        server.throttled = 0
+
+        # 后台返回短有效期：到期前的请求触发一次后台续期，且不等待续期完成（把签发时间往前拨，模拟时间流逝）
+        server.expires_in = TOKEN_MIN_TTL_SEC
+        auth.reset()
+        await burst()
+        elapsed = TOKEN_MIN_TTL_SEC * 0.85
+        auth.issued_at -= elapsed
+        auth.expires_at -= elapsed
+        t0 = time.perf_counter()
+        ok = await burst()
+        wait_ms = (time.perf_counter() - t0) * 1000
+        await asyncio.sleep(0.1)
+        print(f"renewal        : {ok} ok in {wait_ms:.0f}ms, renewals={auth.stats['renewals']}, logins={auth.stats['logins']}")
+        assert ok == n and auth.stats["renewals"] == 1
+
+        # 后台给出已经过去的有效期：按最短有效期计，很快续期，而不是退回默认的 6 小时
+        server.expires_in = -60
+        auth.reset()
+        ok = await burst()
+        ttl = auth.expires_at - time.time()
+        print(f"expired ttl    : {ok} ok, token kept for {ttl:.0f}s")
+        assert ok == n and ttl <= TOKEN_MIN_TTL_SEC
+        server.expires_in = 0
+
+        # 登录失败后退避：退避期内的请求直接失败，不再打登录接口
+        server.restart()
+        server.login_down = True
+        auth.reset()
+        before = len(server.login_hits)
+        for _ in range(3):
+            await burst()
+        attempts = len(server.login_hits) - before
+        print(f"login down     : {3 * n} requests -> {attempts} login attempt(s), retry in {auth.retry_at - time.time():.1f}s")
+        assert attempts == 1
+        print(f"logins in last hour: {auth.logins_last_hour()} {auth.stats}")
+        await bot.terminate()
+    finally:
+        os.chdir(cwd)
+        await server.runner.cleanup()
+
+
+class SinkBot:
+    """代替 AstrBot 的 bot.send_group_msg，只记录发送次数和时间。"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.count = 0
+        self.groups: set = set()
+        self.first_at = 0.0
+        self.last_at = 0.0
+
+    async def send_group_msg(self, group_id: int, message: str) -> None:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        now = time.perf_counter()
+        if not self.count:
+            self.first_at = now
+        self.last_at = now
+        self.count += 1
+        self.groups.add(group_id)
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1048576
+    except Exception:
+        # 非 Linux 退化为峰值 RSS（macOS 单位是字节）
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1048576 if sys.platform == "darwin" else peak / 1024
+
+
+async def load_run(n: int, groups: int, ticks: int, churn: float, drop: float, push_every: int, send_latency: float) -> Dict[str, Any]:
+    """一次压测：每个 tick 依次执行告警、公告和（按间隔）排行榜推送。
+
+    tick_ms/cpu_ms 包含 HTTP 拉取与 JSON 解析；messages_per_sec 是假 bot 从第一条到最后一条消息之间的平均投递速率。
+    模拟后台与插件运行在同一进程，rss 包含两者。
+    """
+    rnd = random.Random(n)
+    server = StubAdminServer(login_delay=0)
+    dashboard = synth_dashboard(n)
+    server.set_dashboard(dashboard)
+    server.bot_config = {
+        "enabled": True,
+        "groupIds": ",".join(str(700000 + g) for g in range(groups)),
+        "wsEnabled": False,
+        # 压测关注插件自身吞吐，放开按群限速
+        "groupRatePerMin": 6000,
+        "groupBurst": 100,
+        "alertMergeWindowSec": 0.5,
+    }
+    await server.start()
+    cwd = os.getcwd()
+    tmp = tempfile.mkdtemp(prefix="farm-rank-bot-")
+    os.chdir(tmp)
+    sink = SinkBot(send_latency)
+    try:
+        bot = FarmRankBot(SimpleNamespace(bot=sink))
+        bot._running = False
+        bot._primary.api_url = server.url
+        await bot.sync_settings()
+        # 首个 tick 建立基线（全量索引/榜单/告警签名），不计入统计
+        t0 = time.perf_counter()
+        await bot._job_alerts()
+        warmup_ms = (time.perf_counter() - t0) * 1000
+        rss_start = _rss_mb()
+
+        tick_ms: List[float] = []
+        cpu_ms: List[float] = []
+        for tick in range(ticks):
+            churn_dashboard(dashboard, rnd, churn, drop)
+            server.set_dashboard(dashboard)
+            w0 = time.perf_counter()
+            c0 = time.process_time()
+            await bot._job_alerts()
+            await bot._check_announcement()
+            if push_every and tick % push_every == 0:
+                await bot._job_rank_push()
+            cpu_ms.append((time.process_time() - c0) * 1000)
+            tick_ms.append((time.perf_counter() - w0) * 1000)
+            await asyncio.sleep(0)
+
+        render_ms: Dict[str, float] = {}
+        for name in ("level", "level_online", "runtime", "gold", "exp", "online", "window:86400"):
+            r0 = time.perf_counter()
+            for _ in range(20):
+                bot._build_rank(name)
+            render_ms[name] = round((time.perf_counter() - r0) * 1000 / 20, 3)
+
+        # 等发送队列清空后计算吞吐
+        deadline = time.time() + 60
+        while bot._dispatcher.depth and time.time() < deadline:
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(0.6)
+        span = max(1e-6, sink.last_at - sink.first_at)
+        result = {
+            "accounts": n,
+            "groups": groups,
+            "ticks": ticks,
+            "warmup_ms": round(warmup_ms, 2),
+            "tick_ms_p50": round(_percentile(tick_ms, 0.5), 2),
+            "tick_ms_p95": round(_percentile(tick_ms, 0.95), 2),
+            "tick_ms_max": round(max(tick_ms), 2),
+            "cpu_ms_per_tick": round(sum(cpu_ms) / len(cpu_ms), 2),
+            "rss_mb": round(_rss_mb(), 1),
+            "rss_growth_mb": round(_rss_mb() - rss_start, 1),
+            "messages": sink.count,
+            "messages_per_sec": round(sink.count / span, 1) if sink.count > 1 else 0.0,
+            "send_failed": bot._dispatcher.stats["failed"],
+            "render_ms": render_ms,
+            "dashboard_kb": round(len(server.dashboard_body or b"") / 1024, 1),
+        }
+        await bot.terminate()
+        return result
+    finally:
+        os.chdir(cwd)
+        await server.runner.cleanup()
+
+
+async def lag_run(n: int, mode: str, ticks: int, churn: float, drop: float, interval: float) -> Dict[str, Any]:
+    """一次事件循环延迟测量：探针协程每 interval 秒 sleep 一次，记录实际醒来比预期晚了多少。
+
+    所有 tick 的响应体预先序列化，模拟后台的 JSON 编码不落在测量区间内；tick 之间留出空闲，
+    延迟分布同时覆盖忙与闲的时段，与插件在 AstrBot 中和其它处理器共享事件循环的情形一致。
+    """
+    rnd = random.Random(n)
+    server = StubAdminServer(login_delay=0)
+    dashboard = synth_dashboard(n)
+    bodies = []
+    for _ in range(ticks + 1):
+        server.set_dashboard(dashboard)
+        bodies.append(server.dashboard_body)
+        churn_dashboard(dashboard, rnd, churn, drop)
+    server.dashboard_body = bodies[0]
+    server.bot_config = {
+        "enabled": True,
+        "groupIds": "700000",
+        "wsEnabled": False,
+        "snapshotExecutor": "" if mode == "inline" else mode,
+        "groupRatePerMin": 6000,
+        "groupBurst": 100,
+    }
+    await server.start()
+    cwd = os.getcwd()
+    tmp = tempfile.mkdtemp(prefix="farm-rank-bot-")
+    os.chdir(tmp)
+    try:
+        bot = FarmRankBot(SimpleNamespace(bot=SinkBot()))
+        bot._running = False
+        bot._primary.api_url = server.url
+        await bot.sync_settings()
+        # 预热：建立基线，process 模式顺带启动子进程
+        await bot._job_alerts()
+
+        lags: List[float] = []
+        stop = asyncio.Event()
+
+        async def probe() -> None:
+            while not stop.is_set():
+                t0 = time.perf_counter()
+                await asyncio.sleep(interval)
+                lags.append(max(0.0, time.perf_counter() - t0 - interval) * 1000)
+
+        # 记录完整回收（第 2 代）的停顿：它会同时暂停所有线程，工作线程无法消除
+        gc_pauses: List[float] = []
+        gc_started = [0.0]
+
+        def on_gc(phase: str, info: Dict[str, Any]) -> None:
+            if phase == "start":
+                gc_started[0] = time.perf_counter()
+            elif info.get("generation") == 2:
+                gc_pauses.append((time.perf_counter() - gc_started[0]) * 1000)
+
+        gc.callbacks.append(on_gc)
+        task = asyncio.ensure_future(probe())
+        tick_ms: List[float] = []
+        c0 = time.process_time()
+        for body in bodies[1:]:
+            server.dashboard_body = body
+            w0 = time.perf_counter()
+            await bot._job_alerts()
+            tick_ms.append((time.perf_counter() - w0) * 1000)
+            await asyncio.sleep(0.05)
+        cpu_ms = (time.process_time() - c0) * 1000 / ticks
+        stop.set()
+        await task
+        gc.callbacks.remove(on_gc)
+        ingest = bot._metrics.histogram("farm_ingest_ms")
+        result = {
+            "mode": mode,
+            "accounts": n,
+            "lag_ms_p50": round(_percentile(lags, 0.5), 2),
+            "lag_ms_p99": round(_percentile(lags, 0.99), 2),
+            "lag_ms_max": round(max(lags), 2),
+            "tick_ms_p50": round(_percentile(tick_ms, 0.5), 2),
+            "loop_cpu_ms_per_tick": round(cpu_ms, 2),
+            "ingest_ms_p95": round(ingest.quantile(0.95), 2),
+            "gc_full_max_ms": round(max(gc_pauses, default=0.0), 2),
+        }
+        await bot.terminate()
+        return result
+    finally:
+        os.chdir(cwd)
+        await server.runner.cleanup()
+
+
+def bench_lag(args: argparse.Namespace) -> None:
+    print(
+        f"{'accounts':>9} {'mode':>8} {'lag p50':>9} {'lag p99':>9} {'lag max':>9} "
+        f"{'tick p50':>9} {'cpu/tick':>9} {'gc max':>9}"
+    )
+    for n in [int(x) for x in args.accounts.split(",") if x]:
+        for mode in [m for m in args.modes.split(",") if m]:
+            r = asyncio.run(lag_run(n, mode, args.ticks, args.churn, args.drop, args.interval))
+            print(
+                f"{n:>9} {mode:>8} {r['lag_ms_p50']:>6.1f} ms {r['lag_ms_p99']:>6.1f} ms {r['lag_ms_max']:>6.1f} ms "
+                f"{r['tick_ms_p50']:>6.0f} ms {r['loop_cpu_ms_per_tick']:>6.0f} ms {r['gc_full_max_ms']:>6.0f} ms"
+            )
+    print("cpu/tick 只统计主进程（process 模式下子进程的解析耗时不在其中）；gc max 为最长的一次完整回收停顿")
+
+
+SOAK_PARK_MAX_TICKS = 288
+
+
+def soak_churn(
+    dashboard: Dict[str, Any], parked: List[Tuple[int, Dict[str, Any]]], rnd: random.Random,
+    tick: int, next_id: int, replace: float,
+) -> int:
+    """一个 tick 的账号流转：删号换新（部分新号没有 id，走 gid- 回退 key）、换绑卡密、
+    临时下架 6~SOAK_PARK_MAX_TICKS 个 tick 后再回来、掉线原因里带随机 IP。返回下一个可用账号编号。"""
+    cards = dashboard["cards"]
+    owned = [(card, acc) for card in cards for acc in card["accounts"]]
+    k = max(1, int(len(owned) * replace))
+    for card, acc in rnd.sample(owned, k):
+        card["accounts"].remove(acc)
+        if rnd.random() < 0.2:
+            parked.append((tick + rnd.randint(6, SOAK_PARK_MAX_TICKS), acc))
+            continue
+        new = synth_account(next_id, rnd)
+        next_id += 1
+        if rnd.random() < 0.3:
+            new["id"] = ""
+        new["status"], new["statusReason"] = "offline", rnd.choice(STATUS_REASON_CORPUS[1:])
+        rnd.choice(cards)["accounts"].append(new)
+    for due, acc in [p for p in parked if p[0] <= tick]:
+        parked.remove((due, acc))
+        rnd.choice(cards)["accounts"].append(acc)
+    for card, acc in rnd.sample(owned, k):
+        if acc in card["accounts"]:
+            card["accounts"].remove(acc)
+            rnd.choice(cards)["accounts"].append(acc)
+    for _, acc in rnd.sample(owned, k * 3):
+        if acc["status"] == "online":
+            acc["status"] = "offline"
+            acc["statusReason"] = rnd.choice(STATUS_REASON_CORPUS[1:] + [f"connect ETIMEDOUT 10.{rnd.randrange(256)}.{rnd.randrange(256)}.1:443"])
+        else:
+            acc["status"], acc["statusReason"] = "online", ""
+    return next_id
+
+
+def _dict_bytes(d: Dict[Any, Any]) -> int:
+    """dict 本身加上键、值对象的大小；多个条目共用的对象（如同一个签名摘要）只算一次。"""
+    seen: set = set()
+    total = sys.getsizeof(d)
+    for k, v in d.items():
+        for obj in (k, v):
+            if id(obj) not in seen:
+                seen.add(id(obj))
+                total += sys.getsizeof(obj)
+    return total
+
+
+async def bench_soak(n: int, days: int, step_min: int, replace: float, ttl_days: float) -> None:
+    """长时间账号流转下告警去重状态的规模：旧实现（普通 dict，永不删除）vs AlertDedup。
+
+    同一批快照上并行模拟两个参照：旧实现，以及按 TTL 语义的参照（账号消失满 ttl 后再回来视为新账号）。
+    AlertDedup 的“签名变化需告警”次数必须与 TTL 参照逐次一致，与旧实现的差值就是超过 TTL 后回来的重新告警。
+    TTL 窗口过后去重表不能超过“在场账号 + TTL 内消失的账号”，且逐日规模保持平稳。
+    """
+    rnd = random.Random(n)
+    dashboard = synth_dashboard(n)
+    parked: List[Tuple[int, Dict[str, Any]]] = []
+    cwd = os.getcwd()
+    tmp = tempfile.mkdtemp(prefix="farm-rank-bot-")
+    os.chdir(tmp)
+    try:
+        bot = FarmRankBot(SimpleNamespace(bot=SinkBot()))
+        bot._running = False
+        bot.cfg = {"groupIds": "1", "alertDedupTtlSec": ttl_days * 86400, "historyEnabled": False}
+        bot._alert_dedup.configure(bot.merged_cfg())
+
+        async def discard(group_id: int, text: str, merge: bool = False) -> None:
+            return None
+
+        bot.send_group_msg = discard
+        dedup = bot._alert_dedup
+        new_alerts = [0]
+        check = dedup.check
+
+        def counted(key: str, sig: str) -> bool:
+            fresh = check(key, sig)
+            new_alerts[0] += fresh
+            return fresh
+
+        dedup.check = counted
+        legacy: Dict[str, str] = {}
+        legacy_alerts = 0
+        ttl_sec = dedup.ttl_sec
+        reference: Dict[str, str] = {}
+        reference_alerts = 0
+        gone_at: Dict[str, float] = {}
+        expired: set = set()
+        present_prev: set = set()
+        realerts = 0
+        # 下架最久的账号回来、再过一个 TTL 后去重表应进入稳态
+        settled_day = math.ceil((ttl_sec + SOAK_PARK_MAX_TICKS * step_min * 60) / 86400)
+        settled_sizes: List[int] = []
+        ticks_per_day = 86400 // (step_min * 60)
+        now = 1_700_000_000.0
+        next_id = n
+        print(f"{'day':>4} {'accounts':>9} {'legacy keys':>12} {'legacy KB':>10} {'dedup keys':>11} {'dedup KB':>9} {'pending':>8} {'evicted':>8}")
+        for tick in range(days * ticks_per_day + 1):
+            next_id = soak_churn(dashboard, parked, rnd, tick, next_id, replace)
+            snapshot = {"cards": dashboard["cards"], "unboundAccounts": []}
+            await bot._check_alerts(snapshot, now=now)
+            present = {rec.key for rec in bot._index.records}
+            for key in present_prev - present:
+                gone_at[key] = now
+            for key in [k for k in gone_at if k in present]:
+                if now - gone_at.pop(key) >= ttl_sec:
+                    reference.pop(key, None)
+                    realerts += 1
+            for key in [k for k in expired if k in present]:
+                expired.discard(key)
+                realerts += 1
+            for key in [k for k, at in gone_at.items() if now - at >= ttl_sec]:
+                del gone_at[key]
+                expired.add(key)
+                reference.pop(key, None)
+            present_prev = present
+            for rec in bot._index.records:
+                if not rec.reason and rec.online:
+                    continue
+                sig = f"{rec.status}|{rec.reason}"
+                if legacy.get(rec.key) != sig:
+                    legacy[rec.key] = sig
+                    legacy_alerts += 1
+                if reference.get(rec.key) != sig:
+                    reference[rec.key] = sig
+                    reference_alerts += 1
+            # 去重表只能包含在场账号和 TTL 内消失的账号
+            assert len(dedup) <= len(present) + len(gone_at), (tick, len(dedup), len(present), len(gone_at))
+            if tick % ticks_per_day == 0:
+                bot._state.flush()
+                dedup_kb = (_dict_bytes(dedup._sigs) + _dict_bytes(dedup._gone)) / 1024
+                print(
+                    f"{tick // ticks_per_day:>4} {len(bot._index.records):>9} {len(legacy):>12} {_dict_bytes(legacy) / 1024:>10.0f} "
+                    f"{len(dedup):>11} {dedup_kb:>9.0f} {dedup.gone:>8} {dedup.evicted:>8}"
+                )
+                if tick // ticks_per_day >= settled_day:
+                    settled_sizes.append(len(dedup))
+            now += step_min * 60
+        rows = bot._state._db.execute("SELECT COUNT(*) FROM alert_sig").fetchone()[0]
+        print(
+            f"alerts by signature change: legacy {legacy_alerts}, TTL reference {reference_alerts} "
+            f"({realerts} accounts back after >{ttl_sec / 86400:g}d), AlertDedup {new_alerts[0]}"
+        )
+        print(f"persisted alert_sig rows: {rows}")
+        assert reference_alerts == new_alerts[0], "dedup decisions differ from the TTL reference"
+        if len(settled_sizes) >= 2:
+            # 稳态：TTL 窗口之后不再随天数增长（允许流转带来的日间波动）
+            assert max(settled_sizes) <= min(settled_sizes) * 1.25, f"dedup keeps growing: {settled_sizes}"
+            print(f"dedup keys from day {settled_day}: {min(settled_sizes)}..{max(settled_sizes)} (flat)")
+        else:
+            print(f"run longer than {settled_day + 1} days to check the steady state")
+        await bot.terminate()
+    finally:
+        os.chdir(cwd)
+
+
+def _snapshot_digest(dashboard: Dict[str, Any]) -> str:
+    return hashlib.sha1(json.dumps(dashboard, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+async def bench_record(n: int, ticks: int, churn: float, drop: float, interval: float, out_dir: str) -> None:
+    """合成流量写一段录制：事件循环侧 record() 的开销、后台线程每帧的编码耗时、差分帧大小，最后读回逐帧校验。"""
+    rnd = random.Random(n)
+    dashboard = synth_dashboard(n)
+    directory = out_dir or tempfile.mkdtemp(prefix="farm-rank-rec-")
+    rec = SnapshotRecorder(directory)
+    rec.configure({"recordEnabled": True})
+    write_ms: List[float] = []
+    write = rec._write
+
+    def timed(ts: float, kind: int, stream: str, payload: Any) -> None:
+        started = time.perf_counter()
+        write(ts, kind, stream, payload)
+        if kind == 0:
+            write_ms.append((time.perf_counter() - started) * 1000)
+
+    rec._write = timed
+    now = 1_760_000_000.0
+    rec.record("settings", "", {"botConfig": {"groupIds": "1", "reportIntervalSec": 300}}, now)
+    digests: Dict[float, str] = {}
+    record_us: List[float] = []
+    for tick in range(ticks):
+        churn_dashboard(dashboard, rnd, churn, drop)
+        # 线上每次收到的都是新解析出的对象
+        snap = prune_dashboard(dashboard)
+        digests[now] = _snapshot_digest(snap)
+        started = time.perf_counter()
+        rec.record("dashboard", "", snap, now)
+        record_us.append((time.perf_counter() - started) * 1e6)
+        rec.record("announcement", "", {"enabled": True, "content": f"维护通知 {tick // 100}", "updatedAt": tick // 100, "level": "info"}, now)
+        # 以写盘速度为准，不让合成流量把队列塞满
+        while rec.depth > RECORD_QUEUE_SIZE // 2:
+            await asyncio.sleep(0.001)
+        now += interval
+    rec.close()
+    full_frame = len(farm_main.zlib.compress(_json_dumps(prune_dashboard(dashboard)), farm_main.RECORD_ZLIB_LEVEL))
+    size = sum(os.path.getsize(p) for p in recording_files(directory))
+    st = rec.stats
+    print(f"{n} accounts, {ticks} snapshots every {interval:.0f}s, {st['keyframes']} keyframe epochs, dropped {st['dropped']}")
+    print(f"record() on the loop: P50 {_percentile(record_us, 0.5):.1f}us / P99 {_percentile(record_us, 0.99):.1f}us")
+    print(f"writer per dashboard: P50 {_percentile(write_ms, 0.5):.1f}ms / P99 {_percentile(write_ms, 0.99):.1f}ms (background thread)")
+    print(f"file: {size / 1048576:.2f}MB = {size / ticks / 1024:.1f}KB per snapshot; full compressed snapshot {full_frame / 1024:.1f}KB "
+          f"({full_frame * ticks / max(1, size):.1f}x smaller)")
+
+    paths = recording_files(directory)
+    ok = total = 0
+    for ts, kind, _, payload in read_recording(paths):
+        if kind == "dashboard":
+            total += 1
+            ok += _snapshot_digest(payload) == digests.get(ts)
+    mid = sorted(digests)[ticks * 2 // 3]
+    seek_ok = any(
+        ts == mid and kind == "dashboard" and _snapshot_digest(payload) == digests[mid]
+        for ts, kind, _, payload in read_recording(paths, start=mid, end=mid)
+    )
+    print(f"read back: {ok}/{total} snapshots identical, seek to t+{mid - min(digests):.0f}s {'ok' if seek_ok else 'FAILED'}")
+    print(f"recording: {directory}")
+
+
+class ReplayClock:
+    """replay 时替换 main 模块里的 time：time() 返回录制时间，其余函数照旧。"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self) -> float:
+        return self.now
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(time, name)
+
+
+def _parse_when(text: str) -> float:
+    if not text:
+        return 0.0
+    try:
+        return float(text)
+    except ValueError:
+        fmt = "%Y-%m-%d %H:%M:%S" if text.count(":") == 2 else "%Y-%m-%d %H:%M"
+        return time.mktime(time.strptime(text, fmt))
+
+
+async def bench_replay(args: argparse.Namespace) -> None:
+    """把录制按原时间线喂给 _check_alerts / _push_random_rank / 榜单渲染，消息收进假发送端。
+
+    时钟取自录制、随机数固定种子、状态库用临时目录，同一份录制两次回放的消息摘要相同，
+    可在改动前后各跑一次比对消息（--dump）与耗时。
+    """
+    paths = recording_files(args.path) if os.path.isdir(args.path) else [args.path]
+    if not paths:
+        print(f"no recordings in {args.path}")
+        return
+    overrides: Dict[str, Any] = {"metricsPort": 0, "recordEnabled": False, "imageRankEnabled": args.images}
+    if args.groups:
+        overrides["groupIds"] = args.groups
+    clock = ReplayClock()
+    farm_main.time = clock
+    random.seed(args.seed)
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp(prefix="farm-rank-replay-"))
+    try:
+        bot = FarmRankBot(SimpleNamespace(bot=SinkBot()))
+        bot._running = False
+        sent: List[Tuple[float, int, str]] = []
+
+        async def capture(group_id: int, text: str, merge: bool = False) -> None:
+            sent.append((clock.now, group_id, text))
+
+        bot.send_group_msg = capture
+        await bot.apply_settings({"botConfig": dict(overrides)})
+        counts = {"dashboard": 0, "settings": 0, "announcement": 0, "skipped": 0}
+        ingest_ms: List[float] = []
+        alert_ms: List[float] = []
+        rank_ms: List[float] = []
+        next_push = 0.0
+        first = prev = None
+        started = time.perf_counter()
+        for ts, kind, stream, payload in read_recording(paths, _parse_when(args.start), _parse_when(args.end)):
+            if args.speed > 0 and prev is not None and ts > prev:
+                await asyncio.sleep((ts - prev) / args.speed)
+            first = ts if first is None else first
+            prev = clock.now = ts
+            if kind == "settings":
+                cfg = dict(payload.get("botConfig") or {})
+                cfg.update(overrides)
+                await bot.apply_settings({"botConfig": cfg})
+                counts[kind] += 1
+                continue
+            b = next((b for b in bot._backends if b.name == stream), None)
+            if b is None:
+                counts["skipped"] += 1
+                continue
+            counts[kind] += 1
+            if kind == "announcement":
+                await bot._handle_announcement(b, payload)
+                continue
+            b.dashboard = payload
+            b.dashboard_at = ts
+            t0 = time.perf_counter()
+            dashboard = await bot._merge_dashboards()
+            ingest_ms.append((time.perf_counter() - t0) * 1000)
+            t0 = time.perf_counter()
+            await bot._check_alerts(dashboard, now=ts)
+            alert_ms.append((time.perf_counter() - t0) * 1000)
+            if ts >= next_push:
+                next_push = ts + bot.rank_interval_sec()
+                t0 = time.perf_counter()
+                await bot._push_random_rank(dashboard)
+                for name in ("level", "runtime", "gold", "exp", "online"):
+                    bot._render(name)
+                rank_ms.append((time.perf_counter() - t0) * 1000)
+        wall = time.perf_counter() - started
+        await bot.terminate()
+    finally:
+        os.chdir(cwd)
+        farm_main.time = time
+    span = (prev - first) if first is not None else 0.0
+    print(
+        f"replayed {sum(counts.values())} frames (dashboard {counts['dashboard']} · settings {counts['settings']} · "
+        f"announcement {counts['announcement']} · unknown backend {counts['skipped']}) "
+        f"spanning {span / 3600:.2f}h in {wall:.1f}s ({span / max(wall, 1e-9):.0f}x)"
+    )
+    per_group: Dict[int, int] = {}
+    for _, gid, _ in sent:
+        per_group[gid] = per_group.get(gid, 0) + 1
+    print(f"messages: {len(sent)} " + " ".join(f"[{gid}]={c}" for gid, c in sorted(per_group.items())))
+    print(f"snapshot ingest (index + diff): P50 {_percentile(ingest_ms, 0.5):.1f}ms / P99 {_percentile(ingest_ms, 0.99):.1f}ms")
+    print(f"_check_alerts: P50 {_percentile(alert_ms, 0.5):.2f}ms / P99 {_percentile(alert_ms, 0.99):.2f}ms / max {max(alert_ms, default=0):.1f}ms")
+    print(f"rank push + all boards: P50 {_percentile(rank_ms, 0.5):.2f}ms / P99 {_percentile(rank_ms, 0.99):.2f}ms ({len(rank_ms)} pushes)")
+    digest = hashlib.sha256(json.dumps(sent, ensure_ascii=False).encode("utf-8")).hexdigest()
+    print(f"message digest: {digest[:16]}")
+    if args.dump:
+        with open(args.dump, "w", encoding="utf-8") as f:
+            for ts, gid, text in sent:
+                f.write(json.dumps({"ts": ts, "group": gid, "text": text}, ensure_ascii=False) + "\n")
+        print(f"messages written to {args.dump}")
+
+
+class PoolBot(SinkBot):
+    """发送池里的一个账号；broken=True 时每次发送都抛错（模拟风控/掉线）。"""
+
+    def __init__(self, self_id: str, latency: float = 0.0):
+        super().__init__(latency)
+        self.self_id = self_id
+        self.broken = False
+
+    async def send_group_msg(self, group_id: int, message: str) -> None:
+        if self.broken:
+            raise RuntimeError(f"{self.self_id} risk-controlled")
+        await super().send_group_msg(group_id, message)
+
+
+async def bots_run(n_bots: int, messages: int, groups: int, bot_rate: float, latency: float, faults: bool) -> Dict[str, Any]:
+    """messages 条消息均匀发往 groups 个群；faults=True 时 1/3 处让一个 bot 开始报错，2/3 处让另一个 bot 消失。"""
+    pool_bots = [PoolBot(f"qq{i + 1}", latency) for i in range(n_bots)]
+    visible = list(pool_bots)
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp(prefix="farm-rank-bot-"))
+    try:
+        bot = FarmRankBot(SimpleNamespace(get_bots=lambda: list(visible)))
+        bot._running = False
+        bot.cfg = {
+            "groupIds": ",".join(str(1000 + g) for g in range(groups)),
+            "sendConcurrency": 8,
+            "groupRatePerMin": 100000,
+            "groupBurst": 1000,
+            "botRatePerMin": bot_rate,
+            "botBurst": 5,
+        }
+        bot._dispatcher.configure(bot.merged_cfg())
+        bot._bots.configure(bot.merged_cfg())
+        pool = bot._bots
+        pool.refresh(force=True)
+        gids = bot.all_group_ids()
+        owners_before = {gid: pool.owner(gid) for gid in gids}
+        moved = 0
+        started = time.perf_counter()
+        for i in range(messages):
+            if faults and n_bots > 1 and i == messages // 3:
+                pool_bots[0].broken = True
+            if faults and n_bots > 2 and i == messages * 2 // 3:
+                visible.remove(pool_bots[1])
+                pool.refresh(force=True)
+                moved = sum(1 for gid in gids if pool.owner(gid) != owners_before[gid])
+            await bot.send_group_msg(gids[i % groups], f"msg {i}")
+            # 消息陆续到达，让故障发生在发送过程中
+            await asyncio.sleep(0)
+            if i % groups == groups - 1:
+                await asyncio.sleep(0.05)
+        d = bot._dispatcher
+        while d.depth or d._workers:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+        owned = {}
+        for gid, key in owners_before.items():
+            owned[key] = owned.get(key, 0) + 1
+        per_bot = [
+            {"bot": s.key, "groups": owned.get(s.key, 0), "sent": s.sent, "failed": s.failed, "took_over": s.took_over}
+            for s in pool.slots.values()
+        ]
+        await bot.terminate()
+    finally:
+        os.chdir(cwd)
+    return {
+        "bots": n_bots,
+        "elapsed": elapsed,
+        "delivered": sum(b.count for b in pool_bots),
+        "dropped": d.stats["failed"],
+        "retries": d.stats["retries"],
+        "p95_ms": d.latency_ms()[1],
+        "moved": moved,
+        "per_bot": per_bot,
+        "pool": dict(pool.stats),
+    }
+
+
+async def bench_bots(counts: List[int], messages: int, groups: int, bot_rate: float, latency: float) -> None:
+    print(f"{messages} messages to {groups} groups, per-bot budget {bot_rate:.0f}/min (burst 5), send latency {latency * 1000:.0f}ms")
+    for faults in (False, True):
+        print("\nfailover: bot qq1 errors from 1/3, qq2 disappears at 2/3" if faults else "throughput")
+        print(f"{'bots':>5} {'elapsed':>8} {'msg/s':>7} {'delivered':>10} {'dropped':>8} {'retries':>8} {'p95':>8} {'failovers':>10} {'spills':>7} {'moved':>6}")
+        for n in counts:
+            if faults and n < 3:
+                continue
+            r = await bots_run(n, messages, groups, bot_rate, latency, faults)
+            moved = f"{r['moved']}/{groups}" if faults else "-"
+            print(
+                f"{n:>5} {r['elapsed']:>7.2f}s {r['delivered'] / r['elapsed']:>7.1f} {r['delivered']:>10} {r['dropped']:>8} "
+                f"{r['retries']:>8} {r['p95_ms']:>6.0f}ms {r['pool']['failovers']:>10} {r['pool']['spills']:>7} {moved:>6}"
+            )
+            if n > 1:
+                print("      " + "  ".join(
+                    f"{b['bot']}: 群{b['groups']} 发{b['sent']} 败{b['failed']} 接管{b['took_over']}" for b in r["per_bot"]
+                ))
+
+
+POLL_PHASES = ("quiet", "incident", "calm", "slow", "errors")
+
+
+async def poll_run(adaptive: bool, n: int, phase_sec: float, ws: bool = False) -> List[Dict[str, Any]]:
+    """插件真实的调度器依次经历各阶段，统计每阶段的 /dashboard 请求数、平均间隔以及状态变化的发现延迟。
+
+    quiet/calm：只有收益增长；incident：每 2 秒有账号掉线/恢复；slow：/dashboard 多 1.5 秒延迟；errors：/dashboard 返回 500。
+    ws=True 时后台每秒经 WebSocket 推送快照、不再拉取 /dashboard，改为统计告警任务的执行（完整比对）次数。
+    """
+    server = StubAdminServer(login_delay=0)
+    await server.start()
+    root = server.url[: -len("/api/admin")]
+    server.bot_config = {
+        "enabled": True, "adminUrl": root, "groupIds": "1", "wsEnabled": ws,
+        "reportIntervalSec": 3600, "pollAdaptive": adaptive,
+    }
+    rnd = random.Random(7)
+    dashboard = synth_dashboard(n)
+    server.set_dashboard(dashboard)
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp(prefix="farm-rank-bot-"))
+    rows: List[Dict[str, Any]] = []
+    try:
+        bot = FarmRankBot(SimpleNamespace(bot=SinkBot()))
+        bot.api_url = bot._primary.api_url = server.url
+        # 后台状态变化的时间点 -> 插件第一次看到它的时间
+        pending: List[float] = []
+        detect: List[float] = []
+        apply_snapshot = bot._apply_snapshot
+
+        def traced(dashboard: Dict[str, Any], delta: Any, started: float) -> None:
+            if delta.status_changes and pending:
+                now = time.perf_counter()
+                detect.extend(now - t for t in pending)
+                pending.clear()
+            apply_snapshot(dashboard, delta, started)
+
+        bot._apply_snapshot = traced
+        # 等配置同步、基线快照建立
+        while bot._dashboard is None:
+            await asyncio.sleep(0.1)
+        for phase in POLL_PHASES:
+            server.dashboard_delay = 1.5 if phase == "slow" else 0.0
+            server.dashboard_down = phase == "errors"
+            job = bot._scheduler.jobs["alerts"]
+            hits = job.runs if ws else server.hits.get("dashboard", 0)
+            intervals: List[float] = []
+            detect.clear()
+            pending.clear()
+            started = time.perf_counter()
+            next_change = started
+            while time.perf_counter() - started < phase_sec:
+                now = time.perf_counter()
+                if now >= next_change:
+                    next_change = now + 2
+                    churn_dashboard(dashboard, rnd, 0.2, 0.01 if phase == "incident" else 0.0)
+                    server.set_dashboard(dashboard)
+                    if phase == "incident":
+                        pending.append(now)
+                intervals.append(bot._poll.interval())
+                await asyncio.sleep(0.25)
+            rows.append({
+                "phase": phase,
+                "requests": (job.runs if ws else server.hits.get("dashboard", 0)) - hits,
+                "interval": sum(intervals) / len(intervals),
+                "interval_end": intervals[-1],
+                "detect": (_percentile(detect, 0.5), max(detect)) if detect else None,
+            })
+        await bot.terminate()
+    finally:
+        os.chdir(cwd)
+        await server.runner.cleanup()
+    return rows
+
+
+async def bench_poll(n: int, phase_sec: float, ws: bool) -> None:
+    print(f"{n} accounts, {phase_sec:.0f}s per phase: {' -> '.join(POLL_PHASES)}" + (" (WebSocket push, req = ingests)" if ws else ""))
+    results = {mode: await poll_run(mode == "adaptive", n, phase_sec, ws) for mode in ("fixed", "adaptive")}
+    print(f"{'phase':>9} | {'fixed req':>9} {'interval':>9} {'detect p50/max':>15} | {'adaptive req':>12} {'interval':>9} {'at end':>7} {'detect p50/max':>15}")
+    totals = {"fixed": 0, "adaptive": 0}
+    for fixed, adaptive in zip(results["fixed"], results["adaptive"]):
+        totals["fixed"] += fixed["requests"]
+        totals["adaptive"] += adaptive["requests"]
+
+        def detect(row: Dict[str, Any]) -> str:
+            return f"{row['detect'][0]:.1f}s/{row['detect'][1]:.1f}s" if row["detect"] else "-"
+
+        print(
+            f"{fixed['phase']:>9} | {fixed['requests']:>9} {fixed['interval']:>8.1f}s {detect(fixed):>15} | "
+            f"{adaptive['requests']:>12} {adaptive['interval']:>8.1f}s {adaptive['interval_end']:>6.1f}s {detect(adaptive):>15}"
+        )
+    print(f"{'total':>9} | {totals['fixed']:>9} {'':>25} | {totals['adaptive']:>12}")
+
+
+CONFIG_MODES = ("poll", "conditional", "push")
+
+
+async def config_run(mode: str, duration: float, change_at: float) -> Dict[str, Any]:
+    """插件真实的调度器跑 duration 秒，change_at 秒时在后台改配置、再过 5 秒改公告，统计两个接口的请求数与生效延迟。
+
+    poll：后台不支持 ETag 也不推送事件（插件的请求节奏与改动前相同）；conditional：只有 ETag；push：ETag + WebSocket 事件。
+    """
+    server = StubAdminServer(login_delay=0)
+    server.etag = mode != "poll"
+    server.push = mode == "push"
+    await server.start()
+    root = server.url[: -len("/api/admin")]
+    # reportIntervalSec 足够长，运行期间不推送榜单
+    server.bot_config = {"enabled": True, "adminUrl": root, "groupIds": "1", "reportIntervalSec": 3600}
+    server.announcement = dict(server.announcement, enabled=True, content="欢迎", updatedAt=1)
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp(prefix="farm-rank-bot-"))
+    try:
+        bot = FarmRankBot(SimpleNamespace(bot=SinkBot()))
+        bot.api_url = bot._primary.api_url = server.url
+        started = time.perf_counter()
+        settings_at = announcement_at = None
+        changed = announced = False
+        while time.perf_counter() - started < duration:
+            await asyncio.sleep(0.02)
+            elapsed = time.perf_counter() - started
+            if not changed and elapsed >= change_at:
+                changed = time.perf_counter()
+                await server.update_settings(dict(server.bot_config, groupIds="1,2"))
+            if not announced and elapsed >= change_at + 5:
+                announced = time.perf_counter()
+                await server.update_announcement("今晚 23:00 维护")
+            if changed and settings_at is None and bot.merged_cfg().get("groupIds") == "1,2":
+                settings_at = time.perf_counter() - changed
+            if announced and announcement_at is None and bot._announcement_ts.get("", 0) > 1:
+                announcement_at = time.perf_counter() - announced
+        ws = bot._primary.ws_connected
+        await bot.terminate()
+    finally:
+        os.chdir(cwd)
+        await server.runner.cleanup()
+    hits = server.hits
+    return {
+        "mode": mode,
+        "ws": ws,
+        "settings": hits.get("settings", 0),
+        "settings_304": hits.get("settings_304", 0),
+        "announcement": hits.get("announcement", 0),
+        "announcement_304": hits.get("announcement_304", 0),
+        "settings_latency": settings_at,
+        "announcement_latency": announcement_at,
+    }
+
+
+async def bench_config(modes: List[str], duration: float, change_at: float) -> None:
+    print(f"{duration:.0f}s run, settings changed at {change_at:.0f}s, announcement at {change_at + 5:.0f}s")
+    print(f"{'mode':>12} {'ws':>3} {'settings (304)':>15} {'announcement (304)':>19} {'req/min':>8} {'settings applied':>17} {'announcement seen':>18}")
+    for mode in modes:
+        r = await config_run(mode, duration, change_at)
+        per_min = (r["settings"] + r["announcement"]) * 60 / duration
+
+        def latency(v: Optional[float]) -> str:
+            return f"{v:.2f}s" if v is not None else "not yet"
+
+        print(
+            f"{mode:>12} {'on' if r['ws'] else 'off':>3} {r['settings']:>8} ({r['settings_304']:>3}) "
+            f"{r['announcement']:>11} ({r['announcement_304']:>4}) {per_min:>8.1f} "
+            f"{latency(r['settings_latency']):>17} {latency(r['announcement_latency']):>18}"
+        )
+
+
+PARSE_MODES = ("legacy", "full", "stream")
+
+
+async def parse_child(mode: str, body_path: str, repeat: int) -> Dict[str, Any]:
+    """在独立进程中拉取并解析同一份 dashboard，测量解析期间的峰值 RSS。"""
+    server = StubAdminServer(login_delay=0)
+    with open(body_path, "rb") as f:
+        server.dashboard_body = f.read()
+    await server.start()
+    tmp = tempfile.mkdtemp(prefix="farm-rank-bot-")
+    os.chdir(tmp)
+    bot = FarmRankBot(SimpleNamespace())
+    bot._running = False
+    bot._primary.api_url = server.url
+    bot.cfg = {"streamParseEnabled": mode == "stream"}
+    token = await bot._primary.auth.get(bot._login_func(bot._primary))
+    baseline = _rss_mb()
+    kept = None
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        kept = None
+        if mode == "legacy":
+            # 旧实现：resp.json() 把完整响应（含 recentLogs 等）转成 dict 并保留
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"{server.url}/dashboard", headers={"Authorization": f"Bearer {token}"}) as resp:
+                    kept = await resp.json()
+        else:
+            kept = await bot._authed_get("/dashboard")
+    elapsed = (time.perf_counter() - t0) * 1000 / repeat
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_mb = peak / 1048576 if sys.platform == "darwin" else peak / 1024
+    accounts = len(AccountIndex(kept["data"]).records)
+    result = {
+        "mode": mode,
+        "accounts": accounts,
+        "parse_ms": round(elapsed, 1),
+        "baseline_mb": round(baseline, 1),
+        "peak_mb": round(peak_mb, 1),
+        "retained_mb": round(_rss_mb() - baseline, 1),
+    }
+    await bot.terminate()
+    await server.runner.cleanup()
+    return result
+
+
+def bench_parse(n: int, repeat: int) -> None:
+    body = json.dumps({"ok": True, "data": synth_dashboard(n)}, ensure_ascii=False).encode()
+    fd, path = tempfile.mkstemp(suffix=".json")
+    with os.fdopen(fd, "wb") as f:
+        f.write(body)
+    print(f"{n} accounts, body {len(body) / 1048576:.1f} MB, decoder: {'orjson' if _has_orjson() else 'json'}")
+    print(f"{'mode':>7} {'parse':>10} {'baseline':>9} {'peak':>9} {'peak-base':>10} {'retained':>9}")
+    try:
+        for mode in PARSE_MODES:
+            out = subprocess.check_output(
+                [sys.executable, os.path.abspath(__file__), "parse", "--child", mode, "--body", path, "--repeat", str(repeat)],
+                text=True,
+            )
+            r = json.loads(out.strip().splitlines()[-1])
+            assert r["accounts"] == n, r
+            print(
+                f"{mode:>7} {r['parse_ms']:>7.0f} ms {r['baseline_mb']:>6.0f} MB {r['peak_mb']:>6.0f} MB "
+                f"{r['peak_mb'] - r['baseline_mb']:>7.0f} MB {r['retained_mb']:>6.0f} MB"
+            )
+    finally:
+        os.unlink(path)
+
+
+def _has_orjson() -> bool:
+    try:
+        import orjson  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _git_rev() -> str:
+    try:
+        root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=root, text=True).strip()
+    except Exception:
+        return ""
+
+
+LOAD_COMPARE_KEYS = ("tick_ms_p50", "tick_ms_p95", "cpu_ms_per_tick", "rss_mb", "messages_per_sec")
+
+
+def compare_load(baseline: Dict[str, Any], current: Dict[str, Any]) -> None:
+    base = {(r["accounts"], r["groups"]): r for r in baseline.get("results", [])}
+    print(f"compare against {baseline.get('git_rev') or '?'} ({baseline.get('created_at', '')})")
+    for r in current["results"]:
+        old = base.get((r["accounts"], r["groups"]))
+        if old is None:
+            continue
+        cells = []
+        for k in LOAD_COMPARE_KEYS:
+            a, b = old.get(k) or 0, r.get(k) or 0
+            delta = f"{(b - a) * 100 / a:+.0f}%" if a else "n/a"
+            cells.append(f"{k}={b} ({delta})")
+        print(f"  {r['accounts']:>7} accounts: " + ", ".join(cells))
+
+
+async def bench_load(args: argparse.Namespace) -> Dict[str, Any]:
+    results = []
+    print(f"{'accounts':>9} {'tick p50':>9} {'tick p95':>9} {'cpu/tick':>9} {'rss':>8} {'msgs':>6} {'msgs/s':>8} {'render lvl':>11}")
+    for n in [int(x) for x in args.accounts.split(",") if x]:
+        r = await load_run(n, args.groups, args.ticks, args.churn, args.drop, args.push_every, args.send_latency)
+        results.append(r)
+        print(
+            f"{n:>9} {r['tick_ms_p50']:>6.1f} ms {r['tick_ms_p95']:>6.1f} ms {r['cpu_ms_per_tick']:>6.1f} ms "
+            f"{r['rss_mb']:>5.0f} MB {r['messages']:>6} {r['messages_per_sec']:>8.0f} {r['render_ms']['level']:>8.3f} ms"
+        )
+    return {
+        "version": 1,
+        "git_rev": _git_rev(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("cmd", "out", "compare")},
+        "results": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="FarmRankBot benchmarks")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_topk = sub.add_parser("topk", help="增量 top-K 榜单 vs 全量排序")
+    p_topk.add_argument("--sizes", default="10000,50000,100000")
+    p_topk.add_argument("--ticks", type=int, default=20)
+    p_topk.add_argument("--churn", type=float, default=0.01, help="每 tick 变化的账号比例")
+
+    p_alerts = sub.add_parser("alerts", help="告警分类引擎 vs 旧的逐账号子串扫描")
+    p_alerts.add_argument("-n", type=int, default=200000)
+
+    p_storm = sub.add_parser("storm", help="批量掉线时告警风暴合并的消息数对比")
+    p_storm.add_argument("--accounts", type=int, default=500)
+    p_storm.add_argument("--threshold", type=int, default=20)
+
+    p_auth = sub.add_parser("auth", help="并发请求下的单飞登录/续期/退避（本地模拟后台）")
+    p_auth.add_argument("--concurrency", type=int, default=50)
+
+    p_load = sub.add_parser("load", help="本地模拟后台 + 假 bot 的端到端压测，输出 JSON 结果")
+    p_load.add_argument("--accounts", default="1000,10000")
+    p_load.add_argument("--groups", type=int, default=50)
+    p_load.add_argument("--ticks", type=int, default=30)
+    p_load.add_argument("--churn", type=float, default=0.05, help="每 tick 收益变化的账号比例")
+    p_load.add_argument("--drop", type=float, default=0.001, help="每 tick 掉线/恢复的账号比例")
+    p_load.add_argument("--push-every", type=int, default=10, help="每隔多少 tick 推送一次排行榜")
+    p_load.add_argument("--send-latency", type=float, default=0.0, help="假 bot 每条消息的发送耗时（秒）")
+    p_load.add_argument("--out", help="结果写入的 JSON 文件")
+    p_load.add_argument("--compare", help="与之前保存的 JSON 结果对比")
+
+    p_parse = sub.add_parser("parse", help="/dashboard 全量解析 vs 流式裁剪解析的峰值内存")
+    p_parse.add_argument("--accounts", type=int, default=50000)
+    p_parse.add_argument("--repeat", type=int, default=3)
+    p_parse.add_argument("--child", choices=PARSE_MODES, help=argparse.SUPPRESS)
+    p_parse.add_argument("--body", help=argparse.SUPPRESS)
+
+    p_lag = sub.add_parser("lag", help="快照处理在事件循环内 / 工作线程 / 工作进程时的事件循环延迟")
+    p_lag.add_argument("--accounts", default="5000,20000")
+    p_lag.add_argument("--modes", default="inline,thread,process")
+    p_lag.add_argument("--ticks", type=int, default=10)
+    p_lag.add_argument("--churn", type=float, default=0.05)
+    p_lag.add_argument("--drop", type=float, default=0.001)
+    p_lag.add_argument("--interval", type=float, default=0.005, help="探针的 sleep 间隔（秒）")
+
+    p_soak = sub.add_parser("soak", help="数周账号流转下告警去重状态的内存：旧 dict vs AlertDedup")
+    p_soak.add_argument("--accounts", type=int, default=3000)
+    p_soak.add_argument("--days", type=int, default=28)
+    p_soak.add_argument("--step-min", type=int, default=10, help="模拟的 tick 间隔（分钟）")
+    p_soak.add_argument("--replace", type=float, default=0.002, help="每 tick 删号/换绑的账号比例")
+    p_soak.add_argument("--ttl-days", type=float, default=3.0)
+
+    p_config = sub.add_parser("config", help="配置/公告：固定轮询 vs 条件请求 vs WebSocket 变更事件的请求数与生效延迟")
+    p_config.add_argument("--modes", default=",".join(CONFIG_MODES))
+    p_config.add_argument("--duration", type=float, default=60.0)
+    p_config.add_argument("--change-at", type=float, default=15.0)
+
+    p_bots = sub.add_parser("bots", help="多 bot 发送池：单账号 vs 一致性哈希分片的吞吐，以及账号报错/消失时的顺延")
+    p_bots.add_argument("--bots", default="1,4")
+    p_bots.add_argument("--messages", type=int, default=300)
+    p_bots.add_argument("--groups", type=int, default=30)
+    p_bots.add_argument("--bot-rate", type=float, default=1200.0, help="每个 bot 每分钟发送额度")
+    p_bots.add_argument("--send-latency", type=float, default=0.02)
+
+    p_poll = sub.add_parser("poll", help="告警轮询：固定 2 秒 vs 按状态变化/后台延迟自适应的请求数与发现延迟")
+    p_poll.add_argument("--accounts", type=int, default=300)
+    p_poll.add_argument("--phase-sec", type=float, default=20.0)
+    p_poll.add_argument("--ws", action="store_true", help="后台经 WebSocket 推送快照，统计告警任务的执行次数")
+
+    p_record = sub.add_parser("record", help="快照录制的开销、差分帧大小与读回校验（合成流量）")
+    p_record.add_argument("--accounts", type=int, default=20000)
+    p_record.add_argument("--ticks", type=int, default=300)
+    p_record.add_argument("--churn", type=float, default=0.05)
+    p_record.add_argument("--drop", type=float, default=0.002)
+    p_record.add_argument("--interval", type=float, default=2.0, help="快照间隔（秒，录制时间）")
+    p_record.add_argument("--out", default="", help="录制目录，默认临时目录")
+
+    p_replay = sub.add_parser("replay", help="按录制的时间线回放告警/榜单推送，消息收进假发送端")
+    p_replay.add_argument("path", help="录制目录或单个 .frr 文件")
+    p_replay.add_argument("--from", dest="start", default="", help="起始时间：时间戳或 \"YYYY-mm-dd HH:MM[:SS]\"")
+    p_replay.add_argument("--to", dest="end", default="")
+    p_replay.add_argument("--speed", type=float, default=0, help="回放倍速，0 为不等待")
+    p_replay.add_argument("--seed", type=int, default=1)
+    p_replay.add_argument("--groups", default="", help="覆盖录制配置里的 groupIds")
+    p_replay.add_argument("--images", action="store_true", help="保留图片榜单（页脚含当前时间，消息摘要不再稳定）")
+    p_replay.add_argument("--dump", default="", help="把发出的消息逐行写成 JSON")
+
+    args = parser.parse_args()
+    if args.cmd == "topk":
+        bench_topk([int(x) for x in args.sizes.split(",") if x], args.ticks, args.churn)
+    elif args.cmd == "alerts":
+        bench_alerts(args.n)
+    elif args.cmd == "storm":
+        bench_storm(args.accounts, args.threshold)
+    elif args.cmd == "auth":
+        asyncio.run(bench_auth(args.concurrency))
+    elif args.cmd == "parse":
+        if args.child:
+            print(json.dumps(asyncio.run(parse_child(args.child, args.body, args.repeat))))
+        else:
+            bench_parse(args.accounts, args.repeat)
+    elif args.cmd == "config":
+        asyncio.run(bench_config([m for m in args.modes.split(",") if m], args.duration, args.change_at))
+    elif args.cmd == "bots":
+        asyncio.run(bench_bots([int(x) for x in args.bots.split(",") if x], args.messages, args.groups, args.bot_rate, args.send_latency))
+    elif args.cmd == "poll":
+        asyncio.run(bench_poll(args.accounts, args.phase_sec, args.ws))
+    elif args.cmd == "record":
+        asyncio.run(bench_record(args.accounts, args.ticks, args.churn, args.drop, args.interval, args.out))
+    elif args.cmd == "replay":
+        asyncio.run(bench_replay(args))
+    elif args.cmd == "soak":
+        asyncio.run(bench_soak(args.accounts, args.days, args.step_min, args.replace, args.ttl_days))
+    elif args.cmd == "lag":
+        bench_lag(args)
+    elif args.cmd == "load":
+        report = asyncio.run(bench_load(args))
+        if args.compare:
+            with open(args.compare, encoding="utf-8") as f:
+                compare_load(json.load(f), report)
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            print(f"results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 import type { IncomingMessage, ServerResponse } from 'node:http'
-import { readBody, resolveUploadRoot, normalizeLineBreaks } from '../utils.js'
+import { readBody, resolveUploadRoot, normalizeLineBreaks, sendJsonWithEtag } from '../utils.js'
 import { loadSystemSettings, saveSystemSettings } from '../../api/system-store.js'
 import { loadCardDb } from '../../api/card-store.js'
 import { join } from 'node:path'
@@ -9,8 +9,7 @@ export async function handleSettingsGet(req: IncomingMessage, res: ServerRespons
     const settings = loadSystemSettings()
     settings.noticeCardLogin = normalizeLineBreaks(settings.noticeCardLogin)
     settings.noticeAppLogin = normalizeLineBreaks(settings.noticeAppLogin)
-    res.setHeader('Content-Type', 'application/json')
-    res.end(JSON.stringify({ ok: true, data: settings }))
+    sendJsonWithEtag(req, res, { ok: true, data: settings })
 }
 
 export async function handleSettingsPost(req: IncomingMessage, res: ServerResponse) {
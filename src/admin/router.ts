@@ -1,7 +1,7 @@
 import type { IncomingMessage, ServerResponse } from 'node:http'
 import { URL } from 'node:url'
 import { config } from '../config/index.js'
-import { readBody } from './utils.js'
+import { readBody, sendJsonWithEtag } from './utils.js'
 import { checkRateLimit, randomDelay } from '../utils/rate-limit.js'
 import { createAdminSession, verifyAdminToken } from './auth.js'
 import { getAgentByUsername, verifyAgentPassword } from '../api/agent-store.js'
@@ -89,9 +89,10 @@ export async function handleAdminRequest(req: IncomingMessage, res: ServerRespon
 
     // Dashboard
     if (path === '/dashboard' && req.method === 'GET') {
-        res.setHeader('Content-Type', 'application/json')
         const data = await buildDashboardData(session)
-        res.end(JSON.stringify({ ok: true, data }))
+        // 在线账号的 runtimeSec 每秒都在变，有账号在线时 ETag 基本不会命中，304 只出现在全部离线时；
+        // runtimeSec 不能从 ETag 输入中去掉，否则命中 304 的客户端会一直拿着旧的运行时长
+        sendJsonWithEtag(req, res, { ok: true, data })
         return
     }
 
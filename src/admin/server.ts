@@ -12,7 +12,7 @@ import { getSessions, removeAccount, getSession } from '../core/account.js'
 import { ProxyPool } from '../core/proxy-pool.js'
 import { accountStore, getSessionStore } from '../store/index.js'
 import { loadCardDb, saveCardDb, updateCard } from '../api/card-store.js'
-import { loadSystemSettings, saveSystemSettings } from '../api/system-store.js'
+import { loadSystemSettings, saveSystemSettings, setSystemChangeCallback } from '../api/system-store.js'
 import { Socks5Client } from '../utils/socks5.js'
 import { log } from '../utils/logger.js'
 import {
@@ -615,7 +615,8 @@ export function startAdminServer(): void {
                     if (verifyAdminToken(token)) {
                         ; (ws as any).data = { authed: true }
                         adminClients.add(ws)
-                        ws.send(JSON.stringify({ type: 'auth_ok' }))
+                        // events：本连接会推送的消息类型，机器人据此停止轮询配置/公告
+                        ws.send(JSON.stringify({ type: 'auth_ok', events: ['snapshot', 'alert', 'settings', 'announcement'] }))
 
                         // Send initial snapshot
                         const dashboard = buildDashboardData()
@@ -664,3 +665,4 @@ function wsBroadcastLog(entry: LogEntry) {
 }
 
 setLogBroadcastCallback(wsBroadcastLog)
+setSystemChangeCallback((kind) => wsBroadcast({ type: kind, ts: Date.now() }))
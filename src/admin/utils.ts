@@ -1,4 +1,5 @@
-import type { IncomingMessage } from 'node:http'
+import type { IncomingMessage, ServerResponse } from 'node:http'
+import { createHash } from 'node:crypto'
 import { join } from 'node:path'
 import { existsSync } from 'node:fs'
 
@@ -45,3 +46,18 @@ export function resolveUploadRoot(): string {
 export function normalizeLineBreaks(text: unknown): string {
     return String(text || '').replace(/\r\n/g, '\n').replace(/\\n/g, '\n')
 }
+
+// 带弱 ETag 的 JSON 响应：客户端携带相同 If-None-Match 时返回 304，省去传输与解析
+export function sendJsonWithEtag(req: IncomingMessage, res: ServerResponse, payload: unknown): void {
+    const body = JSON.stringify(payload)
+    const etag = `W/"${createHash('sha1').update(body).digest('base64url')}"`
+    res.setHeader('ETag', etag)
+    res.setHeader('Cache-Control', 'no-cache')
+    if (req.headers['if-none-match'] === etag) {
+        res.statusCode = 304
+        res.end()
+        return
+    }
+    res.setHeader('Content-Type', 'application/json')
+    res.end(body)
+}
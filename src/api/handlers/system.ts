@@ -1,3 +1,4 @@
+import { createHash } from 'node:crypto'
 import { connect as tlsConnect } from 'node:tls'
 import { getAllPlants } from '../../config/game-data.js'
 import { config, versionData } from '../../config/index.js'
@@ -147,7 +148,14 @@ export async function handleSystemSettings(): Promise<Response> {
   return Response.json({ ok: true, data: publicData })
 }
 
-export async function handleSystemAnnouncement(): Promise<Response> {
+// 带弱 ETag：机器人按 2 秒轮询，内容未变化时返回 304
+export async function handleSystemAnnouncement(_body: unknown, req: Request): Promise<Response> {
   const data = await loadAnnouncement()
-  return Response.json({ ok: true, data })
+  const body = JSON.stringify({ ok: true, data })
+  const etag = `W/"${createHash('sha1').update(body).digest('base64url')}"`
+  const headers = { ETag: etag, 'Cache-Control': 'no-cache' }
+  if (req.headers.get('if-none-match') === etag) {
+    return new Response(null, { status: 304, headers })
+  }
+  return new Response(body, { headers: { ...headers, 'Content-Type': 'application/json' } })
 }
@@ -13,6 +13,20 @@ export type Announcement = {
 
 let cachedAnnouncement: Announcement | null = null
 
+// 配置/公告写入后通知管理端 WebSocket（由 admin/server.ts 注册），机器人据此立即拉取
+export type SystemChangeKind = 'settings' | 'announcement'
+let changeCallback: ((kind: SystemChangeKind) => void) | null = null
+
+export function setSystemChangeCallback(fn: (kind: SystemChangeKind) => void): void {
+  changeCallback = fn
+}
+
+function notifyChange(kind: SystemChangeKind): void {
+  try {
+    changeCallback?.(kind)
+  } catch { }
+}
+
 function getDefaultAnnouncement(): Announcement {
   return {
     id: 'default',
@@ -54,6 +68,7 @@ export async function saveAnnouncement(data: Partial<Announcement>): Promise<Ann
 
   await fs.writeFile(ANNOUNCEMENT_FILE, JSON.stringify(next, null, 2), 'utf8')
   cachedAnnouncement = next
+  notifyChange('announcement')
   return next
 }
 
@@ -111,5 +126,6 @@ export function saveSystemSettings(partial: Partial<SystemSettings>): SystemSett
 
   writeFileSync(SETTINGS_FILE, JSON.stringify(next, null, 2), 'utf8')
   cachedSettings = next
+  notifyChange('settings')
   return next
 }